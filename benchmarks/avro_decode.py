@@ -0,0 +1,99 @@
+"""
+Compare the Avro engines: records decoded by fastavro into dicts then converted with RecordBatch.from_pylist,
+against the columnar decoder building Arrow arrays directly, see data_tools.utils.avro_columnar.
+
+Blocks are decompressed up front, so that "decode" times decoding alone; "read" times a whole
+to_record_batch_reader pass with each engine. Peak memory is the peak of Python allocations traced
+by tracemalloc, in a separate untimed run.
+
+    python benchmarks/avro_decode.py --rows 1000000 --columns name age
+"""
+import argparse
+import io
+import itertools
+import os
+import tempfile
+import timeit
+import tracemalloc
+from pathlib import Path
+
+import fastavro
+import pyarrow as pa
+
+from data_tools.utils import avro_columnar
+from data_tools.utils.avro import AvroUtils
+from data_tools.utils.avro_arrow import avro_to_arrow_schema
+from data_tools.utils.avro_blocks import encode_long, iter_blocks, read_header, read_payload
+from data_tools.utils.avro_schema import project_schema
+from data_tools.utils.fileio import open_input
+
+SCHEMA_PATH = Path(__file__).resolve().parent.parent / "tests" / "sample_schema.avsc"
+
+
+def decode_fastavro(header, payloads, batch_size, columns):
+    reader_schema = project_schema(header.schema, columns) if columns else None
+    schema = avro_to_arrow_schema(reader_schema or header.schema)
+    # The payloads as a container of the null codec, the header is written by fastavro for the same schema
+    stream = io.BytesIO()
+    fastavro.writer(stream, header.schema, [], codec="null", sync_marker=header.sync)
+    for num_records, data in payloads:
+        stream.write(b"".join([encode_long(num_records), encode_long(len(data)), data, header.sync]))
+    stream.seek(0)
+    records = fastavro.reader(stream, reader_schema)
+    while batch := list(itertools.islice(records, batch_size)):
+        pa.RecordBatch.from_pylist(batch, schema=schema)
+
+
+def decode_columnar(header, payloads, batch_size, columns):
+    for _ in avro_columnar.iter_batches(payloads, header.schema, batch_size, columns):
+        pass
+
+
+def read(engine, file_path, batch_size, columns):
+    os.environ[avro_columnar.ENGINE_ENV] = engine
+    AvroUtils.to_record_batch_reader(file_path, batch_size, columns=columns).read_all()
+
+
+def measure(function, repeat):
+    seconds = min(timeit.repeat(function, number=1, repeat=repeat))
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=65536)
+    parser.add_argument("--codecs", nargs="+", default=["deflate", "snappy"])
+    parser.add_argument("--columns", nargs="+")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for codec in args.codecs:
+            file_path = Path(tmpdir) / f"bench-{codec}.avro"
+            AvroUtils.create_sample(file_path, SCHEMA_PATH, args.rows, codec, seed=0, columnar=True)
+            with open_input(file_path) as f:
+                header = read_header(f)
+                payloads = [read_payload(f, header, block) for block in iter_blocks(f, header)]
+            print(f"{codec}: {file_path.stat().st_size} bytes, {args.rows} rows, columns: {args.columns or 'all'}")
+
+            for name, functions in {
+                "decode": {engine: lambda decode=decode: decode(header, payloads, args.batch_size, args.columns)
+                           for engine, decode in (("fastavro", decode_fastavro), ("columnar", decode_columnar))},
+                "read": {engine: lambda engine=engine: read(engine, file_path, args.batch_size, args.columns)
+                         for engine in ("fastavro", "columnar")},
+            }.items():
+                timings = {engine: measure(function, args.repeat) for engine, function in functions.items()}
+                baseline_seconds, baseline_peak = timings["fastavro"]
+                for engine, (seconds, peak) in timings.items():
+                    print(f"  {name:<7} {engine:<9} {seconds:8.3f}s {args.rows / seconds:12.0f} rows/s"
+                          f"  x{baseline_seconds / seconds:5.2f}  peak {peak / 2 ** 20:8.1f} MiB"
+                          f"  x{baseline_peak / peak:5.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Measure how Avro decoding scales with the number of worker processes.
+
+    python benchmarks/avro_parallel.py --rows 1000000 --jobs 1 2 4 8
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import timeit
+from pathlib import Path
+
+from data_tools.utils.avro import AvroUtils
+
+SCHEMA_PATH = Path(__file__).resolve().parent.parent / "tests" / "sample_schema.avsc"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--codecs", nargs="+", default=["deflate", "snappy"])
+    parser.add_argument("--jobs", type=int, nargs="+", default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for codec in args.codecs:
+            file_path = Path(tmpdir) / f"bench-{codec}.avro"
+            AvroUtils.create_sample(file_path, SCHEMA_PATH, args.rows, codec, seed=0, columnar=True)
+            print(f"{codec}: {file_path.stat().st_size} bytes, {args.rows} rows")
+
+            baseline = None
+            for jobs in args.jobs:
+                start_time = timeit.default_timer()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    AvroUtils.stats(file_path, jobs=jobs)
+                elapsed = timeit.default_timer() - start_time
+                baseline = baseline or elapsed
+                print(f"  jobs={jobs:<3} {elapsed:8.3f}s  {args.rows / elapsed:12.0f} rows/s"
+                      f"  x{baseline / elapsed:.2f}")
+
+
+if __name__ == "__main__":
+    main()
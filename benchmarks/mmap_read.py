@@ -0,0 +1,83 @@
+"""
+Compare buffered and memory-mapped reads, with the file evicted from the page cache (cold) or not (warm).
+
+Files are evicted with posix_fadvise(POSIX_FADV_DONTNEED), so cold runs need Linux.
+
+    python benchmarks/mmap_read.py --rows 1000000
+"""
+import argparse
+import contextlib
+import os
+import tempfile
+import timeit
+from pathlib import Path
+
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+from data_tools.utils.avro import AvroUtils
+from data_tools.utils.csv import CsvUtils
+from data_tools.utils.fileio import MMAP_ENV
+from data_tools.utils.parquet import ParquetUtils
+
+SCHEMA_PATH = Path(__file__).resolve().parent.parent / "tests" / "sample_schema.avsc"
+
+
+def evict(file_path: Path) -> None:
+    with open(file_path, "rb") as f:
+        os.fsync(f.fileno())
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def measure(function, file_path: Path, mmap: bool, cold: bool) -> float:
+    os.environ[MMAP_ENV] = "1" if mmap else "0"
+    if cold:
+        evict(file_path)
+    else:
+        # One untimed run to load the file into the page cache
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            function(file_path)
+    start_time = timeit.default_timer()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        function(file_path)
+    return timeit.default_timer() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        avro_path = Path(tmpdir) / "bench.avro"
+        # Small blocks, so that walking the block headers means many small reads
+        AvroUtils.create_sample(avro_path, SCHEMA_PATH, args.rows, "deflate", seed=0, columnar=True,
+                                sync_interval=16 * 1024)
+        table = AvroUtils.to_arrow_table(avro_path)
+        parquet_path = Path(tmpdir) / "bench.parquet"
+        pq.write_table(table, parquet_path, row_group_size=100_000)
+        csv_path = Path(tmpdir) / "bench.csv"
+        pa_csv.write_csv(table.select([name for name in table.schema.names if name in ("id", "name", "age")]),
+                         csv_path)
+
+        benchmarks = {
+            "avro count": (avro_path, lambda file_path: AvroUtils.count(file_path, cache=False)),
+            "avro tail": (avro_path, lambda file_path: AvroUtils.tail(file_path, 1000, cache=False)),
+            "avro stats": (avro_path, lambda file_path: AvroUtils.stats(file_path, cache=False)),
+            "parquet read": (parquet_path, lambda file_path: ParquetUtils.to_record_batch_reader(file_path).read_all()),
+            "csv stats": (csv_path, lambda file_path: CsvUtils.stats(file_path, jobs=4, cache=False)),
+        }
+        print(f"{args.rows} rows")
+        for name, (file_path, function) in benchmarks.items():
+            print(f"{name} ({file_path.stat().st_size} bytes)")
+            for cold in (True, False):
+                timings = {}
+                for mmap in (False, True):
+                    timings[mmap] = min(measure(function, file_path, mmap, cold) for _ in range(args.repeat))
+                print(f"  {'cold' if cold else 'warm'}  buffered {timings[False]:8.3f}s  mmap {timings[True]:8.3f}s"
+                      f"  x{timings[False] / timings[True]:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Compare the bytes read by a selective Parquet query against a full scan.
+
+Bytes are taken from the `rchar` counter of /proc/self/io, so this benchmark needs Linux.
+
+    python benchmarks/parquet_query.py --rows 2000000
+"""
+import argparse
+import contextlib
+import os
+import tempfile
+import timeit
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from data_tools.utils.parquet import ParquetUtils
+
+
+def read_bytes() -> int:
+    with open("/proc/self/io") as f:
+        for line in f:
+            key, value = line.split(":")
+            if key == "rchar":
+                return int(value)
+    raise RuntimeError("rchar is missing from /proc/self/io")
+
+
+def write_dataset(file_path: Path, num_rows: int, row_group_size: int) -> None:
+    ids = pa.array(range(num_rows), pa.int64())
+    table = pa.table({
+        "id": ids,
+        "name": pa.compute.cast(ids, pa.string()),
+        "value": pa.compute.multiply(ids, 3),
+        "payload": pa.compute.binary_join_element_wise(pa.compute.cast(ids, pa.string()), "-" * 64, ""),
+    })
+    pq.write_table(table, file_path, row_group_size=row_group_size)
+
+
+def measure(file_path: Path, query_expression: str):
+    start_bytes = read_bytes()
+    start_time = timeit.default_timer()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        ParquetUtils.query(file_path, query_expression)
+    return read_bytes() - start_bytes, timeit.default_timer() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--row-group-size", type=int, default=100_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "bench.parquet"
+        write_dataset(file_path, args.rows, args.row_group_size)
+        print(f"File size: {file_path.stat().st_size} bytes, {args.rows} rows")
+
+        queries = {
+            "full scan": "select count(*), sum(value), max(payload) from 'bench.parquet'",
+            "selective": f"select id, name from 'bench.parquet' "
+                         f"where id between {args.rows // 2} and {args.rows // 2 + 10}",
+        }
+        for label, query_expression in queries.items():
+            num_bytes, elapsed = measure(file_path, query_expression)
+            print(f"{label:>10}: {num_bytes:>12} bytes read in {elapsed:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Compare prefetch depths when streaming Avro and Parquet files, with the file evicted from the page cache (cold)
+or not (warm). Read-ahead pays off when reads wait on storage and there are cores left for decompression.
+
+Files are evicted with posix_fadvise(POSIX_FADV_DONTNEED), so cold runs need Linux.
+
+    python benchmarks/prefetch_read.py --rows 1000000 --depths 0 1 4
+"""
+import argparse
+import contextlib
+import os
+import tempfile
+import timeit
+from pathlib import Path
+
+import pyarrow.parquet as pq
+
+from data_tools.utils.avro import AvroUtils
+from data_tools.utils.fileio import MMAP_ENV, PREFETCH_ENV
+from data_tools.utils.parquet import ParquetUtils
+
+SCHEMA_PATH = Path(__file__).resolve().parent.parent / "tests" / "sample_schema.avsc"
+
+
+def evict(file_path: Path) -> None:
+    with open(file_path, "rb") as f:
+        os.fsync(f.fileno())
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def measure(function, file_path: Path, depth: int, cold: bool) -> float:
+    os.environ[PREFETCH_ENV] = str(depth)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        if cold:
+            evict(file_path)
+        else:
+            # One untimed run to load the file into the page cache
+            function(file_path)
+        start_time = timeit.default_timer()
+        function(file_path)
+    return timeit.default_timer() - start_time
+
+
+def read_avro(file_path: Path) -> None:
+    AvroUtils.to_record_batch_reader(file_path).read_all()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--depths", type=int, nargs="+", default=[0, 1, 4])
+    # Buffered reads, where waiting on storage happens in read calls rather than in page faults
+    parser.add_argument("--no-mmap", dest="mmap", action="store_false")
+    args = parser.parse_args()
+    if not args.mmap:
+        os.environ[MMAP_ENV] = "0"
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        avro_paths = {}
+        for codec in ("deflate", "snappy"):
+            avro_paths[codec] = Path(tmpdir) / f"bench-{codec}.avro"
+            AvroUtils.create_sample(avro_paths[codec], SCHEMA_PATH, args.rows, codec, seed=0, columnar=True)
+        table = AvroUtils.to_arrow_table(avro_paths["deflate"])
+        parquet_path = Path(tmpdir) / "bench.parquet"
+        pq.write_table(table, parquet_path, row_group_size=100_000, compression="zstd")
+
+        benchmarks = {
+            **{f"avro {codec} read": (file_path, read_avro) for codec, file_path in avro_paths.items()},
+            "avro deflate stats": (avro_paths["deflate"], lambda file_path: AvroUtils.stats(file_path, cache=False)),
+            "parquet read": (parquet_path, lambda file_path: ParquetUtils.to_record_batch_reader(file_path).read_all()),
+        }
+        print(f"{args.rows} rows, {os.cpu_count()} CPUs")
+        for name, (file_path, function) in benchmarks.items():
+            print(f"{name} ({file_path.stat().st_size} bytes)")
+            for cold in (True, False):
+                timings = {depth: min(measure(function, file_path, depth, cold) for _ in range(args.repeat))
+                           for depth in args.depths}
+                baseline = timings[args.depths[0]]
+                print(f"  {'cold' if cold else 'warm'}  " + "  ".join(
+                    f"depth {depth} {seconds:7.3f}s x{baseline / seconds:.2f}" for depth, seconds in timings.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Time every command on generated Avro and Parquet files of several sizes and codecs, and compare with a baseline.
+
+Every measurement runs in a fresh process, so that timings include loading the backends like a command line
+run does, and the peak RSS is that of the command alone. Results are written as JSON; runs slower or bigger
+than the baseline by more than the threshold are reported as regressions and make the suite exit with 1.
+Peak RSS comes from getrusage, so this benchmark needs a Unix.
+
+    python benchmarks/suite.py --sizes 1e4 1e5 1e6 1e7 --output results.json
+    python benchmarks/suite.py --save-baseline
+
+Timings depend on the machine: compare with a baseline recorded on the same machine.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+
+SCHEMA_PATH = Path(__file__).resolve().parent.parent / "tests" / "sample_schema.avsc"
+BASELINE_PATH = Path(__file__).resolve().parent / "baseline.json"
+
+# Codec names as given to create_sample by each format; Avro zstd needs a zstd library fastavro supports
+CODECS = {
+    "avro": {"null": "null", "deflate": "deflate", "snappy": "snappy", "zstd": "zstandard"},
+    "parquet": {"null": "none", "deflate": "gzip", "snappy": "snappy", "zstd": "zstd"},
+}
+
+# Command line arguments of every timed command, run through data_tools.main
+COMMANDS = {
+    "head": lambda path: ["head", str(path)],
+    "tail": lambda path: ["tail", str(path), "--no-cache"],
+    "meta": lambda path: ["meta", str(path), "--no-cache"],
+    "count": lambda path: ["count", str(path), "--no-cache"],
+    "stats": lambda path: ["stats", str(path), "--no-cache"],
+    "sample": lambda path: ["sample", str(path), "1000", "--seed", "0", "--no-cache"],
+    "query": lambda path: ["query", str(path), f"select count(*) as n, avg(age) as age from '{path.name}'"],
+}
+
+
+def run_child(spec: dict) -> dict:
+    """
+    Run one measurement in this process, with the output of the command discarded.
+    """
+    from data_tools import main as cli
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start_time = timeit.default_timer()
+        if spec["command"] == "create_sample":
+            utils_cls = cli.get_utils_class(spec["format"])
+            utils_cls.create_sample(Path(spec["path"]), SCHEMA_PATH, spec["rows"], spec["codec"], seed=0,
+                                    columnar=True)
+        else:
+            sys.argv = ["data-tools", *spec["argv"]]
+            cli.main()
+        seconds = timeit.default_timer() - start_time
+    # Kilobytes on Linux, bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return {"seconds": seconds, "peak_rss_bytes": peak_rss}
+
+
+def measure(spec: dict, repeat: int) -> dict:
+    """
+    Run a measurement `repeat` times, each in a fresh process, and keep the fastest run.
+    """
+    runs = []
+    for _ in range(repeat):
+        process = subprocess.run([sys.executable, __file__, "--child", json.dumps(spec)],
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        if process.returncode:
+            raise RuntimeError(process.stderr.strip().splitlines()[-1])
+        runs.append(json.loads(process.stdout.splitlines()[-1]))
+    return min(runs, key=lambda run: run["seconds"])
+
+
+def run_suite(args: argparse.Namespace, tmpdir: Path) -> list:
+    results = []
+    for file_format in args.formats:
+        for codec in args.codecs:
+            for rows in args.sizes:
+                path = tmpdir / f"bench-{codec}-{rows}.{file_format}"
+                spec = {"command": "create_sample", "format": file_format, "codec": CODECS[file_format][codec],
+                        "rows": rows, "path": str(path)}
+                try:
+                    timings = {"create_sample": measure(spec, args.repeat)}
+                except RuntimeError as e:
+                    print(f"{file_format}/{codec}: skipped, {e}", file=sys.stderr)
+                    break
+                for command in args.commands:
+                    timings[command] = measure({"command": command, "argv": COMMANDS[command](path)}, args.repeat)
+
+                size = path.stat().st_size
+                for command, timing in timings.items():
+                    result = {
+                        "name": f"{file_format}/{codec}/{rows}/{command}",
+                        "format": file_format,
+                        "codec": codec,
+                        "rows": rows,
+                        "command": command,
+                        "file_bytes": size,
+                        **timing,
+                        "rows_per_second": rows / timing["seconds"],
+                        "bytes_per_second": size / timing["seconds"],
+                    }
+                    print(f"{result['name']:<40} {timing['seconds']:9.3f}s {result['rows_per_second']:14.0f} rows/s"
+                          f" {timing['peak_rss_bytes'] / 2 ** 20:9.1f} MiB", file=sys.stderr)
+                    results.append(result)
+                path.unlink()
+    return results
+
+
+def compare(results: list, baseline: list, threshold: float, min_delta: float) -> list:
+    """
+    Return the results slower or using more memory than their baseline by more than `threshold` times.
+    Timing differences under `min_delta` seconds are noise for the smallest files and are ignored.
+    """
+    baseline_results = {result["name"]: result for result in baseline}
+    regressions = []
+    for result in results:
+        expected = baseline_results.get(result["name"])
+        if expected is None:
+            continue
+        slower = (result["seconds"] > expected["seconds"] * threshold
+                  and result["seconds"] - expected["seconds"] > min_delta)
+        bigger = result["peak_rss_bytes"] > expected["peak_rss_bytes"] * threshold
+        if slower or bigger:
+            regressions.append({
+                "name": result["name"],
+                "seconds": [expected["seconds"], result["seconds"]],
+                "peak_rss_bytes": [expected["peak_rss_bytes"], result["peak_rss_bytes"]],
+            })
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=lambda value: int(float(value)), nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--formats", nargs="+", choices=sorted(CODECS), default=sorted(CODECS))
+    parser.add_argument("--codecs", nargs="+", choices=sorted(CODECS["avro"]), default=sorted(CODECS["avro"]))
+    parser.add_argument("--commands", nargs="+", choices=list(COMMANDS), default=list(COMMANDS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", type=Path)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=1.25)
+    parser.add_argument("--min-delta", type=float, default=0.05)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(json.loads(args.child))))
+        return
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # Commands run with --no-cache, this only keeps stray cache entries out of the user's cache
+        os.environ["DATA_TOOLS_CACHE_DIR"] = str(Path(tmpdir) / "cache")
+        results = run_suite(args, Path(tmpdir))
+
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(report, indent=2) + "\n")
+        return
+    if not args.baseline.exists():
+        return
+
+    regressions = compare(results, json.loads(args.baseline.read_text())["results"], args.threshold,
+                          args.min_delta)
+    for regression in regressions:
+        (old_seconds, new_seconds), (old_rss, new_rss) = regression["seconds"], regression["peak_rss_bytes"]
+        print(f"REGRESSION {regression['name']}: {old_seconds:.3f}s -> {new_seconds:.3f}s, "
+              f"{old_rss / 2 ** 20:.1f} -> {new_rss / 2 ** 20:.1f} MiB", file=sys.stderr)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
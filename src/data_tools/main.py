@@ -1,9 +1,152 @@
+import importlib
+import inspect
+import os
+import sys
+import typing as T
 from pathlib import Path
 
 import argparse as argparse
 
-from data_tools.utils.avro import AvroUtils
-from data_tools.utils.parquet import ParquetUtils
+if T.TYPE_CHECKING:
+    from data_tools.utils.base import BaseUtils
+
+# Backends are imported only once a command needs them, so that light commands
+# (e.g. `meta` on an Avro file) do not pay for loading pyarrow or duckdb.
+FORMATS = {
+    "avro": "data_tools.utils.avro:AvroUtils",
+    "parquet": "data_tools.utils.parquet:ParquetUtils",
+    "csv": "data_tools.utils.csv:CsvUtils",
+    "json": "data_tools.utils.json:JsonUtils",
+}
+
+# Kept in sync with data_tools.utils.output, which imports pyarrow
+OUTPUT_FORMATS = ("jsonl", "csv", "arrow")
+
+
+def column_list(value: str) -> list:
+    """
+    Parse a comma-separated list of top-level column names.
+    """
+    return [column.strip() for column in value.split(",") if column.strip()]
+
+
+# Projection on top-level columns, pushed down to the readers of every format
+COLUMNS = (("--columns",), {"type": column_list})
+# Input files are memory-mapped unless --no-mmap is given, see data_tools.utils.fileio
+MMAP = (("--mmap",), {"action": argparse.BooleanOptionalAction, "default": True})
+# Kept in sync with data_tools.utils.fileio
+MMAP_ENV = "DATA_TOOLS_MMAP"
+# Blocks or row groups read ahead by background threads, 0 to read in the consuming thread
+PREFETCH = (("--prefetch",), {"type": int})
+# Kept in sync with data_tools.utils.fileio
+PREFETCH_ENV = "DATA_TOOLS_PREFETCH"
+# Avro records are decoded straight into Arrow arrays, or into Python dicts by fastavro
+AVRO_ENGINE = (("--avro-engine",), {"choices": ("columnar", "fastavro")})
+# Kept in sync with data_tools.utils.avro_columnar
+AVRO_ENGINE_ENV = "DATA_TOOLS_AVRO_ENGINE"
+# Unix socket of the query server, see data_tools.utils.server
+SOCKET = (("--socket",), {"dest": "socket_file", "type": Path})
+
+# Command name -> arguments, as (name or flags, add_argument keyword arguments).
+# Every file_path may also be a directory or a glob pattern, see data_tools.utils.dataset.
+COMMANDS = {
+    "head": [
+        (("file_path",), {"type": Path}),
+        COLUMNS,
+        (("--format",), {"dest": "output_format", "choices": OUTPUT_FORMATS, "default": "jsonl"}),
+        MMAP,
+    ],
+    "tail": [
+        (("file_path",), {"type": Path}),
+        COLUMNS,
+        (("--format",), {"dest": "output_format", "choices": OUTPUT_FORMATS, "default": "jsonl"}),
+        (("--no-cache",), {"dest": "cache", "action": "store_false"}),
+        MMAP,
+    ],
+    "meta": [
+        (("file_path",), {"type": Path}),
+        (("--no-cache",), {"dest": "cache", "action": "store_false"}),
+        (("--jobs",), {"type": int}),
+        MMAP,
+    ],
+    "count": [
+        (("file_path",), {"type": Path}),
+        (("--jobs",), {"type": int}),
+        (("--no-cache",), {"dest": "cache", "action": "store_false"}),
+        MMAP,
+    ],
+    "sample": [
+        (("file_path",), {"type": Path}),
+        (("n",), {"type": int}),
+        (("--seed",), {"type": int}),
+        COLUMNS,
+        (("--format",), {"dest": "output_format", "choices": OUTPUT_FORMATS, "default": "jsonl"}),
+        (("--jobs",), {"type": int}),
+        (("--no-cache",), {"dest": "cache", "action": "store_false"}),
+        MMAP,
+    ],
+    "create_sample": [
+        (("schema_path",), {"type": Path}),
+        (("sample_size",), {"type": int}),
+        (("file_path",), {"type": Path}),
+        (("--seed",), {"type": int}),
+        (("--columnar",), {"action": "store_true"}),
+        (("--jobs",), {"type": int}),
+        (("--chunk-size",), {"type": int, "default": 100_000}),
+    ],
+    "schema": [
+        (("file_path",), {"type": Path}),
+        (("--no-cache",), {"dest": "cache", "action": "store_false"}),
+        (("--jobs",), {"type": int}),
+        MMAP,
+    ],
+    "stats": [
+        (("file_path",), {"type": Path}),
+        COLUMNS,
+        (("--batch-size",), {"type": int, "default": 65536}),
+        # Quantiles and most frequent values, estimated with fixed-size sketches
+        (("--approx",), {"action": "store_true"}),
+        (("--jobs",), {"type": int}),
+        (("--no-cache",), {"dest": "cache", "action": "store_false"}),
+        PREFETCH,
+        AVRO_ENGINE,
+        MMAP,
+    ],
+    "convert": [
+        (("file_path",), {"type": Path}),
+        # The output format is picked from the extension of the output path
+        (("output_path",), {"type": Path}),
+        COLUMNS,
+        (("--codec",), {"type": str}),
+        (("--row-group-size",), {"type": int}),
+        (("--sync-interval",), {"type": int}),
+        (("--jobs",), {"type": int}),
+        PREFETCH,
+        AVRO_ENGINE,
+        MMAP,
+    ],
+    "query": [
+        (("file_path",), {"type": Path}),
+        COLUMNS,
+        (("query_expression",), {"type": str}),
+        (("--jobs",), {"type": int}),
+        (("--format",), {"dest": "output_format", "choices": OUTPUT_FORMATS, "default": "jsonl"}),
+        # Queries of single files go to the `serve` process when one is listening, unless --no-server is given
+        (("--no-server",), {"dest": "server", "action": "store_false"}),
+        SOCKET,
+        PREFETCH,
+        AVRO_ENGINE,
+        MMAP,
+    ],
+    "serve": [
+        SOCKET,
+        (("--jobs",), {"type": int}),
+        (("--result-cache-size",), {"type": int, "default": 32}),
+        PREFETCH,
+        AVRO_ENGINE,
+        MMAP,
+    ],
+}
 
 
 def get_file_format(file_path: Path) -> str:
@@ -17,47 +160,41 @@ def get_file_format(file_path: Path) -> str:
         return "parquet"
     elif ext == ".csv":
         return "csv"
-    elif ext == ".json":
+    elif ext == ".json" or ext == ".jsonl":
         return "json"
     else:
         raise ValueError("Unsupported file format.")
 
 
-def init_args():
-    parser = argparse.ArgumentParser()
-
-    subparsers = parser.add_subparsers(help="commands", dest="command")
-
-    # data-tools head
-    head_parser = subparsers.add_parser("head")
-    head_parser.add_argument("file_path", action="store")
+def is_dataset_path(file_path: Path) -> bool:
+    """
+    Tell whether the path names several files: a directory or a glob pattern.
+    """
+    return file_path.is_dir() or any(character in str(file_path) for character in "*?[")
 
-    # data-tools tail
-    tail_parser = subparsers.add_parser("tail")
-    tail_parser.add_argument("file_path", type=Path, action="store")
 
-    # data-tools meta
-    meta_parser = subparsers.add_parser("meta")
-    meta_parser.add_argument("file_path", type=Path, action="store")
+def get_utils_class(file_format: str) -> "T.Type[BaseUtils]":
+    """
+    Import the backend implementing the given file format.
+    """
+    if file_format not in FORMATS:
+        raise ValueError("Unsupported file format.")
+    module_name, class_name = FORMATS[file_format].split(":")
+    return getattr(importlib.import_module(module_name), class_name)
 
-    # data-tools create_sample
-    create_sample_parser = subparsers.add_parser("create_sample")
-    create_sample_parser.add_argument("schema_path", type=Path, action="store")
-    create_sample_parser.add_argument("sample_size", type=int, action="store")
-    create_sample_parser.add_argument("file_path", type=Path, action="store")
 
-    # data-tools schema
-    schema_parser = subparsers.add_parser("schema")
-    schema_parser.add_argument("file_path", type=Path, action="store")
+def init_args():
+    parser = argparse.ArgumentParser()
+    # Per-phase timings and counters as JSON, to stderr or appended to --profile-output
+    parser.add_argument("--profile", action="store_true")
+    parser.add_argument("--profile-output", default="-", metavar="PATH")
 
-    # data-tools stats
-    stats_parser = subparsers.add_parser("stats")
-    stats_parser.add_argument("file_path", type=Path, action="store")
+    subparsers = parser.add_subparsers(help="commands", dest="command")
 
-    # data-tools query
-    query_parser = subparsers.add_parser("query")
-    query_parser.add_argument("file_path", type=Path, action="store")
-    query_parser.add_argument("query_expression", type=str, action="store")
+    for command, arguments in COMMANDS.items():
+        command_parser = subparsers.add_parser(command)
+        for names, options in arguments:
+            command_parser.add_argument(*names, **{"action": "store", **options})
 
     args = parser.parse_args()
     return args
@@ -65,22 +202,64 @@ def init_args():
 
 def main():
     args = init_args()
+    if not getattr(args, "mmap", True):
+        # Read by the backends and inherited by their worker processes
+        os.environ[MMAP_ENV] = "0"
+    if getattr(args, "prefetch", None) is not None:
+        os.environ[PREFETCH_ENV] = str(args.prefetch)
+    if getattr(args, "avro_engine", None) is not None:
+        os.environ[AVRO_ENGINE_ENV] = args.avro_engine
+    if args.command == "serve":
+        from data_tools.utils.server import serve
+
+        serve(args.socket_file, args.jobs, args.result_cache_size)
+        return
+
     file_path = Path(args.file_path)
-    file_format = get_file_format(file_path)
-    if file_format == "avro":
-        utilsCls = AvroUtils
-    elif file_format == "parquet":
-        utilsCls = ParquetUtils
+    if args.command == "query" and args.server and not is_dataset_path(file_path):
+        from data_tools.utils.server import query_server
+
+        if query_server(file_path, args.query_expression, args.output_format, args.columns, args.socket_file):
+            return
+    function_args = {}
+    if is_dataset_path(file_path):
+        # A directory or a glob pattern: the command runs over all the files at once
+        from data_tools.utils.dataset import Dataset, DatasetUtils, discover
+
+        files, file_format = discover(file_path, get_file_format)
+        function_args["dataset"] = Dataset(file_path.name, files, get_utils_class(file_format))
+        utilsCls = DatasetUtils
     else:
-        raise ValueError("Unsupported file format.")
+        utilsCls = get_utils_class(get_file_format(file_path))
+    if args.command == "convert":
+        # The backend writing the output, the one running the command reads the input
+        function_args["output_cls"] = get_utils_class(get_file_format(args.output_path))
 
     if hasattr(utilsCls, args.command):
         function = getattr(utilsCls, args.command)
-        function_args = []
-        for arg_name in vars(args):
-            if arg_name != "command":
-                function_args.append(getattr(args, arg_name))
-        function(*function_args)
+        # Pass options by name, skipping the ones this format's implementation does not take
+        parameters = inspect.signature(function).parameters
+        for arg_name, value in vars(args).items():
+            if arg_name != "command" and arg_name in parameters:
+                function_args[arg_name] = value
+        if args.profile:
+            from data_tools.utils import profile
+
+            profile.enable()
+        try:
+            if args.profile:
+                try:
+                    with profile.span(args.command):
+                        function(**function_args)
+                finally:
+                    profile.write_report(args.profile_output, args.command)
+            else:
+                function(**function_args)
+        except BrokenPipeError:
+            # The consumer of our output went away (e.g. `| head`): stop quietly, and point stdout
+            # to devnull so that flushing it at exit does not raise again
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            sys.exit(1)
     else:
         raise ValueError("Invalid command.")
 
@@ -1,3 +1,8 @@
+from __future__ import annotations
+
+import collections
+import functools
+import itertools
 import os
 import json
 import typing as T
@@ -5,16 +10,34 @@ from pathlib import Path
 
 import fastavro
 
-from data_tools.utils.base import BaseUtils
+from data_tools.utils import profile
+from data_tools.utils.avro_blocks import AvroBlock, iter_blocks, read_header, read_records, split_ranges
+from data_tools.utils.base import RANGES_PER_JOB, BaseUtils
+from data_tools.utils.cache import cached, entry_name
+from data_tools.utils.fileio import open_input
+from data_tools.utils.lazy import LazyModule
+from data_tools.utils.parallel import ordered_map
+
+if T.TYPE_CHECKING:
+    import pyarrow as pa
+
+    from data_tools.utils.stats import TableStats
+else:
+    pa = LazyModule("pyarrow")
 
 
 class AvroUtils(BaseUtils):
     @classmethod
     def create_sample(
             cls, file_path: Path, schema_path: Path, sample_size: int, codec: str = "null",
-            metadata=None, sync_interval: int = 1024 * 1024) -> Path:
+            metadata=None, sync_interval: int = 1024 * 1024, seed: T.Optional[int] = None,
+            columnar: bool = False, jobs: T.Optional[int] = None, chunk_size: int = 100_000) -> Path:
         """
         Create a random sample data file given an Avro schema file.
+        The same seed always produces the same records.
+
+        In columnar mode, whole columns are generated with NumPy in chunks of `chunk_size` rows across
+        `jobs` processes and written incrementally, so memory stays flat whatever the sample size.
         """
         if metadata is None:
             metadata = {"Name": "Dummy data"}
@@ -23,7 +46,13 @@ class AvroUtils(BaseUtils):
             schema = json.load(f)
             schema = fastavro.parse_schema(schema=schema)
 
-        sample_data = cls.generate_data(schema, sample_size)
+        if columnar:
+            from data_tools.utils.output import to_pylist
+
+            batches = cls.generate_batches(schema, sample_size, seed, jobs, chunk_size)
+            sample_data = (record for batch in batches for record in to_pylist(batch))
+        else:
+            sample_data = cls.generate_data(schema, sample_size, seed)
 
         with open(file_path, "wb") as f:
             fastavro.writer(f, schema, sample_data, codec=codec, metadata=metadata,
@@ -31,76 +60,199 @@ class AvroUtils(BaseUtils):
         return file_path
 
     @classmethod
-    def meta(cls, file_path: Path) -> T.Tuple:
+    def meta(cls, file_path: Path, cache: bool = True) -> T.Tuple:
         """
         Inspect metadata of an Avro file.
         """
-        with open(file_path, "rb") as f:
-            avro_reader = fastavro.reader(f)
-            schema = avro_reader.writer_schema
-            serialized_size = os.path.getsize(file_path)
+        compute = functools.partial(cls._read_header, file_path)
+        schema, metadata, codec = cached(file_path, "avro_header", compute, cache)
+        serialized_size = os.path.getsize(file_path)
 
-            cls.print_metadata(schema, avro_reader.metadata, avro_reader.codec, serialized_size)
-            return schema, avro_reader.metadata, avro_reader.codec, serialized_size
+        cls.print_metadata(schema, metadata, codec, serialized_size)
+        return schema, metadata, codec, serialized_size
 
     @classmethod
-    def schema(cls, file_path: Path) -> None:
-        with open(file_path, "rb") as f:
-            avro_reader = fastavro.reader(f)
-            schema = avro_reader.writer_schema
-            serialized_size = os.path.getsize(file_path)
+    def schema(cls, file_path: Path, cache: bool = True) -> None:
+        compute = functools.partial(cls._read_header, file_path)
+        schema, metadata, _ = cached(file_path, "avro_header", compute, cache)
+        serialized_size = os.path.getsize(file_path)
 
-            print(f"Avro schema: {schema}")
-            print(f"Avro metadata: {avro_reader.metadata}, {serialized_size}")
+        print(f"Avro schema: {schema}")
+        print(f"Avro metadata: {metadata}, {serialized_size}")
 
     @classmethod
-    def stats(cls, file_path: Path) -> T.Tuple[int, T.Dict]:
-        with open(file_path, "rb") as f:
+    def arrow_schema(cls, file_path: Path, cache: bool = True) -> pa.Schema:
+        from data_tools.utils.avro_arrow import avro_to_arrow_schema
+
+        schema, _, _ = cached(file_path, "avro_header", functools.partial(cls._read_header, file_path), cache)
+        return avro_to_arrow_schema(schema)
+
+    @staticmethod
+    def _read_header(file_path: Path) -> T.Tuple[T.Dict, T.Dict, str]:
+        with open_input(file_path) as f:
             avro_reader = fastavro.reader(f)
-            num_rows = 0
-            column_stats = {}
-            for row in avro_reader:
-                num_rows += 1
-                for k, v in row.items():
-                    column_stat = column_stats.get(k, {
-                        "count": 0,
-                        "null_count": 0,
-                        "min": None,
-                        "max": None
-                    })
-                    column_stat["count"] += 1
-                    if v is None:
-                        column_stat["null_count"] += 1
-                    elif column_stat["min"] is None or v < column_stat["min"]:
-                        column_stat["min"] = v
-                    elif column_stat["max"] is None or v > column_stat["max"]:
-                        column_stat["max"] = v
-                    column_stats[k] = column_stat
-            print(column_stat)
-            return num_rows, column_stats
+            return avro_reader.writer_schema, avro_reader.metadata, avro_reader.codec
 
     @classmethod
-    def tail(cls, file_path: Path, n: int = 20) -> T.List:
+    def stats(cls, file_path: Path, batch_size: int = 65536, jobs: T.Optional[int] = None, cache: bool = True,
+              columns: T.Optional[T.Sequence[str]] = None, approx: bool = False) -> T.Tuple[int, T.Dict]:
         """
-        Returns the last N records of an Avro file as a list of dictionaries.
+        Compute per-column statistics of an Avro file.
+
+        Records are decoded into Arrow record batches of `batch_size` rows and every batch is
+        aggregated with Arrow compute kernels; partial results are merged across batches.
+        With several jobs, byte ranges of the file are decoded and aggregated in a process pool.
+        Only the given columns are decoded. Results are cached until the file changes.
+        In approximate mode, quantiles and most frequent values are estimated with mergeable sketches.
         """
-        with open(file_path, "rb") as f:
-            avro_reader = fastavro.reader(f)
-            records = list(avro_reader)
-            num_records = len(records)
+        file_stats = cls.file_stats(file_path, jobs, cache, columns, approx, batch_size=batch_size)
+        num_rows, column_stats = cls.summarize_stats(file_stats)
+        cls.print_stats(num_rows, column_stats)
+        return num_rows, column_stats
 
-            # Calculate the number of records to read
-            num_to_read = min(num_records, n)
-            # Read the last N records and store them in a list
-            records = [record for record in records[num_records - num_to_read:num_records]]
-            print(records)
-            return records
+    @classmethod
+    def file_stats(cls, file_path: Path, jobs: T.Optional[int] = None, cache: bool = True,
+                   columns: T.Optional[T.Sequence[str]] = None, approx: bool = False,
+                   batch_size: int = 65536) -> TableStats:
+        compute = functools.partial(cls._compute_stats, file_path, batch_size, jobs, columns, approx)
+        return cached(file_path, entry_name("approx_stats" if approx else "stats", columns), compute, cache)
 
     @classmethod
-    def head(cls, file_path: Path, n: int = 20):
-        with open(file_path, "rb") as f:
-            avro_reader = fastavro.reader(f)
-            for i, record in enumerate(avro_reader):
-                if i == n:
+    def _compute_stats(cls, file_path: Path, batch_size: int, jobs: T.Optional[int],
+                       columns: T.Optional[T.Sequence[str]] = None, approx: bool = False) -> TableStats:
+        from data_tools.utils.avro_arrow import avro_to_arrow_schema
+        from data_tools.utils.avro_schema import project_schema
+        from data_tools.utils.stats import TableStats
+
+        if not jobs or jobs == 1:
+            table_stats = TableStats(approx)
+            for batch in cls.to_record_batch_reader(file_path, batch_size, columns=columns):
+                table_stats.update(batch)
+            return table_stats
+
+        with open_input(file_path) as f:
+            header = read_header(f)
+        reader_schema = project_schema(header.schema, columns) if columns else None
+        schema = avro_to_arrow_schema(reader_schema or header.schema)
+        aggregate = functools.partial(cls._range_stats, file_path, schema, batch_size, reader_schema, approx)
+        ranges = split_ranges(header, os.path.getsize(file_path), RANGES_PER_JOB * jobs)
+        return functools.reduce(TableStats.merge, ordered_map(aggregate, ranges, jobs), TableStats(approx))
+
+    @classmethod
+    def _range_stats(cls, file_path: Path, schema: pa.Schema, batch_size: int, reader_schema: T.Optional[T.Dict],
+                     approx: bool, byte_range: T.Tuple[int, int]) -> TableStats:
+        from data_tools.utils.stats import TableStats
+
+        table_stats = TableStats(approx)
+        for batch in cls._iter_range_batches(file_path, schema, batch_size, reader_schema, byte_range):
+            table_stats.update(batch)
+        return table_stats
+
+    @classmethod
+    def tail(cls, file_path: Path, n: int = 20, output_format: str = "jsonl", cache: bool = True,
+             columns: T.Optional[T.Sequence[str]] = None) -> T.List:
+        """
+        Returns the last N records of an Avro file as a list of dictionaries.
+
+        Only block headers are read while walking the file, and the resulting block index is cached;
+        just the trailing blocks holding the last N records are decompressed and decoded.
+        """
+        from data_tools.utils.avro_schema import project_schema
+
+        block_index = cached(file_path, "avro_blocks", functools.partial(cls.block_index, file_path), cache)
+        with open_input(file_path) as f:
+            header = read_header(f)
+            reader_schema = project_schema(header.schema, columns) if columns else None
+            blocks = collections.deque()
+            num_buffered = 0
+            for block in reversed(block_index):
+                if num_buffered >= n:
                     break
-                print(record)
+                blocks.appendleft(AvroBlock(*block))
+                num_buffered += block[1]
+
+            num_to_skip = max(num_buffered - n, 0)
+            with profile.span("decode"):
+                records = list(itertools.islice(read_records(f, header, blocks, reader_schema), num_to_skip, None))
+        cls._print_records(reader_schema or header.schema, records, output_format)
+        return records
+
+    @classmethod
+    def num_rows(cls, file_path: Path, cache: bool = True) -> int:
+        """
+        Count the records of an Avro file from the record count of every block.
+
+        Payloads are skipped with a seek, nothing is decompressed or decoded.
+        """
+        block_index = cached(file_path, "avro_blocks", functools.partial(cls.block_index, file_path), cache)
+        return sum(num_records for _, num_records, _ in block_index)
+
+    @classmethod
+    def take_rows(cls, file_path: Path, positions: T.Sequence[int], columns: T.Optional[T.Sequence[str]] = None,
+                  cache: bool = True) -> pa.Table:
+        """
+        Return the records at the given sorted positions of an Avro file.
+        Using the cached block index, only the blocks holding them are decompressed and decoded.
+        """
+        from data_tools.utils.avro_arrow import avro_to_arrow_schema
+        from data_tools.utils.avro_schema import project_schema
+        from data_tools.utils.sampling import group_positions
+
+        block_index = cached(file_path, "avro_blocks", functools.partial(cls.block_index, file_path), cache)
+        offsets = group_positions(positions, (num_records for _, num_records, _ in block_index))
+        with open_input(file_path) as f:
+            header = read_header(f)
+            reader_schema = project_schema(header.schema, columns) if columns else None
+            records = read_records(f, header, (AvroBlock(*block_index[i]) for i in offsets), reader_schema)
+            rows = []
+            with profile.span("decode"):
+                for i, block_offsets in offsets.items():
+                    block_records = list(itertools.islice(records, block_index[i][1]))
+                    rows.extend(block_records[offset] for offset in block_offsets)
+        with profile.span("arrow"):
+            return pa.Table.from_pylist(rows, schema=avro_to_arrow_schema(reader_schema or header.schema))
+
+    @staticmethod
+    def block_index(file_path: Path) -> T.List[T.Tuple[int, int, int]]:
+        """
+        Return the (offset, number of records, size) of every block of an Avro file.
+        """
+        with open_input(file_path) as f, profile.span("index"):
+            header = read_header(f)
+            return [tuple(block) for block in iter_blocks(f, header)]
+
+    @classmethod
+    def head(cls, file_path: Path, n: int = 20, output_format: str = "jsonl",
+             columns: T.Optional[T.Sequence[str]] = None) -> T.List:
+        """
+        Returns the first N records of an Avro file as a list of dictionaries.
+        """
+        from data_tools.utils.avro_schema import project_schema
+
+        with open_input(file_path) as f:
+            reader_schema = project_schema(read_header(f).schema, columns) if columns else None
+            f.seek(0)
+            avro_reader = fastavro.reader(f, reader_schema)
+            with profile.span("decode"):
+                records = list(itertools.islice(avro_reader, n))
+            schema = reader_schema or avro_reader.writer_schema
+        cls._print_records(schema, records, output_format)
+        return records
+
+    @classmethod
+    def _print_records(cls, schema: T.Dict, records: T.List[T.Dict], output_format: str) -> None:
+        from data_tools.utils.avro_arrow import avro_to_arrow_schema
+
+        try:
+            arrow_schema = avro_to_arrow_schema(schema)
+        except ValueError:
+            # Unions of several types and recursive records have no Arrow type, records are written as they are
+            from data_tools.utils.output import write_records
+
+            with profile.span("print"):
+                num_rows = write_records([field["name"] for field in schema["fields"]], records, output_format)
+            profile.count("rows_output", num_rows)
+            return
+        with profile.span("arrow"):
+            batch = pa.RecordBatch.from_pylist(records, schema=arrow_schema)
+        cls.print_batches(arrow_schema, [batch], output_format)
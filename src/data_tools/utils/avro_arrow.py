@@ -0,0 +1,156 @@
+import typing as T
+
+import pyarrow as pa
+
+PRIMITIVE_TYPES = {
+    "null": pa.null(),
+    "boolean": pa.bool_(),
+    "int": pa.int32(),
+    "long": pa.int64(),
+    "float": pa.float32(),
+    "double": pa.float64(),
+    "bytes": pa.binary(),
+    "string": pa.string(),
+}
+
+LOGICAL_TYPES = {
+    "date": pa.date32(),
+    "time-millis": pa.time32("ms"),
+    "time-micros": pa.time64("us"),
+    "timestamp-millis": pa.timestamp("ms", tz="UTC"),
+    "timestamp-micros": pa.timestamp("us", tz="UTC"),
+    "local-timestamp-millis": pa.timestamp("ms"),
+    "local-timestamp-micros": pa.timestamp("us"),
+}
+
+
+def avro_to_arrow_schema(schema: T.Dict) -> pa.Schema:
+    """
+    Derive the Arrow schema matching the records fastavro decodes for the given Avro record schema.
+    """
+    named_types = {}
+    struct_type = _arrow_type(schema, named_types, schema.get("namespace", ""))
+    if not pa.types.is_struct(struct_type):
+        raise ValueError("Top level Avro schema must be a record.")
+    return pa.schema(list(struct_type))
+
+
+def _full_name(name: str, namespace: str) -> str:
+    if "." in name or not namespace:
+        return name
+    return f"{namespace}.{name}"
+
+
+def _arrow_type(avro_type: T.Union[str, T.List, T.Dict], named_types: T.Dict, namespace: str) -> pa.DataType:
+    if isinstance(avro_type, str):
+        if avro_type in PRIMITIVE_TYPES:
+            return PRIMITIVE_TYPES[avro_type]
+        for name in (_full_name(avro_type, namespace), avro_type):
+            if name in named_types:
+                if named_types[name] is None:
+                    raise ValueError("Unsupported recursive type: {}".format(avro_type))
+                return named_types[name]
+        raise ValueError("Unsupported type: {}".format(avro_type))
+
+    if isinstance(avro_type, list):
+        branches = [branch for branch in avro_type if branch != "null"]
+        if not branches:
+            return pa.null()
+        if len(branches) > 1:
+            raise ValueError("Unsupported union type: {}".format(avro_type))
+        return _arrow_type(branches[0], named_types, namespace)
+
+    logical_type = avro_type.get("logicalType")
+    if logical_type in LOGICAL_TYPES:
+        return LOGICAL_TYPES[logical_type]
+    if logical_type == "decimal" and avro_type.get("precision", 0) <= 38:
+        return pa.decimal128(avro_type["precision"], avro_type.get("scale", 0))
+
+    type_name = avro_type["type"]
+    if type_name == "record" or type_name == "error":
+        full_name = _full_name(avro_type["name"], avro_type.get("namespace", namespace))
+        record_namespace = full_name.rpartition(".")[0]
+        # Register a placeholder first, recursive records cannot be represented in Arrow
+        named_types[full_name] = None
+        fields = [
+            pa.field(field["name"], _arrow_type(field["type"], named_types, record_namespace))
+            for field in avro_type["fields"]
+        ]
+        named_types[full_name] = pa.struct(fields)
+        return named_types[full_name]
+    elif type_name == "enum":
+        named_types[_full_name(avro_type["name"], avro_type.get("namespace", namespace))] = pa.string()
+        return pa.string()
+    elif type_name == "fixed":
+        named_types[_full_name(avro_type["name"], avro_type.get("namespace", namespace))] = pa.binary(avro_type["size"])
+        return pa.binary(avro_type["size"])
+    elif type_name == "array":
+        return pa.list_(_arrow_type(avro_type["items"], named_types, namespace))
+    elif type_name == "map":
+        return pa.map_(pa.string(), _arrow_type(avro_type["values"], named_types, namespace))
+    else:
+        # A primitive type written in its object form, e.g. {"type": "string"}
+        return _arrow_type(type_name, named_types, namespace)
+
+
+def arrow_to_avro_schema(schema: pa.Schema, name: str = "Record") -> T.Dict:
+    """
+    Derive an Avro record schema able to hold the rows of the given Arrow schema, as pylist records.
+
+    Nullable fields become unions with null, struct fields become records named after their path.
+    """
+    return {
+        "type": "record",
+        "name": name,
+        "fields": [_avro_field(field, name) for field in schema],
+    }
+
+
+def _avro_field(field: pa.Field, path: str) -> T.Dict:
+    avro_type = _avro_type(field.type, f"{path}_{field.name}")
+    if field.nullable and avro_type != "null":
+        return {"name": field.name, "type": ["null", avro_type], "default": None}
+    return {"name": field.name, "type": avro_type}
+
+
+def _avro_type(arrow_type: pa.DataType, path: str) -> T.Union[str, T.Dict]:
+    if pa.types.is_dictionary(arrow_type):
+        return _avro_type(arrow_type.value_type, path)
+    if pa.types.is_null(arrow_type):
+        return "null"
+    if pa.types.is_boolean(arrow_type):
+        return "boolean"
+    if pa.types.is_integer(arrow_type):
+        # Avro ints are signed 32-bit
+        small = arrow_type.bit_width < 32 or (arrow_type.bit_width == 32 and pa.types.is_signed_integer(arrow_type))
+        return "int" if small else "long"
+    if pa.types.is_floating(arrow_type):
+        return "double" if arrow_type.bit_width == 64 else "float"
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return "string"
+    if pa.types.is_binary(arrow_type) or pa.types.is_large_binary(arrow_type):
+        return "bytes"
+    if pa.types.is_fixed_size_binary(arrow_type):
+        return {"type": "fixed", "name": path, "size": arrow_type.byte_width}
+    if pa.types.is_decimal(arrow_type):
+        return {"type": "bytes", "logicalType": "decimal", "precision": arrow_type.precision,
+                "scale": arrow_type.scale}
+    if pa.types.is_date(arrow_type):
+        return {"type": "int", "logicalType": "date"}
+    if pa.types.is_time(arrow_type):
+        if arrow_type.unit in ("s", "ms"):
+            return {"type": "int", "logicalType": "time-millis"}
+        return {"type": "long", "logicalType": "time-micros"}
+    if pa.types.is_timestamp(arrow_type):
+        precision = "millis" if arrow_type.unit in ("s", "ms") else "micros"
+        prefix = "" if arrow_type.tz else "local-"
+        return {"type": "long", "logicalType": f"{prefix}timestamp-{precision}"}
+    if pa.types.is_list(arrow_type) or pa.types.is_large_list(arrow_type) or pa.types.is_fixed_size_list(arrow_type):
+        return {"type": "array", "items": _avro_field(arrow_type.value_field, path)["type"]}
+    if pa.types.is_map(arrow_type):
+        if not (pa.types.is_string(arrow_type.key_type) or pa.types.is_large_string(arrow_type.key_type)):
+            raise ValueError("Unsupported map key type: {}".format(arrow_type.key_type))
+        return {"type": "map", "values": _avro_field(arrow_type.item_field, path)["type"]}
+    if pa.types.is_struct(arrow_type):
+        return {"type": "record", "name": path, "fields": [_avro_field(field, path) for field in arrow_type]}
+    raise ValueError("Unsupported type: {}".format(arrow_type))
@@ -0,0 +1,300 @@
+import functools
+import io
+import json
+import typing as T
+
+import fastavro
+from fastavro.read import BLOCK_READERS, HEADER_SCHEMA
+
+from data_tools.utils import profile
+from data_tools.utils.fileio import read_at
+from data_tools.utils.parallel import prefetch
+
+MAGIC = b"Obj\x01"
+SYNC_SIZE = 16
+SYNC_SCAN_SIZE = 64 * 1024
+# Byte ranges decoded in parallel are kept between these sizes, so that the ranges in flight keep every
+# worker busy without holding a large part of the decoded file in memory
+MIN_SPLIT_SIZE = 1024 * 1024
+MAX_SPLIT_SIZE = 16 * 1024 * 1024
+MAX_RUN_SIZE = 16 * 1024 * 1024
+
+
+class AvroHeader(T.NamedTuple):
+    schema: T.Dict
+    codec: str
+    metadata: T.Dict[str, str]
+    sync: bytes
+    # Raw header bytes; the first block starts right after them.
+    raw: bytes
+
+
+class AvroBlock(T.NamedTuple):
+    # Offset of the block (its record count varint) in the file.
+    offset: int
+    num_records: int
+    # Total size of the block on disk, including both varints and the sync marker.
+    size: int
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.size
+
+
+def read_long(fo: T.BinaryIO) -> T.Optional[int]:
+    """
+    Read a zig-zag encoded varint. Returns None at the end of the file.
+    """
+    shift = 0
+    result = 0
+    while True:
+        byte = fo.read(1)
+        if not byte:
+            if shift:
+                raise EOFError("Truncated varint.")
+            return None
+        b = byte[0]
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return (result >> 1) ^ -(result & 1)
+        shift += 7
+
+
+def encode_long(value: int) -> bytes:
+    """
+    Encode a zig-zag varint, the inverse of read_long.
+    """
+    value = (value << 1) ^ (value >> 63)
+    encoded = bytearray()
+    while value & ~0x7F:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def read_header(fo: T.BinaryIO) -> AvroHeader:
+    """
+    Read the Avro container header, leaving the file positioned at the first block.
+    """
+    start = fo.tell()
+    header = T.cast(T.Dict[str, T.Any], fastavro.schemaless_reader(fo, HEADER_SCHEMA, None))
+    if header["magic"] != MAGIC:
+        raise ValueError("Not an Avro container file.")
+    end = fo.tell()
+    fo.seek(start)
+    raw = fo.read(end - start)
+
+    metadata = {k: v.decode() for k, v in header["meta"].items()}
+    schema = json.loads(metadata["avro.schema"])
+    return AvroHeader(schema, metadata.get("avro.codec", "null"), metadata, header["sync"], raw)
+
+
+def iter_blocks(fo: T.BinaryIO, header: AvroHeader, start: T.Optional[int] = None) -> T.Iterator[AvroBlock]:
+    """
+    Walk the block headers of an Avro container, seeking past every payload without reading it.
+    Walking starts at the first block, or at the block starting at the `start` offset.
+    """
+    fo.seek(len(header.raw) if start is None else start)
+    while True:
+        offset = fo.tell()
+        num_records = read_long(fo)
+        if num_records is None:
+            return
+        payload_size = read_long(fo)
+        if payload_size is None:
+            raise EOFError(f"Truncated block at offset {offset}.")
+        fo.seek(payload_size, io.SEEK_CUR)
+        if fo.read(SYNC_SIZE) != header.sync:
+            raise ValueError(f"Invalid sync marker after block at offset {offset}.")
+        yield AvroBlock(offset, num_records, fo.tell() - offset)
+
+
+def split_ranges(header: AvroHeader, file_size: int, num_splits: int,
+                 min_split_size: T.Optional[int] = None,
+                 max_split_size: T.Optional[int] = None) -> T.List[T.Tuple[int, int]]:
+    """
+    Split the data section of an Avro container into roughly equal byte ranges, at least `num_splits` of them
+    for a large file.
+
+    Ranges are not aligned to blocks; every block belongs to the range its first byte falls in,
+    see iter_range_blocks.
+    """
+    data_start = len(header.raw)
+    split_size = min(-(-(file_size - data_start) // num_splits), max_split_size or MAX_SPLIT_SIZE)
+    split_size = max(split_size, min_split_size or MIN_SPLIT_SIZE, 1)
+    return [(start, min(start + split_size, file_size)) for start in range(data_start, file_size, split_size)]
+
+
+def find_block_start(fo: T.BinaryIO, header: AvroHeader, position: int) -> T.Optional[int]:
+    """
+    Return the offset of the first block starting at or after `position`, found by scanning for the sync marker.
+    """
+    # Every block, including the first one, is preceded by a sync marker
+    position = max(position - SYNC_SIZE, len(header.raw) - SYNC_SIZE)
+    fo.seek(position)
+    tail = b""
+    while True:
+        chunk = fo.read(SYNC_SCAN_SIZE)
+        if not chunk:
+            return None
+        window = tail + chunk
+        index = window.find(header.sync)
+        if index >= 0:
+            return position - len(tail) + index + SYNC_SIZE
+        position += len(chunk)
+        # Keep enough bytes to find a marker spanning two chunks
+        tail = window[-(SYNC_SIZE - 1):]
+
+
+def iter_range_blocks(fo: T.BinaryIO, header: AvroHeader, start: int, end: int) -> T.Iterator[AvroBlock]:
+    """
+    Walk the blocks whose first byte lies in [start, end).
+    Ranges covering a file without overlap visit every block exactly once.
+    """
+    block_start = find_block_start(fo, header, start)
+    if block_start is None or block_start >= end:
+        return
+    for block in iter_blocks(fo, header, block_start):
+        if block.offset >= end:
+            return
+        yield block
+
+
+def read_records(fo: T.BinaryIO, header: AvroHeader, blocks: T.Iterable[AvroBlock],
+                 reader_schema: T.Optional[T.Dict] = None) -> T.Iterator[T.Dict]:
+    """
+    Decode the records of the given blocks only, with the given reader schema if any.
+
+    A container is a header followed by any blocks ending with its sync marker, so blocks far apart in the
+    file are decoded by one reader, parsing the schema once per `MAX_RUN_SIZE` bytes instead of once per block.
+    """
+    runs = []
+    runs_size = 0
+    # Walking blocks moves the file position, so collect them before reading any payload
+    for raw in _read_runs(fo, list(blocks)):
+        runs.append(raw)
+        runs_size += len(raw)
+        if runs_size >= MAX_RUN_SIZE:
+            yield from _reader(io.BytesIO(b"".join([header.raw, *runs])), reader_schema)
+            runs = []
+            runs_size = 0
+    if runs:
+        yield from _reader(io.BytesIO(b"".join([header.raw, *runs])), reader_schema)
+
+
+def prefetch_records(fo: T.BinaryIO, header: AvroHeader, blocks: T.Iterable[AvroBlock],
+                     reader_schema: T.Optional[T.Dict] = None, depth: int = 4) -> T.Iterator[T.Dict]:
+    """
+    Decode the records of the given blocks, while a pool of `depth` threads reads and decompresses
+    the next `depth` blocks in the background.
+
+    The decompressed blocks are streamed to a single fastavro reader behind a header declaring the null codec,
+    so only decoding is left to the consuming thread. `fo` must have been opened by open_input.
+    """
+    chunks = prefetch(functools.partial(_read_decompressed_block, fo, header), blocks, depth)
+    stream = io.BufferedReader(_ChunkStream(_null_codec_header(header), chunks))
+    yield from _reader(stream, reader_schema)
+
+
+def _reader(fo: T.IO[bytes], reader_schema: T.Optional[T.Dict]) -> T.Iterator[T.Dict]:
+    # Records of a container are records, while fastavro types them as any Avro value
+    return T.cast(T.Iterator[T.Dict], fastavro.reader(fo, reader_schema))
+
+
+def _null_codec_header(header: AvroHeader) -> bytes:
+    """
+    Encode the header of the same container, with the null codec.
+    """
+    if header.codec == "null":
+        return header.raw
+    metadata = {key: value.encode() for key, value in header.metadata.items()}
+    metadata["avro.codec"] = b"null"
+    buffer = io.BytesIO()
+    fastavro.schemaless_writer(buffer, _parsed_header_schema(), {"magic": MAGIC, "meta": metadata,
+                                                                 "sync": header.sync})
+    return buffer.getvalue()
+
+
+@functools.lru_cache(maxsize=None)
+def _parsed_header_schema() -> T.Dict:
+    return T.cast(T.Dict, fastavro.parse_schema(HEADER_SCHEMA))
+
+
+def read_payload(fo: T.BinaryIO, header: AvroHeader, block: AvroBlock) -> T.Tuple[int, bytes]:
+    """
+    Read a block and decompress its payload, returning its number of records and their encoded bytes.
+    Safe to call from several threads at once, `fo` must have been opened by open_input.
+    """
+    with profile.span("read"):
+        raw = read_at(fo, block.offset, block.size)
+    profile.count("bytes_read", len(raw))
+    buffer = io.BytesIO(raw)
+    num_records = read_long(buffer)
+    if num_records is None:
+        raise EOFError(f"Truncated block at offset {block.offset}.")
+    # The reader of the codec reads the payload size and the payload, and returns the decompressed data
+    data = BLOCK_READERS[header.codec](buffer)
+    return num_records, data.getvalue() if isinstance(data, io.BytesIO) else bytes(data)
+
+
+def _read_decompressed_block(fo: T.BinaryIO, header: AvroHeader, block: AvroBlock) -> bytes:
+    """
+    Read a block and decompress its payload, returning it encoded as a block of the null codec.
+    """
+    if header.codec == "null":
+        with profile.span("read"):
+            raw = read_at(fo, block.offset, block.size)
+        profile.count("bytes_read", len(raw))
+        return raw
+    num_records, data = read_payload(fo, header, block)
+    return b"".join([encode_long(num_records), encode_long(len(data)), data, header.sync])
+
+
+class _ChunkStream(io.RawIOBase):
+    """
+    A read-only stream over the header bytes followed by the chunks of an iterator.
+    """
+
+    def __init__(self, head: bytes, chunks: T.Iterator[bytes]):
+        super().__init__()
+        self._chunk = memoryview(head)
+        self._chunks = chunks
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._chunk:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._chunk = memoryview(chunk)
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+
+def _read_runs(fo: T.BinaryIO, blocks: T.Iterable[AvroBlock], max_run_size: int = MAX_RUN_SIZE) -> T.Iterator[bytes]:
+    """
+    Read the raw bytes of the given blocks, coalescing contiguous blocks into reads of up to `max_run_size` bytes.
+    """
+    # Blocks are never empty, so a run is pending whenever it ends after its start
+    start = end = 0
+    for block in blocks:
+        if block.offset != end or block.end - start > max_run_size:
+            if end > start:
+                yield _read_run(fo, start, end)
+            start = block.offset
+        end = block.end
+    if end > start:
+        yield _read_run(fo, start, end)
+
+
+def _read_run(fo: T.BinaryIO, start: int, end: int) -> bytes:
+    with profile.span("read"):
+        fo.seek(start)
+        raw = fo.read(end - start)
+    profile.count("bytes_read", len(raw))
+    return raw
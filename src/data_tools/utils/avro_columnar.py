@@ -0,0 +1,811 @@
+"""
+Decode Avro records straight into Arrow arrays, without building a Python object per record or per value.
+
+The writer schema is compiled once into the source of a Python function walking a batch of records. The walk
+only moves a position over the bytes, with no call per value or per field, and keeps the positions where
+NumPy cannot find its way: the start of every record and of every item of a collection, and the end of every
+collection. From those, every column locates its values with vectorized operations, each one starting where
+the previous one ends, decodes them and hands them to Arrow as buffers.
+
+Integers are varints of unknown size; their lengths are looked up in a table computed once per buffer of
+blocks, see _varint_lengths.
+"""
+import array
+import itertools
+import os
+import typing as T
+
+from data_tools.utils import profile
+from data_tools.utils.lazy import LazyModule
+
+if T.TYPE_CHECKING:
+    import numpy as np
+    import pyarrow as pa
+else:
+    np = LazyModule("numpy")
+    pa = LazyModule("pyarrow")
+
+# Set to "fastavro" to decode records with fastavro into Python dicts. An environment variable, so that worker
+# processes follow the choice of the command like with DATA_TOOLS_MMAP.
+ENGINE_ENV = "DATA_TOOLS_AVRO_ENGINE"
+ENGINES = ("columnar", "fastavro")
+
+Schema = T.Union[str, T.List, T.Dict]
+
+# A long takes at most 10 bytes
+MAX_VARINT_SIZE = 10
+VARINT_CHUNK_SIZE = 1 << 16
+
+
+def engine() -> str:
+    name = os.environ.get(ENGINE_ENV, "columnar")
+    if name not in ENGINES:
+        raise ValueError("Unknown Avro engine: {}".format(name))
+    return name
+
+
+def iter_batches(payloads: T.Iterable[T.Tuple[int, bytes]], schema: T.Dict, batch_size: int,
+                 columns: T.Optional[T.Sequence[str]] = None) -> T.Iterator["pa.RecordBatch"]:
+    """
+    Decode the (number of records, decompressed payload) of consecutive blocks into record batches of
+    `batch_size` rows, with the given top-level columns of the writer schema only.
+    Batches span blocks, like the ones built from fastavro records.
+    """
+    decode = compile_decoder(schema, columns)
+    pending = []
+    num_pending = 0
+    for num_records, data in _join_payloads(payloads, batch_size):
+        pos = 0
+        while num_records:
+            num_rows = min(batch_size - num_pending, num_records)
+            # The records left fill the rest of the data
+            size_hint = -(-(len(data) - pos) * num_rows // num_records)
+            batch, pos = decode(data, pos, num_rows, size_hint)
+            num_records -= num_rows
+            pending.append(batch)
+            num_pending += num_rows
+            if num_pending == batch_size:
+                yield _combine(pending)
+                pending = []
+                num_pending = 0
+    if pending:
+        yield _combine(pending)
+
+
+def _join_payloads(payloads: T.Iterable[T.Tuple[int, bytes]],
+                   num_rows: int) -> T.Iterator[T.Tuple[int, bytes]]:
+    """
+    Join the payloads of consecutive blocks until they hold at least `num_rows` records,
+    records never span blocks. Decoding has a cost per call, which small blocks would pay for every few records.
+    """
+    chunks = []
+    num_records = 0
+    for block_records, payload in payloads:
+        chunks.append(payload)
+        num_records += block_records
+        if num_records >= num_rows:
+            yield num_records, b"".join(chunks)
+            chunks = []
+            num_records = 0
+    if num_records:
+        yield num_records, b"".join(chunks)
+
+
+def _combine(batches: T.List["pa.RecordBatch"]) -> "pa.RecordBatch":
+    if len(batches) == 1:
+        batch = batches[0]
+    else:
+        with profile.span("arrow"):
+            batch = pa.Table.from_batches(batches).combine_chunks().to_batches()[0]
+    profile.count("rows_decoded", batch.num_rows)
+    return batch
+
+
+def compile_decoder(schema: T.Dict, columns: T.Optional[T.Sequence[str]] = None) -> T.Callable:
+    """
+    Compile an Avro record schema into decode(data, pos, num_rows, size_hint) -> (record batch, position after
+    the rows), `size_hint` being the expected size in bytes of the rows.
+
+    The batch follows avro_to_arrow_schema, with the given top-level columns only, in the given order;
+    the other fields are skipped over.
+    """
+    from data_tools.utils.avro_arrow import avro_to_arrow_schema
+    from data_tools.utils.avro_schema import project_schema
+
+    selected = list(columns or [field["name"] for field in schema["fields"]])
+    arrow_schema = avro_to_arrow_schema(project_schema(schema, selected))
+    full_name = _full_name(schema["name"], schema.get("namespace", ""))
+    named = {full_name: schema}
+    namespace = full_name.rpartition(".")[0]
+    fields = {}
+    steps = []
+    for field in schema["fields"]:
+        if field["name"] in selected:
+            fields[field["name"]] = _compile(field["type"], named, namespace)
+            steps.append(fields[field["name"]])
+        else:
+            # Named types defined in skipped fields may be used by the following ones
+            _define_all(field["type"], named, namespace)
+            steps.append(_Skip(field["type"], named, namespace))
+
+    code = _Code()
+    rows = array.array("q")
+    code.add(2, f"{code.appender(rows)}(pos)")
+    for step in steps:
+        step.emit_walk(code, 2)
+    walk = code.function()
+
+    def decode(data, pos, num_rows, size_hint):
+        with profile.span("decode"):
+            # The lengths of varints are computed for the expected rows only, with some margin
+            size = size_hint + size_hint // 4 + MAX_VARINT_SIZE
+            while True:
+                window = memoryview(data)[pos:pos + size]
+                lengths = varint_lengths(window)
+                try:
+                    end = walk(window, memoryview(lengths), 0, num_rows)
+                except IndexError:
+                    end = None
+                # Strings are skipped over without reading them, the last one may end past the window
+                if end is not None and (end < len(window) or pos + end == len(data)):
+                    break
+                code.clear()
+                if pos + len(window) >= len(data):
+                    raise ValueError("Truncated or invalid Avro data.")
+                size *= 2
+            buffer = np.frombuffer(window, dtype=np.uint8)
+            starts = _positions(rows)
+            for step in steps:
+                starts = step.locate(buffer, lengths, starts)
+        with profile.span("arrow"):
+            arrays = [fields[name].finish(buffer, lengths, None) for name in selected]
+            return pa.RecordBatch.from_arrays(arrays, schema=arrow_schema), pos + end
+
+    return decode
+
+
+class _Code:
+    """
+    The source of the function walking records, and the objects it uses.
+    """
+
+    def __init__(self):
+        self.lines = []
+        self.bound = {"read_long": _read_long}
+        self.arrays = []
+        self._ids = itertools.count()
+        # Functions moving past the values of records containing themselves, by full name of the record
+        self.skippers: T.Dict[str, str] = {}
+        self.skipper_lines: T.List[str] = []
+
+    def appender(self, values: "array.array") -> str:
+        """
+        Return the name of the append method of an array of positions filled while walking.
+        """
+        # Bound objects become default arguments of the function, looked up as fast as its locals
+        name = f"append_{next(self._ids)}"
+        self.bound[name] = values.append
+        self.arrays.append(values)
+        return name
+
+    def clear(self) -> None:
+        # After a failed walk
+        for values in self.arrays:
+            del values[:]
+
+    def variable(self, prefix: str) -> str:
+        return f"{prefix}_{next(self._ids)}"
+
+    def add(self, indent: int, *lines: str) -> None:
+        self.lines.extend("    " * indent + line for line in lines)
+
+    def emit_long(self, indent: int, target: str) -> None:
+        # Inline the common case of a single byte varint
+        self.add(indent,
+                 "byte = data[pos]",
+                 "if byte < 0x80:",
+                 f"    {target} = (byte >> 1) ^ -(byte & 1)",
+                 "    pos += 1",
+                 "else:",
+                 f"    {target}, pos = read_long(data, pos)")
+
+    def emit_skip_bytes(self, indent: int) -> None:
+        # A single byte holds lengths up to 63; negative ones are rejected when locating the values
+        self.add(indent,
+                 "byte = data[pos]",
+                 "if byte < 0x80:",
+                 "    pos += (byte >> 1) + 1",
+                 "else:",
+                 "    length, pos = read_long(data, pos)",
+                 "    pos += length")
+
+    def skipper(self, full_name: str, emit: T.Callable[["_Code", int], None]) -> str:
+        """
+        Return the name of the function moving past a value of the named record, its body emitted by `emit`.
+        The code of a record containing itself cannot be inlined, its nested values are skipped by calls.
+        """
+        if full_name not in self.skippers:
+            name = f"skip_{next(self._ids)}"
+            # Registered first, the body calls the function for nested values
+            self.skippers[full_name] = name
+            lines, self.lines = self.lines, []
+            self.add(0, f"def {name}(data, lengths, pos):")
+            emit(self, 1)
+            self.add(1, "return pos")
+            self.skipper_lines.extend(self.lines)
+            self.lines = lines
+        return self.skippers[full_name]
+
+    def function(self) -> T.Callable[[bytes, memoryview, int, int], int]:
+        arguments = ", ".join(f"{name}={name}" for name in self.bound)
+        source = "\n".join([
+            *self.skipper_lines,
+            f"def walk(data, lengths, pos, num_rows, {arguments}):",
+            "    for _ in range(num_rows):",
+            *self.lines,
+            "    return pos",
+        ])
+        namespace = dict(self.bound)
+        exec(compile(source, "<avro decoder>", "exec"), namespace)
+        return namespace["walk"]
+
+
+def _full_name(name: str, namespace: str) -> str:
+    if "." in name or not namespace:
+        return name
+    return f"{namespace}.{name}"
+
+
+def _read_long(data: bytes, pos: int) -> T.Tuple[int, int]:
+    b = data[pos]
+    n = b & 0x7F
+    shift = 7
+    while b & 0x80:
+        pos += 1
+        b = data[pos]
+        n |= (b & 0x7F) << shift
+        shift += 7
+    return (n >> 1) ^ -(n & 1), pos + 1
+
+
+def varint_lengths(data: T.Union[bytes, memoryview]) -> "np.ndarray":
+    """
+    Map every position of the data to the length of a varint starting there: one byte, plus one per byte
+    with the continuation bit in a row from there on.
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    lengths = np.empty(len(buffer), dtype=np.uint8)
+    # In chunks, keeping the temporary arrays small; a varint starting in a chunk may end in the next one
+    for start in range(0, len(buffer), VARINT_CHUNK_SIZE):
+        continued = buffer[start:start + VARINT_CHUNK_SIZE + MAX_VARINT_SIZE - 1] >= 0x80
+        chunk_lengths = np.ones(len(continued), dtype=np.uint8)
+        # The positions followed by at least i bytes with the continuation bit, i included
+        run = continued.copy()
+        for i in range(1, MAX_VARINT_SIZE):
+            if not run.any():
+                break
+            chunk_lengths += run
+            run[:-i] &= continued[i:]
+            run[-i:] = False
+        lengths[start:start + VARINT_CHUNK_SIZE] = chunk_lengths[:VARINT_CHUNK_SIZE]
+    return lengths
+
+
+def _positions(values: "array.array") -> "np.ndarray":
+    # Arrays of machine integers take 8 bytes per position, where lists would keep an int object for each
+    positions = np.array(values, dtype=np.int64)
+    del values[:]
+    return positions
+
+
+# Positions are int64 arrays with one entry per occurrence of a value, -1 where it is absent: in the rows where
+# an enclosing union holds null. Absent values are located nowhere and decoded as zeros or empty values.
+
+def _shift(starts: "np.ndarray", sizes: T.Union[int, "np.ndarray"]) -> "np.ndarray":
+    return np.where(starts >= 0, starts + sizes, -1)
+
+
+def _varints_after(lengths: "np.ndarray", starts: "np.ndarray") -> "np.ndarray":
+    return np.where(starts >= 0, starts + lengths[np.maximum(starts, 0)], -1)
+
+
+def _decode_varints(data: "np.ndarray", lengths: "np.ndarray", starts: "np.ndarray") -> "np.ndarray":
+    """
+    Decode the zig-zag varints at the given positions.
+    """
+    values = np.zeros(len(starts), dtype=np.uint64)
+    if not len(starts):
+        return values.view(np.int64)
+    valid = starts >= 0
+    starts = np.where(valid, starts, 0)
+    sizes = np.where(valid, lengths[starts], 0)
+    for i in range(int(sizes.max())):
+        selected = sizes > i
+        groups = data[starts[selected] + i] & np.uint8(0x7F)
+        values[selected] |= groups.astype(np.uint64) << np.uint64(7 * i)
+    return (values >> np.uint64(1)).view(np.int64) ^ -(values & np.uint64(1)).view(np.int64)
+
+
+def _validity_buffer(validity: T.Optional["np.ndarray"]) -> T.Optional["pa.Buffer"]:
+    if validity is None:
+        return None
+    return pa.py_buffer(np.packbits(validity, bitorder="little"))
+
+
+def _mask(validity: T.Optional["np.ndarray"]) -> T.Optional["pa.Array"]:
+    return None if validity is None else pa.array(~validity)
+
+
+class _Column:
+    """
+    One Arrow column: emits the code walking past its values, then locates and decodes them.
+    """
+
+    def emit_walk(self, code: _Code, indent: int) -> None:
+        raise NotImplementedError
+
+    def emit_null(self, code: _Code, indent: int) -> None:
+        """
+        Emit the code keeping the place of a value in a null branch, for columns keeping positions.
+        """
+
+    def locate(self, data: "np.ndarray", lengths: "np.ndarray", starts: "np.ndarray") -> "np.ndarray":
+        """
+        Take the positions of the values of the batch, returning the positions right after them.
+        """
+        raise NotImplementedError
+
+    def finish(self, data: "np.ndarray", lengths: "np.ndarray", validity: T.Optional["np.ndarray"]) -> "pa.Array":
+        raise NotImplementedError
+
+
+class _VarintColumn(_Column):
+    def __init__(self, arrow_type: "pa.DataType"):
+        self.arrow_type = arrow_type
+
+    def emit_walk(self, code, indent):
+        code.add(indent, "pos += lengths[pos]")
+
+    def locate(self, data, lengths, starts):
+        self.starts = starts
+        return _varints_after(lengths, starts)
+
+    def finish(self, data, lengths, validity):
+        values = _decode_varints(data, lengths, self.starts).astype(f"int{self.arrow_type.bit_width}")
+        return pa.Array.from_buffers(self.arrow_type, len(values), [_validity_buffer(validity), pa.py_buffer(values)])
+
+
+class _FixedColumn(_Column):
+    """
+    Values of `width` bytes: booleans, floats, doubles and fixed.
+    """
+
+    def __init__(self, arrow_type: "pa.DataType", width: int):
+        self.arrow_type = arrow_type
+        self.width = width
+
+    def emit_walk(self, code, indent):
+        code.add(indent, f"pos += {self.width}")
+
+    def locate(self, data, lengths, starts):
+        self.starts = starts
+        return _shift(starts, self.width)
+
+    def finish(self, data, lengths, validity):
+        valid = self.starts >= 0
+        values = np.zeros((len(self.starts), self.width), dtype=np.uint8)
+        values[valid] = data[self.starts[valid, None] + np.arange(self.width)]
+        if pa.types.is_boolean(self.arrow_type):
+            return pa.array(values[:, 0] != 0, mask=None if validity is None else ~validity)
+        buffers = [_validity_buffer(validity), pa.py_buffer(values)]
+        return pa.Array.from_buffers(self.arrow_type, len(self.starts), buffers)
+
+
+class _BinaryColumn(_Column):
+    def __init__(self, arrow_type: "pa.DataType"):
+        self.arrow_type = arrow_type
+
+    def emit_walk(self, code, indent):
+        code.emit_skip_bytes(indent)
+
+    def locate(self, data, lengths, starts):
+        self.sizes = _decode_varints(data, lengths, starts)
+        if len(self.sizes) and self.sizes.min() < 0:
+            raise ValueError("Invalid negative length of {} value.".format(self.arrow_type))
+        # The values follow their length
+        self.starts = _varints_after(lengths, starts)
+        return _shift(self.starts, self.sizes)
+
+    def finish(self, data, lengths, validity):
+        offsets = np.zeros(len(self.sizes) + 1, dtype=np.int64)
+        np.cumsum(self.sizes, out=offsets[1:])
+        # The position in the data of every byte of the values, one run per value
+        index_type = np.int32 if len(data) <= np.iinfo(np.int32).max else np.int64
+        shifts = (self.starts - offsets[:-1]).astype(index_type)
+        values = data[np.repeat(shifts, self.sizes) + np.arange(offsets[-1], dtype=index_type)]
+        large = offsets[-1] > np.iinfo(np.int32).max
+        if large:
+            array_type = pa.large_string() if pa.types.is_string(self.arrow_type) else pa.large_binary()
+        else:
+            array_type = self.arrow_type
+            offsets = offsets.astype(np.int32)
+        buffers = [_validity_buffer(validity), pa.py_buffer(offsets), pa.py_buffer(values)]
+        array = pa.Array.from_buffers(array_type, len(self.sizes), buffers)
+        if pa.types.is_string(array_type) or pa.types.is_large_string(array_type):
+            # Strings are not checked while walking; fastavro fails on invalid UTF-8 as well
+            array.validate(full=True)
+        return array.cast(self.arrow_type) if large else array
+
+
+class _NullColumn(_Column):
+    def emit_walk(self, code, indent):
+        pass
+
+    def locate(self, data, lengths, starts):
+        self.num_values = len(starts)
+        return starts
+
+    def finish(self, data, lengths, validity):
+        return pa.nulls(self.num_values)
+
+
+class _EnumColumn(_VarintColumn):
+    def __init__(self, symbols: T.Sequence[str]):
+        super().__init__(pa.int32())
+        self.symbols = pa.array(symbols, pa.string())
+
+    def finish(self, data, lengths, validity):
+        return self.symbols.take(super().finish(data, lengths, validity))
+
+
+class _DecimalColumn(_Column):
+    def __init__(self, arrow_type: "pa.DataType", size: T.Optional[int]):
+        # Unscaled values are big-endian two's complement integers, of a fixed size or length-prefixed
+        self.arrow_type = arrow_type
+        self.raw = _FixedColumn(pa.binary(size), size) if size else _BinaryColumn(pa.binary())
+
+    def emit_walk(self, code, indent):
+        self.raw.emit_walk(code, indent)
+
+    def locate(self, data, lengths, starts):
+        return self.raw.locate(data, lengths, starts)
+
+    def finish(self, data, lengths, validity):
+        starts = self.raw.starts
+        if isinstance(self.raw, _FixedColumn):
+            sizes = np.where(starts >= 0, self.raw.width, 0)
+        else:
+            sizes = self.raw.sizes
+        ends = starts + sizes
+        # Decimal128 values are 16-byte little-endian two's complement integers: the bytes are reversed into
+        # their place and negative values are sign-extended. Precision fits 16 bytes, longer values only
+        # repeat the sign in their leading bytes.
+        unscaled = np.zeros((len(starts), 16), dtype=np.uint8)
+        negative = sizes > 0
+        negative[negative] = data[starts[negative]] >= 0x80
+        unscaled[negative] = 0xFF
+        for i in range(min(16, int(sizes.max(initial=0)))):
+            has_byte = sizes > i
+            unscaled[has_byte, i] = data[ends[has_byte] - 1 - i]
+        buffers = [_validity_buffer(validity), pa.py_buffer(unscaled)]
+        return pa.Array.from_buffers(self.arrow_type, len(starts), buffers)
+
+
+class _RecordColumn(_Column):
+    def __init__(self, names: T.List[str], fields: T.List[_Column]):
+        self.names = names
+        self.fields = fields
+
+    def emit_walk(self, code, indent):
+        for field in self.fields:
+            field.emit_walk(code, indent)
+
+    def emit_null(self, code, indent):
+        for field in self.fields:
+            field.emit_null(code, indent)
+
+    def locate(self, data, lengths, starts):
+        for field in self.fields:
+            starts = field.locate(data, lengths, starts)
+        return starts
+
+    def finish(self, data, lengths, validity):
+        arrays = [field.finish(data, lengths, None) for field in self.fields]
+        return pa.StructArray.from_arrays(arrays, self.names, mask=_mask(validity))
+
+
+class _CollectionColumn(_Column):
+    """
+    Arrays (items: the values) and maps (items: the keys, then the values), written as blocks of items.
+    The walk keeps the start of every item, the number of items and the end of the collection.
+    """
+
+    def __init__(self, items: T.List[_Column], build: T.Callable):
+        self.items = items
+        self.build = build
+        self.item_starts = array.array("q")
+        self.item_counts = array.array("q")
+        self.after = array.array("q")
+
+    def emit_walk(self, code, indent):
+        total = code.variable("total")
+        count = code.variable("count")
+        code.add(indent, f"{total} = 0", "while True:")
+        code.emit_long(indent + 1, count)
+        code.add(indent + 1,
+                 f"if not {count}:",
+                 "    break",
+                 # A negative count is followed by the size of the block in bytes
+                 f"if {count} < 0:",
+                 f"    {count} = -{count}",
+                 "    pos = read_long(data, pos)[1]",
+                 f"{total} += {count}",
+                 f"for _ in range({count}):",
+                 f"    {code.appender(self.item_starts)}(pos)")
+        for item in self.items:
+            item.emit_walk(code, indent + 2)
+        code.add(indent, f"{code.appender(self.item_counts)}({total})", f"{code.appender(self.after)}(pos)")
+
+    def emit_null(self, code, indent):
+        code.add(indent, f"{code.appender(self.item_counts)}(0)", f"{code.appender(self.after)}(-1)")
+
+    def locate(self, data, lengths, starts):
+        self.counts = _positions(self.item_counts)
+        item_starts = _positions(self.item_starts)
+        for item in self.items:
+            item_starts = item.locate(data, lengths, item_starts)
+        return _positions(self.after)
+
+    def finish(self, data, lengths, validity):
+        offsets = np.zeros(len(self.counts) + 1, dtype=np.int32)
+        np.cumsum(self.counts, out=offsets[1:])
+        arrays = [item.finish(data, lengths, None) for item in self.items]
+        # A null offset makes a null collection, null collections have no items
+        mask = None if validity is None else np.append(~validity, False)
+        return self.build(pa.array(offsets, mask=mask), *arrays)
+
+
+class _NullableColumn(_Column):
+    """
+    A union of null and one other type, its branch indexes are zig-zag encoded in a single byte.
+    """
+
+    def __init__(self, value: _Column, null_index: int):
+        self.value = value
+        self.null_byte = 2 * null_index
+        self.value_byte = 2 * (1 - null_index)
+
+    def emit_walk(self, code, indent):
+        code.add(indent,
+                 f"if data[pos] == {self.null_byte}:",
+                 "    pos += 1")
+        self.value.emit_null(code, indent + 1)
+        code.add(indent,
+                 "else:",
+                 "    pos += 1")
+        self.value.emit_walk(code, indent + 1)
+
+    def emit_null(self, code, indent):
+        self.value.emit_null(code, indent)
+
+    def locate(self, data, lengths, starts):
+        present = starts >= 0
+        branches = data[np.maximum(starts, 0)]
+        invalid = present & (branches != self.null_byte) & (branches != self.value_byte)
+        if invalid.any():
+            position = int(starts[invalid][0])
+            raise ValueError(f"Invalid union branch {_read_long(data, position)[0]} at {position}.")
+        self.validity = present & (branches == self.value_byte)
+        after = self.value.locate(data, lengths, np.where(self.validity, starts + 1, -1))
+        return np.where(self.validity, after, _shift(starts, 1))
+
+    def finish(self, data, lengths, validity):
+        own_validity = self.validity if validity is None else self.validity & validity
+        return self.value.finish(data, lengths, own_validity)
+
+
+class _SingleBranchColumn(_Column):
+    """
+    A union of a single type, read as that type after the branch index.
+    """
+
+    def __init__(self, value: _Column):
+        self.value = value
+
+    def emit_walk(self, code, indent):
+        code.add(indent, "pos += 1")
+        self.value.emit_walk(code, indent)
+
+    def emit_null(self, code, indent):
+        self.value.emit_null(code, indent)
+
+    def locate(self, data, lengths, starts):
+        if (data[starts[starts >= 0]] != 0).any():
+            raise ValueError("Invalid union branch of a single branch union.")
+        return self.value.locate(data, lengths, _shift(starts, 1))
+
+    def finish(self, data, lengths, validity):
+        return self.value.finish(data, lengths, validity)
+
+
+class _Skip(_Column):
+    """
+    A field that is not decoded. It is walked over with generated code handling any type, keeping its end.
+    """
+
+    def __init__(self, schema: Schema, named: T.Dict[str, T.Dict], namespace: str):
+        self.schema = schema
+        self.named = named
+        self.namespace = namespace
+        self.after = array.array("q")
+
+    def emit_walk(self, code, indent):
+        _emit_skip(self.schema, self.named, self.namespace, code, indent)
+        code.add(indent, f"{code.appender(self.after)}(pos)")
+
+    def locate(self, data, lengths, starts):
+        return _positions(self.after)
+
+
+PRIMITIVE_COLUMNS: T.Dict[str, T.Callable[[], _Column]] = {
+    "null": _NullColumn,
+    "boolean": lambda: _FixedColumn(pa.bool_(), 1),
+    "int": lambda: _VarintColumn(pa.int32()),
+    "long": lambda: _VarintColumn(pa.int64()),
+    "float": lambda: _FixedColumn(pa.float32(), 4),
+    "double": lambda: _FixedColumn(pa.float64(), 8),
+    "bytes": lambda: _BinaryColumn(pa.binary()),
+    "string": lambda: _BinaryColumn(pa.string()),
+}
+
+
+def _define(schema: T.Dict, named: T.Dict[str, T.Dict], namespace: str) -> str:
+    """
+    Register a named type, returning the namespace of its own fields.
+    """
+    full_name = _full_name(schema["name"], schema.get("namespace", namespace))
+    named[full_name] = schema
+    return full_name.rpartition(".")[0]
+
+
+def _define_all(schema: Schema, named: T.Dict[str, T.Dict], namespace: str) -> None:
+    """
+    Register the named types defined anywhere in the given type.
+    """
+    if isinstance(schema, list):
+        for branch in schema:
+            _define_all(branch, named, namespace)
+    elif isinstance(schema, dict):
+        if schema["type"] in ("record", "error", "enum", "fixed"):
+            inner_namespace = _define(schema, named, namespace)
+            for field in schema.get("fields", []):
+                _define_all(field["type"], named, inner_namespace)
+        elif schema["type"] == "array":
+            _define_all(schema["items"], named, namespace)
+        elif schema["type"] == "map":
+            _define_all(schema["values"], named, namespace)
+
+
+def _resolve(schema: str, named: T.Dict[str, T.Dict], namespace: str) -> T.Tuple[T.Dict, str]:
+    for name in (_full_name(schema, namespace), schema):
+        if name in named:
+            return named[name], name.rpartition(".")[0]
+    raise ValueError("Unsupported type: {}".format(schema))
+
+
+def _compile(schema: Schema, named: T.Dict[str, T.Dict], namespace: str) -> _Column:
+    from data_tools.utils.avro_arrow import LOGICAL_TYPES
+
+    if isinstance(schema, str):
+        if schema in PRIMITIVE_COLUMNS:
+            return PRIMITIVE_COLUMNS[schema]()
+        # Every use of a named type is a column of its own
+        definition, definition_namespace = _resolve(schema, named, namespace)
+        return _compile(definition, named, definition_namespace)
+
+    if isinstance(schema, list):
+        branches = [branch for branch in schema if branch != "null"]
+        if len(branches) > 1 or len(schema) > 2:
+            raise ValueError("Unsupported union type: {}".format(schema))
+        value = _compile(branches[0], named, namespace) if branches else _NullColumn()
+        return _NullableColumn(value, schema.index("null")) if len(schema) == 2 else _SingleBranchColumn(value)
+
+    logical_type = schema.get("logicalType")
+    if logical_type in LOGICAL_TYPES:
+        return _VarintColumn(LOGICAL_TYPES[logical_type])
+    if logical_type == "decimal" and schema.get("precision", 0) <= 38:
+        if schema["type"] == "fixed":
+            _define(schema, named, namespace)
+        arrow_type = pa.decimal128(schema["precision"], schema.get("scale", 0))
+        return _DecimalColumn(arrow_type, schema["size"] if schema["type"] == "fixed" else None)
+
+    type_name = schema["type"]
+    if type_name == "record" or type_name == "error":
+        record_namespace = _define(schema, named, namespace)
+        fields = [_compile(field["type"], named, record_namespace) for field in schema["fields"]]
+        return _RecordColumn([field["name"] for field in schema["fields"]], fields)
+    elif type_name == "enum":
+        _define(schema, named, namespace)
+        return _EnumColumn(schema["symbols"])
+    elif type_name == "fixed":
+        _define(schema, named, namespace)
+        return _FixedColumn(pa.binary(schema["size"]), schema["size"])
+    elif type_name == "array":
+        return _CollectionColumn([_compile(schema["items"], named, namespace)], pa.ListArray.from_arrays)
+    elif type_name == "map":
+        values = _compile(schema["values"], named, namespace)
+        return _CollectionColumn([_BinaryColumn(pa.string()), values], pa.MapArray.from_arrays)
+    else:
+        # A primitive type written in its object form, e.g. {"type": "string"}
+        return _compile(type_name, named, namespace)
+
+
+# Types of a fixed size, in bytes
+FIXED_SIZES = {"null": 0, "boolean": 1, "float": 4, "double": 8}
+
+
+def _emit_skip(schema: Schema, named: T.Dict[str, T.Dict], namespace: str, code: _Code, indent: int,
+               records: T.Tuple[str, ...] = ()) -> None:
+    """
+    Emit the code moving past a value of the given type, nested in the given records (full names).
+    """
+    if isinstance(schema, str):
+        if schema in ("int", "long"):
+            code.add(indent, "pos += lengths[pos]")
+        elif schema in ("bytes", "string"):
+            code.emit_skip_bytes(indent)
+        elif schema in FIXED_SIZES:
+            code.add(indent, f"pos += {FIXED_SIZES[schema]}")
+        else:
+            definition, definition_namespace = _resolve(schema, named, namespace)
+            _emit_skip(definition, named, definition_namespace, code, indent, records)
+        return
+
+    if isinstance(schema, list):
+        index = code.variable("index")
+        code.emit_long(indent, index)
+        for i, branch in enumerate(schema):
+            code.add(indent, f"{'if' if i == 0 else 'elif'} {index} == {i}:", "    pass")
+            _emit_skip(branch, named, namespace, code, indent + 1, records)
+        code.add(indent, "else:", f"    raise ValueError(f'Invalid union branch {{{index}}} at {{pos}}.')")
+        return
+
+    type_name = schema["type"]
+    if type_name == "record" or type_name == "error":
+        full_name = _full_name(schema["name"], schema.get("namespace", namespace))
+        record_namespace = _define(schema, named, namespace)
+        if full_name in records:
+            def emit_fields(code: _Code, indent: int) -> None:
+                for field in schema["fields"]:
+                    _emit_skip(field["type"], named, record_namespace, code, indent, (full_name,))
+
+            code.add(indent, f"pos = {code.skipper(full_name, emit_fields)}(data, lengths, pos)")
+        else:
+            for field in schema["fields"]:
+                _emit_skip(field["type"], named, record_namespace, code, indent, records + (full_name,))
+    elif type_name == "enum":
+        _define(schema, named, namespace)
+        code.add(indent, "pos += lengths[pos]")
+    elif type_name == "fixed":
+        _define(schema, named, namespace)
+        code.add(indent, f"pos += {schema['size']}")
+    elif type_name == "array" or type_name == "map":
+        count = code.variable("count")
+        code.add(indent, "while True:")
+        code.emit_long(indent + 1, count)
+        code.add(indent + 1,
+                 f"if not {count}:",
+                 "    break",
+                 # The size of the block allows skipping all its items at once
+                 f"if {count} < 0:",
+                 "    size, pos = read_long(data, pos)",
+                 "    pos += size",
+                 "    continue",
+                 f"for _ in range({count}):")
+        if type_name == "map":
+            _emit_skip("string", named, namespace, code, indent + 2)
+            _emit_skip(schema["values"], named, namespace, code, indent + 2, records)
+        else:
+            _emit_skip(schema["items"], named, namespace, code, indent + 2, records)
+    else:
+        _emit_skip(type_name, named, namespace, code, indent, records)
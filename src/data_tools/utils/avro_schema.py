@@ -0,0 +1,47 @@
+import typing as T
+
+import fastavro.schema
+
+NAMED_TYPES = ("record", "error", "enum", "fixed")
+
+
+def project_schema(schema: T.Dict, columns: T.Sequence[str]) -> T.Dict:
+    """
+    Build a reader schema keeping only the given top-level fields of a record schema, in the given order.
+
+    Decoding with it, fastavro skips the other fields instead of building Python objects for them.
+    Named types defined in dropped fields are inlined where the kept fields use them.
+    """
+    expanded = fastavro.schema.expand_schema(schema)
+    fields = {field["name"]: field for field in expanded["fields"]}
+    unknown = [column for column in columns if column not in fields]
+    if unknown:
+        raise ValueError("Unknown columns: {}".format(", ".join(unknown)))
+
+    # Expanding inlines every reference, keep the first definition of each named type only
+    defined = {expanded["name"]}
+    projected_fields = [{**fields[column], "type": _dedupe(fields[column]["type"], defined)} for column in columns]
+    return {**expanded, "fields": projected_fields}
+
+
+def _dedupe(schema: T.Union[str, T.List, T.Dict], defined: T.Set[str]) -> T.Union[str, T.List, T.Dict]:
+    if isinstance(schema, list):
+        return [_dedupe(branch, defined) for branch in schema]
+    if not isinstance(schema, dict):
+        return schema
+
+    type_name = schema["type"]
+    if type_name in NAMED_TYPES:
+        # Names are fully qualified once expanded
+        if schema["name"] in defined:
+            return schema["name"]
+        defined.add(schema["name"])
+        if type_name == "record" or type_name == "error":
+            fields = [{**field, "type": _dedupe(field["type"], defined)} for field in schema["fields"]]
+            return {**schema, "fields": fields}
+        return schema
+    elif type_name == "array":
+        return {**schema, "items": _dedupe(schema["items"], defined)}
+    elif type_name == "map":
+        return {**schema, "values": _dedupe(schema["values"], defined)}
+    return schema
@@ -1,201 +1,88 @@
+from __future__ import annotations
+
+import functools
+import io
+import itertools
+import os
 import random
-import string
-import timeit
+import sys
 import typing as T
 from pathlib import Path
 
-import duckdb
 import fastavro
-import pyarrow as pa
+
+from data_tools.utils import avro_columnar, profile
+from data_tools.utils.avro_blocks import (AvroBlock, AvroHeader, iter_blocks, iter_range_blocks, prefetch_records,
+                                          read_header, read_payload, read_records, split_ranges)
+from data_tools.utils.fileio import open_input, prefetch_depth
+from data_tools.utils.generators import compile_generator
+from data_tools.utils.lazy import LazyModule
+from data_tools.utils.parallel import ordered_map, prefetch
+
+if T.TYPE_CHECKING:
+    import duckdb
+    import numpy as np
+    import pyarrow as pa
+
+    from data_tools.utils.stats import TableStats
+else:
+    duckdb = LazyModule("duckdb")
+    np = LazyModule("numpy")
+    pa = LazyModule("pyarrow")
+
+# Splitting into more ranges than workers keeps them busy when ranges decode at different speeds
+RANGES_PER_JOB = 4
+# Approximate size in bytes of the Avro blocks written, the fastavro default
+SYNC_INTERVAL = 16000
 
 
 class BaseUtils:
     @classmethod
-    def _generate_random_record(cls, schema: T.Dict) -> T.Dict:
+    def generate_data(cls, schema: T.Dict, sample_size: int, seed: T.Optional[int] = None) -> T.List:
         """
-        Generate a random record based on the given Avro or Parquet schema.
+        Generate random records for the given Avro schema, reproducibly when a seed is given.
         """
-        record = {}
-        # @TODO: support union types
-        # @TODO: support logical types
-        for field in schema["fields"]:
-            if field["type"] == "null":
-                record[field["name"]] = None
-            elif field["type"] == "boolean":
-                record[field["name"]] = random.choice([True, False])
-            elif field["type"] == "int":
-                record[field["name"]] = random.randint(-2147483648, 2147483647)
-            elif field["type"] == "long":
-                record[field["name"]] = random.randint(-9223372036854775808, 9223372036854775807)
-            elif field["type"] == "float":
-                record[field["name"]] = random.uniform(-3.4e38, 3.4e38)
-            elif field["type"] == "double":
-                record[field["name"]] = random.uniform(-1.7e308, 1.7e308)
-            elif field["type"] == "string":
-                record[field["name"]] = cls._generate_random_string()
-            elif field["type"] == "bytes":
-                record[field["name"]] = cls._generate_random_bytes()
-            elif field["type"] == "array":
-                record[field["name"]] = cls._generate_random_array(field["items"])
-            elif field["type"] == "map":
-                record[field["name"]] = cls._generate_random_map(field["values"])
-            elif field["type"] == "record":
-                record[field["name"]] = cls._generate_random_record(field)
-            elif isinstance(field["type"], dict) and field["type"]["type"] == "record":
-                record[field["name"]] = cls._generate_random_record(field["type"])
-            elif isinstance(field["type"], dict) and field["type"]["type"] == "array":
-                record[field["name"]] = cls._generate_random_array(field["type"]["items"])
-            elif isinstance(field["type"], dict) and field["type"]["type"] == "map":
-                record[field["name"]] = cls._generate_random_map(field["type"]["values"])
-            elif field["type"] == "fixed":
-                size = field["size"]
-                record[field["name"]] = cls._generate_random_fixed(size)
-            elif isinstance(field["type"], dict) and field["type"]["type"] == "fixed":
-                size = field["type"]["size"]
-                record[field["name"]] = cls._generate_random_fixed(size)
-            elif field["type"] == "enum":
-                symbols = field["symbols"]
-                record[field["name"]] = cls._generate_random_enum(symbols)
-            elif isinstance(field["type"], dict) and field["type"]["type"] == "enum":
-                symbols = field["type"]["symbols"]
-                record[field["name"]] = cls._generate_random_enum(symbols)
-            else:
-                raise ValueError("Unsupported type: {}".format(field["type"]))
-        return record
-
-    @classmethod
-    def _generate_random_fixed(cls, size: int) -> bytes:
-        """
-        Generate a random fixed bytes value of the given size.
-        """
-        return bytes([random.randint(0, 255) for _ in range(size)])
-
-    @classmethod
-    def _generate_random_enum(cls, symbols: T.List[str]) -> str:
-        """
-        Generate a random enum value from the given symbols.
-        """
-        return random.choice(symbols)
-
-    @classmethod
-    def _generate_random_string(cls, length: int = 10) -> str:
-        """
-        Generate a random string of given length.
-        """
-        return "".join(random.choices(string.ascii_letters + string.digits, k=length))
-
-    @classmethod
-    def _generate_random_bytes(cls, length: int = 10) -> bytes:
-        """
-        Generate a random byte string of given length.
-        """
-        return bytes(random.getrandbits(8) for _ in range(length))
-
-    @classmethod
-    def _generate_random_array(cls, items_schema: T.Union[str, T.Dict]) -> T.List:
-        """
-        Generate a random array of items based on the given Avro or Parquet schema.
-        """
-        items = []
-        for _ in range(random.randint(1, 5)):
-            if isinstance(items_schema, str):
-                items.append(cls._generate_random_string())
-            elif isinstance(items_schema, dict) and items_schema["type"] == "record":
-                items.append(cls._generate_random_record(items_schema))
-            elif isinstance(items_schema, dict) and items_schema["type"] == "array":
-                items.append(cls._generate_random_array(items_schema["items"]))
-            elif isinstance(items_schema, dict) and items_schema["type"] == "map":
-                items.append(cls._generate_random_map(items_schema["values"]))
-            else:
-                raise ValueError("Unsupported type: {}".format(items_schema["type"]))
-        return items
-
-    @classmethod
-    def _generate_random_map(cls, values_schema: T.Union[str, T.Dict]) -> T.Dict:
-        """
-        Generate a random map of values based on the given Avro or Parquet schema.
-        """
-        values = {}
-        for _ in range(random.randint(1, 5)):
-            key = cls._generate_random_string()
-            if isinstance(values_schema, str):
-                values[key] = cls._generate_random_string()
-            elif isinstance(values_schema, dict) and values_schema["type"] == "record":
-                values[key] = cls._generate_random_record(values_schema)
-            elif isinstance(values_schema, dict) and values_schema["type"] == "array":
-                values[key] = cls._generate_random_array(values_schema["items"])
-            elif isinstance(values_schema, dict) and values_schema["type"] == "map":
-                values[key] = cls._generate_random_map(values_schema["values"])
-            else:
-                raise ValueError("Unsupported type: {}".format(values_schema["type"]))
-        return values
-    
-    @classmethod
-    def _generate_random_value(cls, schema: T.Dict) -> any:
-        """
-        Generate a random value based on the given Avro or Parquet schema.
-        """
-        if schema["type"] == "null":
-            return None
-        elif schema["type"] == "boolean":
-            return random.choice([True, False])
-        elif schema["type"] == "int":
-            return random.randint(-2147483648, 2147483647)
-        elif schema["type"] == "long":
-            return random.randint(-9223372036854775808, 9223372036854775807)
-        elif schema["type"] == "float":
-            return random.uniform(-3.4e38, 3.4e38)
-        elif schema["type"] == "double":
-            return random.uniform(-1.7e308, 1.7e308)
-        elif schema["type"] == "string":
-            return cls._generate_random_string()
-        elif schema["type"] == "bytes":
-            return cls._generate_random_bytes()
-        elif schema["type"] == "array":
-            return cls._generate_random_array(schema["items"])
-        elif schema["type"] == "map":
-            return cls._generate_random_map(schema["values"])
-        elif schema["type"] == "record":
-            return cls._generate_random_record(schema)
-        else:
-            raise ValueError("Unsupported type: {}".format(schema["type"]))
+        generate_record = compile_generator(schema)
+        rng = random.Random(seed)
+        return [generate_record(rng) for _ in range(sample_size)]
 
     @classmethod
-    def generate_data(cls, schema, sample_size: int) -> T.List:
-        # Generate random sample data using the Avro schema
-        sample_data = [cls._generate_random_record(schema) for _ in range(sample_size)]
-        return sample_data
+    def generate_batches(cls, schema: T.Dict, sample_size: int, seed: T.Optional[int] = None,
+                         jobs: T.Optional[int] = None, chunk_size: int = 100_000) -> T.Iterator[pa.RecordBatch]:
+        """
+        Generate random data column by column, as Arrow record batches of `chunk_size` rows.
 
-    @staticmethod
-    def time_method(method):
-        def timed(*args, **kwargs):
-            ts = timeit.default_timer()
-            result = method(*args, **kwargs)
-            te = timeit.default_timer()
-            print(f"{method.__name__} took {te - ts:.6f} seconds")
-            return result
+        Chunks are seeded independently from `seed` and generated across a pool of `jobs` processes.
+        Only a few chunks are in flight at a time, so memory stays flat whatever the sample size.
+        """
+        from data_tools.utils.column_generators import generate_batch
 
-        return timed
+        num_chunks = -(-sample_size // chunk_size)
+        seed_sequences = np.random.SeedSequence(seed).spawn(num_chunks)
+        chunk_sizes = [min(chunk_size, sample_size - i * chunk_size) for i in range(num_chunks)]
+        generate = functools.partial(generate_batch, schema)
+        yield from ordered_map(generate, zip(chunk_sizes, seed_sequences), jobs)
 
-    def create_sample(self, file_path: Path, schema_path: Path, sample_size: int):
+    def create_sample(self, file_path: Path, schema_path: Path, sample_size: int, *, seed: T.Optional[int] = None):
         raise NotImplementedError
 
     @staticmethod
-    def _print_table(table):
-        # Convert table to dictionary of lists
-        data_dict = table.to_pydict()
-
-        # Get list of column names
-        column_names = table.column_names
+    def print_batches(schema: pa.Schema, batches: T.Iterable[pa.RecordBatch], output_format: str = "jsonl") -> int:
+        """
+        Stream record batches to stdout as JSON Lines, CSV or an Arrow IPC stream.
+        """
+        from data_tools.utils.output import write_batches
 
-        # Iterate over rows and print as dictionaries
-        for i in range(len(data_dict[column_names[0]])):
-            row_dict = {}
-            for col_name in column_names:
-                row_dict[col_name] = data_dict[col_name][i]
-            print(row_dict)
+        with profile.span("print"):
+            num_rows = write_batches(schema, batches, output_format)
+        profile.count("rows_output", num_rows)
+        return num_rows
 
-    def meta(self, file_path: Path):
+    @classmethod
+    def meta(cls, file_path: Path) -> T.Tuple:
+        """
+        Print and return the schema, metadata, codec and serialized size of the file.
+        """
         raise NotImplementedError
 
     @staticmethod
@@ -205,45 +92,348 @@ class BaseUtils:
         print(f"Codec: {codec}")
         print(f"Serialized size: {serialized_size}")
 
+    @classmethod
+    def arrow_schema(cls, file_path: Path, cache: bool = True) -> pa.Schema:
+        """
+        Return the Arrow schema of the records of the file.
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def num_rows(cls, file_path: Path, cache: bool = True) -> int:
+        """
+        Return the number of records of the file, reading as little of it as the format allows.
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def count(cls, file_path: Path, cache: bool = True) -> int:
+        """
+        Print the number of records of the file.
+        """
+        num_rows = cls.num_rows(file_path, cache)
+        print(f"Number of rows: {num_rows}")
+        return num_rows
+
+    @classmethod
+    def sample(cls, file_path: Path, n: int = 20, seed: T.Optional[int] = None, output_format: str = "jsonl",
+               columns: T.Optional[T.Sequence[str]] = None, cache: bool = True) -> pa.Table:
+        """
+        Prints N records picked uniformly at random, in file order. The same seed always picks the same records.
+        """
+        table = cls.sample_table(file_path, n, seed, columns, cache)
+        cls.print_batches(table.schema, table.to_batches(), output_format)
+        return table
+
+    @classmethod
+    def sample_table(cls, file_path: Path, n: int, seed: T.Optional[int] = None,
+                     columns: T.Optional[T.Sequence[str]] = None, cache: bool = True) -> pa.Table:
+        """
+        Pick N records uniformly at random, in file order.
+
+        Formats indexing their blocks by row count implement take_rows: row positions are picked up front and
+        only the blocks holding them are decoded. Other files are sampled in one streaming pass.
+        """
+        from data_tools.utils.sampling import reservoir_sample, sample_positions
+
+        if hasattr(cls, "take_rows"):
+            positions = sample_positions(cls.num_rows(file_path, cache), n, seed)
+            return cls.take_rows(file_path, positions, columns, cache)
+        reader = cls.to_record_batch_reader(file_path, columns=columns)
+        return reservoir_sample(reader, reader.schema, n, seed)
+
+    @classmethod
+    def file_stats(cls, file_path: Path, jobs: T.Optional[int] = None, cache: bool = True,
+                   columns: T.Optional[T.Sequence[str]] = None, approx: bool = False) -> T.Any:
+        """
+        Return the statistics of the file, in a form merge_stats can combine with those of other files.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def merge_stats(left: T.Any, right: T.Any) -> T.Any:
+        return left.merge(right)
+
+    @staticmethod
+    def summarize_stats(file_stats: TableStats) -> T.Tuple[int, T.Dict]:
+        """
+        Turn statistics returned by file_stats into the row count and per-column statistics printed by stats.
+        """
+        return file_stats.num_rows, file_stats.to_dict()
+
+    @staticmethod
+    def print_stats(num_rows: int, column_stats: T.Dict[str, T.Dict]) -> None:
+        print(f"Number of rows: {num_rows}")
+        for column_name, column_stat in column_stats.items():
+            print(f"{column_name}: {column_stat}")
+
+    @staticmethod
+    def project_schema(schema: pa.Schema, columns: T.Optional[T.Sequence[str]]) -> pa.Schema:
+        """
+        Keep only the given top-level columns of the schema, in the given order.
+        """
+        if not columns:
+            return schema
+        unknown = [column for column in columns if column not in schema.names]
+        if unknown:
+            raise ValueError("Unknown columns: {}".format(", ".join(unknown)))
+        return pa.schema([schema.field(column) for column in columns], metadata=schema.metadata)
+
+    @classmethod
+    def to_record_batch_reader(cls, file_path: Path, batch_size: int = 65536, jobs: T.Optional[int] = None,
+                               columns: T.Optional[T.Sequence[str]] = None) -> pa.RecordBatchReader:
+        """
+        Stream an Avro file as Arrow record batches of at most `batch_size` rows.
+
+        The Arrow schema is derived once from the Avro writer schema, so peak memory is bounded by the batch size.
+        With several jobs, byte ranges of the file are decoded in a process pool and the batches are
+        yielded in file order. Only the given columns are decoded, see project_schema.
+        Upcoming blocks are read and decompressed by background threads while the current one is decoded,
+        see prefetch_records. Records are decoded straight into Arrow arrays unless the fastavro engine is
+        selected, see avro_columnar.
+        """
+        from data_tools.utils.avro_arrow import avro_to_arrow_schema
+        from data_tools.utils.avro_schema import project_schema
+
+        with open_input(file_path) as f:
+            header = read_header(f)
+        reader_schema = project_schema(header.schema, columns) if columns else None
+        schema = avro_to_arrow_schema(reader_schema or header.schema)
+        if not jobs or jobs == 1:
+            batches = cls._iter_record_batches(file_path, schema, batch_size, reader_schema)
+        else:
+            decode = functools.partial(cls._decode_range, file_path, schema, batch_size, reader_schema)
+            ranges = split_ranges(header, os.path.getsize(file_path), RANGES_PER_JOB * jobs)
+            batches = itertools.chain.from_iterable(ordered_map(decode, ranges, jobs))
+        return pa.RecordBatchReader.from_batches(schema, batches)
+
+    @staticmethod
+    def _iter_record_batches(file_path: Path, schema: pa.Schema, batch_size: int,
+                             reader_schema: T.Optional[T.Dict] = None) -> T.Iterator[pa.RecordBatch]:
+        depth = prefetch_depth()
+        with open_input(file_path) as f:
+            if avro_columnar.engine() == "columnar" or depth:
+                header = read_header(f)
+                yield from BaseUtils._decode_blocks(f, header, iter_blocks(f, header), schema, batch_size,
+                                                    reader_schema, depth)
+                return
+            avro_reader = fastavro.reader(f, reader_schema)
+            yield from BaseUtils._batch_records(avro_reader, schema, batch_size)
+            # fastavro read the blocks itself, up to the end of the file
+            profile.count("bytes_read", f.tell())
+
+    @staticmethod
+    def _decode_blocks(f: T.BinaryIO, header: AvroHeader, blocks: T.Iterable[AvroBlock], schema: pa.Schema,
+                       batch_size: int, reader_schema: T.Optional[T.Dict], depth: int) -> T.Iterator[pa.RecordBatch]:
+        """
+        Decode the given blocks with the Avro engine in use, see avro_columnar.engine.
+        """
+        if avro_columnar.engine() == "columnar":
+            payloads = prefetch(functools.partial(read_payload, f, header), blocks, depth)
+            columns = [field["name"] for field in reader_schema["fields"]] if reader_schema else None
+            yield from avro_columnar.iter_batches(payloads, header.schema, batch_size, columns)
+            return
+        if depth:
+            records = prefetch_records(f, header, blocks, reader_schema, depth)
+        else:
+            records = read_records(f, header, blocks, reader_schema)
+        yield from BaseUtils._batch_records(records, schema, batch_size)
+
+    @staticmethod
+    def _batch_records(records: T.Iterator[T.Dict], schema: pa.Schema,
+                       batch_size: int) -> T.Iterator[pa.RecordBatch]:
+        while True:
+            with profile.span("decode"):
+                batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                break
+            with profile.span("arrow"):
+                record_batch = pa.RecordBatch.from_pylist(batch, schema=schema)
+            profile.count("rows_decoded", record_batch.num_rows)
+            yield record_batch
+
+    @classmethod
+    def _iter_range_batches(cls, file_path: Path, schema: pa.Schema, batch_size: int,
+                            reader_schema: T.Optional[T.Dict],
+                            byte_range: T.Tuple[int, int]) -> T.Iterator[pa.RecordBatch]:
+        """
+        Decode the blocks starting in the given byte range.
+        """
+        depth = prefetch_depth()
+        with open_input(file_path) as f:
+            header = read_header(f)
+            blocks = iter_range_blocks(f, header, *byte_range)
+            yield from cls._decode_blocks(f, header, blocks, schema, batch_size, reader_schema, depth)
+
+    @classmethod
+    def _decode_range(cls, file_path: Path, schema: pa.Schema, batch_size: int, reader_schema: T.Optional[T.Dict],
+                      byte_range: T.Tuple[int, int]) -> T.List[pa.RecordBatch]:
+        # Runs in a worker process, batches are sent back to the parent in one piece
+        return list(cls._iter_range_batches(file_path, schema, batch_size, reader_schema, byte_range))
+
     @classmethod
     def to_arrow_table(cls, file_path: Path) -> pa.Table:
-        with open(file_path, "rb") as f:
-            avro_reader = fastavro.reader(f)
-            table = pa.Table.from_pylist(list(avro_reader))
-            return table
+        return cls.to_record_batch_reader(file_path).read_all()
 
     @classmethod
     def write_arrow_table(cls, table: pa.Table, file_path: Path) -> None:
+        cls.write_record_batches(file_path, table.schema, table.to_batches())
+
+    @classmethod
+    def write_record_batches(cls, file_path: Path, schema: pa.Schema, batches: T.Iterable[pa.RecordBatch],
+                             codec: T.Optional[str] = None, *, sync_interval: int = SYNC_INTERVAL,
+                             jobs: T.Optional[int] = None, **options) -> int:
+        """
+        Write record batches to an Avro file, with an Avro schema derived from the Arrow one.
+
+        Every batch is encoded and compressed into whole blocks on its own, sharing the sync marker of the file.
+        With several jobs, batches are encoded in a process pool and their blocks appended in order, so memory
+        is bounded by the batches in flight. Returns the number of rows written.
+        """
+        from data_tools.utils.avro_arrow import arrow_to_avro_schema
+
+        avro_schema = fastavro.parse_schema(arrow_to_avro_schema(schema))
+        codec = codec or "null"
+        sync_marker = os.urandom(16)
+        header = io.BytesIO()
+        fastavro.write.Writer(header, avro_schema, codec, sync_interval=sync_interval, sync_marker=sync_marker)
+
+        encode = functools.partial(cls._encode_blocks, avro_schema, codec, sync_interval, sync_marker)
+        num_rows = 0
         with open(file_path, "wb") as f:
-            fastavro.writer(f, table.schema, table.to_pydict().values())
+            f.write(header.getvalue())
+            for batch_rows, blocks in ordered_map(encode, batches, jobs or 1):
+                f.write(blocks)
+                num_rows += batch_rows
+        return num_rows
+
+    @staticmethod
+    def _encode_blocks(avro_schema: T.Dict, codec: str, sync_interval: int, sync_marker: bytes,
+                       batch: pa.RecordBatch) -> T.Tuple[int, bytes]:
+        from data_tools.utils.output import to_pylist
+
+        # Written as a whole container in memory, of which only the blocks are kept
+        buffer = io.BytesIO()
+        writer = fastavro.write.Writer(buffer, avro_schema, codec, sync_interval=sync_interval, sync_marker=sync_marker)
+        header_size = buffer.tell()
+        for record in to_pylist(batch):
+            writer.write(record)
+        writer.flush()
+        return batch.num_rows, buffer.getvalue()[header_size:]
+
+    @classmethod
+    def convert(cls, file_path: Path, output_path: Path, output_cls: T.Type[BaseUtils], codec: T.Optional[str] = None,
+                row_group_size: T.Optional[int] = None, sync_interval: T.Optional[int] = None,
+                jobs: T.Optional[int] = None, columns: T.Optional[T.Sequence[str]] = None) -> int:
+        """
+        Convert a file to the format of `output_cls`, streaming record batches from the reader to the writer.
+        Only the batches in flight are held in memory, whatever the size of the file.
+        """
+        reader = cls.to_record_batch_reader(file_path, jobs=jobs, columns=columns)
+        return cls.write_converted(output_path, output_cls, reader.schema, reader, codec, row_group_size,
+                                   sync_interval, jobs)
+
+    @staticmethod
+    def write_converted(output_path: Path, output_cls: T.Type[BaseUtils], schema: pa.Schema,
+                        batches: T.Iterable[pa.RecordBatch], codec: T.Optional[str] = None,
+                        row_group_size: T.Optional[int] = None,
+                        sync_interval: T.Optional[int] = None, jobs: T.Optional[int] = None) -> int:
+        # Options left unset fall back to the defaults of the output format
+        options: T.Dict[str, T.Any] = {"row_group_size": row_group_size, "sync_interval": sync_interval}
+        options = {name: value for name, value in options.items() if value is not None}
+        num_rows = output_cls.write_record_batches(output_path, schema, batches, codec, jobs=jobs, **options)
+        print(f"Converted {num_rows} rows to {output_path}")
+        return num_rows
+
+    @classmethod
+    def register_table(cls, con: duckdb.DuckDBPyConnection, file_path: Path, jobs: T.Optional[int] = None,
+                       columns: T.Optional[T.Sequence[str]] = None) -> None:
+        """
+        Make the file queryable under its file name in the given DuckDB connection.
+        """
+        cls.register_files(con, file_path.name, [file_path], jobs, columns=columns)
+
+    @classmethod
+    def register_persistent_table(cls, con: duckdb.DuckDBPyConnection, file_path: Path, jobs: T.Optional[int] = None,
+                                  columns: T.Optional[T.Sequence[str]] = None) -> None:
+        """
+        Like register_table, for a table scanned by any number of queries: the records are decoded once,
+        into an Arrow table held in memory that DuckDB scans in place.
+        """
+        table = cls.to_record_batch_reader(file_path, jobs=jobs, columns=columns).read_all()
+        con.register(file_path.name, table)
 
     @classmethod
-    def query(cls, file_path: Path, query_expression: str):
+    def register_files(cls, con: duckdb.DuckDBPyConnection, table_name: str, file_paths: T.List[Path],
+                       jobs: T.Optional[int] = None, schema: T.Optional[pa.Schema] = None,
+                       columns: T.Optional[T.Sequence[str]] = None) -> None:
+        """
+        Make the records of all the files queryable under the given table name, restricted to the given columns.
+        When a schema is given, no file is opened before DuckDB starts scanning.
+        """
+        from data_tools.utils.decoded_files import register_decoded
+
+        # A record batch reader can be scanned only once, while a query may scan a table several times
+        # (self-joins, subqueries). Every scan decodes the files again, batch by batch, see decoded_files.
+        if schema is None:
+            schema = cls.arrow_schema(file_paths[0])
+        schema = cls.project_schema(schema, columns)
+        decode = functools.partial(cls._decoded_batches, schema, jobs, columns)
+        register_decoded(con, table_name, file_paths, schema, decode)
+
+    @classmethod
+    def _decoded_batches(cls, schema: pa.Schema, jobs: T.Optional[int], columns: T.Optional[T.Sequence[str]],
+                         file_path: Path) -> T.Iterator[pa.RecordBatch]:
+        # A generator: the file is opened when the first batch is requested
+        for batch in cls.to_record_batch_reader(file_path, jobs=jobs, columns=columns):
+            yield cls._cast_batch(batch, schema)
+
+    @staticmethod
+    def _cast_batch(batch: pa.RecordBatch, schema: pa.Schema) -> pa.RecordBatch:
+        if batch.schema == schema:
+            return batch
+        columns = [batch.column(field.name).cast(field.type) for field in schema]
+        return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+    @classmethod
+    def query(cls, file_path: Path, query_expression: str, jobs: T.Optional[int] = None,
+              output_format: str = "jsonl", columns: T.Optional[T.Sequence[str]] = None) -> None:
         """
         Query and filter data in an Avro or Parquet file.
         Example: "select * from 'weather.avro'"
         """
-        my_arrow_table = cls.to_arrow_table(file_path)
-
         con = duckdb.connect()
-        con.register(file_path.name, my_arrow_table)
+        with profile.span("register"):
+            cls.register_table(con, file_path, jobs, columns)
+        cls.run_query(con, query_expression, output_format)
 
-        # Run query that selects part of the data
-        query = con.execute(query_expression)
+    @staticmethod
+    def result_reader(con: duckdb.DuckDBPyConnection) -> pa.RecordBatchReader:
+        """
+        Return a reader of the record batches of the query last executed on the connection.
+        """
+        # fetch_record_batch is deprecated by recent DuckDB releases, older ones only have it
+        if hasattr(con, "to_arrow_reader"):
+            return con.to_arrow_reader()
+        return con.fetch_record_batch()
 
-        # Create Record Batch Reader from Query Result.
-        # "fetch_record_batch()" also accepts an extra parameter related to the desired produced chunk size.
-        record_batch_reader = query.fetch_record_batch()
+    @classmethod
+    def run_query(cls, con: duckdb.DuckDBPyConnection, query_expression: str, output_format: str = "jsonl") -> None:
+        """
+        Run a query on the tables registered in the connection, print its result and close the connection.
+        """
+        # Run query that selects part of the data
+        with profile.span("duckdb"):
+            query = con.execute(query_expression)
 
-        # Retrieve all batch chunks
-        all_chunks = []
-        while True:
-            try:
-                # Process a single chunk here
-                # pyarrow.lib.RecordBatch
-                chunk = record_batch_reader.read_next_batch()
-                all_chunks.append(chunk)
-            except StopIteration:
-                break
-        data = pa.Table.from_batches(all_chunks)
-        cls._print_table(data)
+        # Batches are written as soon as DuckDB produces them, output starts with the first batch
+        record_batch_reader = cls.result_reader(query)
+        try:
+            cls.print_batches(record_batch_reader.schema, profile.timed_iter("duckdb", record_batch_reader),
+                              output_format)
+        finally:
+            con.close()
+            # Only tables registered by register_files have streams to wait for, see decoded_files
+            decoded_files = sys.modules.get("data_tools.utils.decoded_files")
+            if decoded_files is not None:
+                decoded_files.close_streams(con)
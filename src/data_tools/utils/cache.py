@@ -0,0 +1,133 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import typing as T
+from pathlib import Path
+
+# Set to use another cache directory
+CACHE_DIR_ENV = "DATA_TOOLS_CACHE_DIR"
+MAX_CACHE_SIZE = 64 * 1024 * 1024
+# Hashed along with the path, size and modification time, so that a file rewritten in place is not mistaken
+# for the cached one. This covers the Avro header (schema and sync marker) and the Parquet magic.
+FINGERPRINT_SIZE = 64 * 1024
+# Stored in every entry, an entry of another version is a miss. Bump it whenever the cached values change
+# shape (a new statistic, a renamed field, another class), so that older entries are recomputed.
+CACHE_VERSION = 1
+
+
+def cache_dir() -> Path:
+    """
+    Return the cache directory: $DATA_TOOLS_CACHE_DIR, or data-tools under the XDG cache directory.
+    """
+    if os.environ.get(CACHE_DIR_ENV):
+        return Path(os.environ[CACHE_DIR_ENV])
+    xdg_cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(xdg_cache_home) / "data-tools"
+
+
+def fingerprint(file_path: Path) -> str:
+    """
+    Identify the current content of a file by its path, size, modification time and leading bytes.
+    """
+    stat = os.stat(file_path)
+    digest = hashlib.sha256()
+    digest.update(f"{Path(file_path).resolve()}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode())
+    with open(file_path, "rb") as f:
+        digest.update(f.read(FINGERPRINT_SIZE))
+    return digest.hexdigest()
+
+
+class MetadataCache:
+    """
+    On-disk cache of values computed from a file (schema, row count, block index, statistics).
+
+    Every entry is a pickle file named after the file fingerprint and the entry name, holding the value
+    along with the CACHE_VERSION it was written with. Reading an entry refreshes its modification time and
+    the least recently used entries are evicted once the cache grows past `max_size` bytes. Any error
+    reading or writing the cache, or an entry of another version, is treated as a miss.
+
+    Unpickling runs arbitrary code, so the directory is private to its user and entries owned by another
+    user are misses: the cache must not be shared.
+    """
+
+    def __init__(self, directory: T.Optional[Path] = None, max_size: int = MAX_CACHE_SIZE):
+        self.directory = Path(directory) if directory is not None else cache_dir()
+        self.max_size = max_size
+
+    def _entry_path(self, key: str, name: str) -> Path:
+        return self.directory / f"{key}-{name}.pickle"
+
+    def get(self, key: str, name: str) -> T.Optional[T.Any]:
+        """
+        Return the `name` entry of the file with the given fingerprint, or None.
+        """
+        try:
+            entry_path = self._entry_path(key, name)
+            with open(entry_path, "rb") as f:
+                if hasattr(os, "getuid") and os.fstat(f.fileno()).st_uid != os.getuid():
+                    return None
+                version, value = pickle.load(f)
+            if version != CACHE_VERSION:
+                return None
+            os.utime(entry_path)
+            return value
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError, TypeError, ValueError):
+            return None
+
+    def set(self, key: str, name: str, value: T.Any) -> None:
+        try:
+            entry_path = self._entry_path(key, name)
+            self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+            # Written aside and renamed, so that concurrent readers never see a partial entry
+            with tempfile.NamedTemporaryFile("wb", dir=self.directory, suffix=".tmp", delete=False) as f:
+                pickle.dump((CACHE_VERSION, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(f.name, entry_path)
+            self.evict()
+        except OSError:
+            pass
+
+    def evict(self) -> None:
+        """
+        Remove the least recently used entries until the cache fits in `max_size` bytes.
+        """
+        entries = []
+        for entry_path in self.directory.glob("*.pickle"):
+            try:
+                stat = entry_path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry_path))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                entry_path.unlink()
+            except OSError:
+                pass
+            total_size -= size
+
+
+def entry_name(name: str, columns: T.Optional[T.Sequence[str]] = None) -> str:
+    """
+    Name the entry of a value computed over some columns only, e.g. their statistics.
+    """
+    if not columns:
+        return name
+    return "{}-{}".format(name, hashlib.sha256("\0".join(columns).encode()).hexdigest()[:16])
+
+
+def cached(file_path: Path, name: str, compute: T.Callable[[], T.Any], enabled: bool = True) -> T.Any:
+    """
+    Return the cached `name` entry of the file, computing and storing it on a miss.
+    """
+    if not enabled:
+        return compute()
+    metadata_cache = MetadataCache()
+    key = fingerprint(file_path)
+    value = metadata_cache.get(key, name)
+    if value is None:
+        value = compute()
+        metadata_cache.set(key, name, value)
+    return value
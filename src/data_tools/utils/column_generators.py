@@ -0,0 +1,205 @@
+import typing as T
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from data_tools.utils.avro_arrow import avro_to_arrow_schema
+from data_tools.utils.generators import ALPHABET, MAX_ITEMS, MAX_SECONDS, MIN_ITEMS, STRING_LENGTH
+
+ColumnGenerator = T.Callable[[np.random.Generator, int], pa.Array]
+
+ALPHABET_ARRAY = np.frombuffer(ALPHABET.encode(), dtype=np.uint8)
+HEX_ARRAY = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+
+
+def _fixed_width_strings(data: np.ndarray, num_rows: int, width: int, arrow_type: pa.DataType) -> pa.Array:
+    offsets = np.arange(0, num_rows * width + 1, width, dtype=np.int32)
+    return pa.Array.from_buffers(arrow_type, num_rows, [None, pa.py_buffer(offsets), pa.py_buffer(data)])
+
+
+def _random_strings(rng: np.random.Generator, num_rows: int) -> pa.Array:
+    data = ALPHABET_ARRAY[rng.integers(0, len(ALPHABET_ARRAY), num_rows * STRING_LENGTH)]
+    return _fixed_width_strings(data, num_rows, STRING_LENGTH, pa.string())
+
+
+def _random_bytes(rng: np.random.Generator, num_rows: int) -> pa.Array:
+    data = rng.integers(0, 256, num_rows * STRING_LENGTH, dtype=np.uint8)
+    return _fixed_width_strings(data, num_rows, STRING_LENGTH, pa.binary())
+
+
+def _random_uuids(rng: np.random.Generator, num_rows: int) -> pa.Array:
+    digits = HEX_ARRAY[rng.integers(0, 16, (num_rows, 32))]
+    data = np.full((num_rows, 36), ord("-"), dtype=np.uint8)
+    for start, end, digits_start in ((0, 8, 0), (9, 13, 8), (14, 18, 12), (19, 23, 16), (24, 36, 20)):
+        data[:, start:end] = digits[:, digits_start:digits_start + end - start]
+    return _fixed_width_strings(data.ravel(), num_rows, 36, pa.string())
+
+
+def _random_integers(low: int, high: int, arrow_type: pa.DataType) -> ColumnGenerator:
+    """
+    Uniform integers in [low, high], stored as the given 32 or 64-bit Arrow type.
+    """
+    dtype = np.int32 if arrow_type.bit_width == 32 else np.int64
+
+    def generator(rng, num_rows):
+        values = rng.integers(low, high, num_rows, dtype=dtype, endpoint=True)
+        return pa.Array.from_buffers(arrow_type, num_rows, [None, pa.py_buffer(values)])
+
+    return generator
+
+
+PRIMITIVE_GENERATORS: T.Dict[str, ColumnGenerator] = {
+    "null": lambda rng, num_rows: pa.nulls(num_rows),
+    "boolean": lambda rng, num_rows: pa.array(rng.random(num_rows) < 0.5),
+    "int": lambda rng, num_rows: pa.array(rng.integers(-2 ** 31, 2 ** 31, num_rows, dtype=np.int32)),
+    "long": lambda rng, num_rows: pa.array(rng.integers(-2 ** 63, 2 ** 63 - 1, num_rows, dtype=np.int64,
+                                                        endpoint=True)),
+    "float": lambda rng, num_rows: pa.array((rng.uniform(-1, 1, num_rows) * 3.4e38).astype(np.float32)),
+    "double": lambda rng, num_rows: pa.array(rng.uniform(-1, 1, num_rows) * 1.7e308),
+    "string": _random_strings,
+    "bytes": _random_bytes,
+}
+
+LOGICAL_GENERATORS: T.Dict[str, ColumnGenerator] = {
+    "date": _random_integers(0, MAX_SECONDS // 86400 - 1, pa.date32()),
+    "time-millis": _random_integers(0, 86400000 - 1, pa.time32("ms")),
+    "time-micros": _random_integers(0, 86400000000 - 1, pa.time64("us")),
+    "timestamp-millis": _random_integers(0, MAX_SECONDS * 1000 - 1, pa.timestamp("ms", tz="UTC")),
+    "timestamp-micros": _random_integers(0, MAX_SECONDS * 10 ** 6 - 1, pa.timestamp("us", tz="UTC")),
+    "local-timestamp-millis": _random_integers(0, MAX_SECONDS * 1000 - 1, pa.timestamp("ms")),
+    "local-timestamp-micros": _random_integers(0, MAX_SECONDS * 10 ** 6 - 1, pa.timestamp("us")),
+    "uuid": _random_uuids,
+}
+
+
+def compile_column_generator(schema: T.Dict) -> T.Callable[[np.random.Generator, int], pa.RecordBatch]:
+    """
+    Compile an Avro record schema into a callable producing whole record batches.
+
+    Every column is drawn at once with vectorized NumPy generators. The batches follow the Arrow schema
+    derived from the Avro schema, so they can be written to Parquet or converted back to Avro records.
+    """
+    arrow_schema = avro_to_arrow_schema(schema)
+    generate_struct = _compile(schema, {}, schema.get("namespace", ""))
+
+    def generator(rng, num_rows):
+        struct_array = generate_struct(rng, num_rows)
+        return pa.RecordBatch.from_arrays(struct_array.flatten(), schema=arrow_schema)
+
+    return generator
+
+
+def _full_name(name: str, namespace: str) -> str:
+    if "." in name or not namespace:
+        return name
+    return f"{namespace}.{name}"
+
+
+def _with_nulls(generator: ColumnGenerator, null_probability: float) -> ColumnGenerator:
+    def nullable_generator(rng, num_rows):
+        values = generator(rng, num_rows)
+        mask = pa.array(rng.random(num_rows) < null_probability)
+        return pc.if_else(mask, pa.nulls(num_rows, values.type), values)
+    return nullable_generator
+
+
+def _list_offsets(rng: np.random.Generator, num_rows: int) -> T.Tuple[pa.Array, int]:
+    lengths = rng.integers(MIN_ITEMS, MAX_ITEMS, num_rows, dtype=np.int32, endpoint=True)
+    offsets = np.zeros(num_rows + 1, dtype=np.int32)
+    np.cumsum(lengths, out=offsets[1:])
+    return pa.array(offsets), int(offsets[-1])
+
+
+def _compile(schema: T.Union[str, T.List, T.Dict], named: T.Dict[str, ColumnGenerator],
+             namespace: str) -> ColumnGenerator:
+    if isinstance(schema, str):
+        if schema in PRIMITIVE_GENERATORS:
+            return PRIMITIVE_GENERATORS[schema]
+        for name in (_full_name(schema, namespace), schema):
+            if name in named:
+                return named[name]
+        raise ValueError("Unsupported type: {}".format(schema))
+
+    if isinstance(schema, list):
+        branches = [branch for branch in schema if branch != "null"]
+        if len(branches) != 1:
+            raise ValueError("Unsupported union type in columnar mode: {}".format(schema))
+        generator = _compile(branches[0], named, namespace)
+        # The null branch is drawn as often as any other branch, like in the row generator
+        return _with_nulls(generator, 1 / len(schema)) if len(schema) > 1 else generator
+
+    logical_type = schema.get("logicalType")
+    if logical_type in LOGICAL_GENERATORS:
+        return LOGICAL_GENERATORS[logical_type]
+    if logical_type == "decimal":
+        return _compile_decimal(schema)
+
+    type_name = schema["type"]
+    if type_name == "record" or type_name == "error":
+        full_name = _full_name(schema["name"], schema.get("namespace", namespace))
+        record_namespace = full_name.rpartition(".")[0]
+        names = [field["name"] for field in schema["fields"]]
+        fields = [_compile(field["type"], named, record_namespace) for field in schema["fields"]]
+
+        def record_generator(rng, num_rows):
+            return pa.StructArray.from_arrays([generate(rng, num_rows) for generate in fields], names)
+
+        named[full_name] = record_generator
+        return record_generator
+    elif type_name == "enum":
+        symbols = pa.array(schema["symbols"], pa.string())
+        generator = named[_full_name(schema["name"], schema.get("namespace", namespace))] = \
+            lambda rng, num_rows: symbols.take(pa.array(rng.integers(0, len(symbols), num_rows)))
+        return generator
+    elif type_name == "fixed":
+        size = schema["size"]
+
+        def fixed_generator(rng, num_rows):
+            data = rng.integers(0, 256, num_rows * size, dtype=np.uint8)
+            return pa.Array.from_buffers(pa.binary(size), num_rows, [None, pa.py_buffer(data)])
+
+        named[_full_name(schema["name"], schema.get("namespace", namespace))] = fixed_generator
+        return fixed_generator
+    elif type_name == "array":
+        items = _compile(schema["items"], named, namespace)
+
+        def array_generator(rng, num_rows):
+            offsets, num_items = _list_offsets(rng, num_rows)
+            return pa.ListArray.from_arrays(offsets, items(rng, num_items))
+
+        return array_generator
+    elif type_name == "map":
+        values = _compile(schema["values"], named, namespace)
+
+        def map_generator(rng, num_rows):
+            offsets, num_items = _list_offsets(rng, num_rows)
+            return pa.MapArray.from_arrays(offsets, _random_strings(rng, num_items), values(rng, num_items))
+
+        return map_generator
+    else:
+        # A primitive type written in its object form, e.g. {"type": "string"}
+        return _compile(type_name, named, namespace)
+
+
+def _compile_decimal(schema: T.Dict) -> ColumnGenerator:
+    arrow_type = pa.decimal128(schema["precision"], schema.get("scale", 0))
+    # Unscaled values are drawn as int64, so wider precisions are only partially covered
+    limit = 10 ** min(schema["precision"], 18)
+
+    def decimal_generator(rng, num_rows):
+        unscaled = np.empty((num_rows, 2), dtype=np.int64)
+        unscaled[:, 0] = rng.integers(-limit + 1, limit, num_rows)
+        # Sign extend the low word into the high word of the 128-bit little-endian values
+        unscaled[:, 1] = unscaled[:, 0] >> 63
+        return pa.Array.from_buffers(arrow_type, num_rows, [None, pa.py_buffer(unscaled)])
+
+    return decimal_generator
+
+
+def generate_batch(schema: T.Dict, chunk: T.Tuple[int, np.random.SeedSequence]) -> pa.RecordBatch:
+    """
+    Generate one independently seeded chunk of rows, meant to run in a worker process.
+    """
+    num_rows, seed_sequence = chunk
+    return compile_column_generator(schema)(np.random.default_rng(seed_sequence), num_rows)
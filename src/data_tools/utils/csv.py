@@ -0,0 +1,33 @@
+import typing as T
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+from data_tools.utils.text import BLOCK_SIZE, TextUtils
+
+
+class CsvUtils(TextUtils):
+    output_format = "csv"
+
+    @classmethod
+    def open_reader(cls, source: T.Union[Path, T.BinaryIO], block_size: int = BLOCK_SIZE) -> pa.RecordBatchReader:
+        """
+        Open a streaming CSV reader. Column names come from the header line, types are inferred from the first block.
+        """
+        return pa_csv.open_csv(source, read_options=pa_csv.ReadOptions(block_size=block_size))
+
+    @classmethod
+    def read_lines(cls, data: pa.Buffer, schema: pa.Schema) -> pa.Table:
+        if not data:
+            return schema.empty_table()
+        read_options = pa_csv.ReadOptions(column_names=schema.names)
+        convert_options = pa_csv.ConvertOptions(column_types=schema)
+        return pa_csv.read_csv(pa.BufferReader(data), read_options=read_options, convert_options=convert_options)
+
+    @classmethod
+    def data_start(cls, f: T.BinaryIO) -> int:
+        # Skip the header line
+        f.seek(0)
+        f.readline()
+        return f.tell()
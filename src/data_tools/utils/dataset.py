@@ -0,0 +1,349 @@
+from __future__ import annotations
+
+import concurrent.futures
+import functools
+import glob
+import itertools
+import os
+import re
+import typing as T
+import urllib.parse
+from pathlib import Path
+
+from data_tools.utils.lazy import LazyModule
+from data_tools.utils.parallel import ordered_map
+
+if T.TYPE_CHECKING:
+    import duckdb
+    import pyarrow as pa
+
+    from data_tools.utils.base import BaseUtils
+else:
+    duckdb = LazyModule("duckdb")
+    pa = LazyModule("pyarrow")
+
+GLOB_CHARACTERS = "*?["
+# Value Hive writes for a null partition value
+HIVE_DEFAULT_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+INTEGER_PATTERN = re.compile(r"-?\d+")
+
+
+def _has_glob(pattern: str) -> bool:
+    return any(character in pattern for character in GLOB_CHARACTERS)
+
+
+def _is_hidden(name: str) -> bool:
+    # Hidden files and the markers left by Spark/Hadoop jobs (_SUCCESS, _metadata, .crc files)
+    return name.startswith(".") or name.startswith("_")
+
+
+class DataFile(T.NamedTuple):
+    path: Path
+    # Hive-style key=value directories between the dataset root and the file, outermost first
+    partition: T.Tuple[T.Tuple[str, T.Optional[str]], ...]
+
+
+def _partition(relative_path: Path) -> T.Tuple[T.Tuple[str, T.Optional[str]], ...]:
+    partition = []
+    for part in relative_path.parts[:-1]:
+        key, separator, value = part.partition("=")
+        if separator and key:
+            value = urllib.parse.unquote(value)
+            partition.append((urllib.parse.unquote(key), None if value == HIVE_DEFAULT_PARTITION else value))
+    return tuple(partition)
+
+
+def discover(path: Path, get_file_format: T.Callable[[Path], str]) -> T.Tuple[T.List[DataFile], str]:
+    """
+    List the data files of a directory (recursively) or matched by a glob pattern, in path order.
+
+    Hidden files and files of unknown formats are skipped. All the other files must share one format,
+    which is returned along with the files.
+    """
+    if path.is_dir():
+        root_parts = path.parts
+        paths = []
+        for directory, directory_names, file_names in os.walk(path):
+            directory_names[:] = sorted(name for name in directory_names if not _is_hidden(name))
+            paths.extend(Path(directory) / name for name in sorted(file_names) if not _is_hidden(name))
+    else:
+        # Partitions are read below the last directory without glob characters
+        root_parts = tuple(itertools.takewhile(lambda part: not _has_glob(part), path.parts[:-1]))
+        paths = [Path(match) for match in sorted(glob.glob(str(path), recursive=True))]
+        paths = [match for match in paths if match.is_file() and not _is_hidden(match.name)]
+
+    files = []
+    file_formats = set()
+    for file_path in paths:
+        try:
+            file_formats.add(get_file_format(file_path))
+        except ValueError:
+            continue
+        files.append(DataFile(file_path, _partition(Path(*file_path.parts[len(root_parts):]))))
+    if not files:
+        raise ValueError(f"No data files found in {path}.")
+    if len(file_formats) > 1:
+        raise ValueError(f"Files of several formats found in {path}: {', '.join(sorted(file_formats))}.")
+    return files, file_formats.pop()
+
+
+def _partition_type(values: T.Iterable[T.Optional[str]]) -> pa.DataType:
+    values = [value for value in values if value is not None]
+    if values and all(INTEGER_PATTERN.fullmatch(value) for value in values):
+        return pa.int64()
+    return pa.string()
+
+
+def _sql_string(value: str) -> str:
+    return "'{}'".format(value.replace("'", "''"))
+
+
+def _sql_identifier(name: str) -> str:
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+class Dataset(T.NamedTuple):
+    # Table name of the dataset in queries, the last component of the path like for single files
+    name: str
+    files: T.List[DataFile]
+    utils_cls: T.Type[BaseUtils]
+
+    @property
+    def partition_fields(self) -> T.List[pa.Field]:
+        """
+        One field per partition key, typed int64 when all its values are integers and string otherwise.
+        """
+        values = {}
+        for data_file in self.files:
+            for key, value in data_file.partition:
+                values.setdefault(key, []).append(value)
+        return [pa.field(key, _partition_type(key_values)) for key, key_values in values.items()]
+
+    def with_partition_fields(self, schema: pa.Schema) -> pa.Schema:
+        for field in self.partition_fields:
+            if field.name in schema.names:
+                raise ValueError(f"Partition key {field.name} is also a column of the data files.")
+            schema = schema.append(field)
+        return schema
+
+    def data_columns(self, columns: T.Optional[T.Sequence[str]]) -> T.Optional[T.List[str]]:
+        """
+        Keep the columns read from the data files, dropping partition keys.
+        """
+        if not columns:
+            return None
+        partition_keys = {field.name for field in self.partition_fields}
+        return [column for column in columns if column not in partition_keys]
+
+
+class DatasetUtils:
+    """
+    Commands over a dataset: all the files found under a directory or matched by a glob pattern.
+
+    Per-file work (schemas, statistics) runs in a worker pool and the results are merged into one answer.
+    Values of Hive-style key=value directories are exposed as extra columns.
+    """
+
+    @classmethod
+    def arrow_schema(cls, dataset: Dataset, jobs: T.Optional[int] = None, cache: bool = True) -> pa.Schema:
+        """
+        Unify the schemas of all the files, and append the partition columns.
+        """
+        read = functools.partial(dataset.utils_cls.arrow_schema, cache=cache)
+        paths = [data_file.path for data_file in dataset.files]
+        schemas = list(ordered_map(read, paths, jobs, concurrent.futures.ThreadPoolExecutor))
+        return dataset.with_partition_fields(pa.unify_schemas(schemas))
+
+    @classmethod
+    def schema(cls, dataset: Dataset, jobs: T.Optional[int] = None, cache: bool = True) -> pa.Schema:
+        schema = cls.arrow_schema(dataset, jobs, cache)
+        print(f"Files: {len(dataset.files)}")
+        print(f"Schema:\n{schema}")
+        return schema
+
+    @classmethod
+    def meta(cls, dataset: Dataset, jobs: T.Optional[int] = None, cache: bool = True) -> T.Tuple:
+        """
+        Inspect a dataset: its unified schema, number of files, partition keys and total size.
+        """
+        schema = cls.arrow_schema(dataset, jobs, cache)
+        metadata = {
+            "files": len(dataset.files),
+            "partition_keys": [field.name for field in dataset.partition_fields],
+        }
+        serialized_size = sum(os.path.getsize(data_file.path) for data_file in dataset.files)
+        dataset.utils_cls.print_metadata(schema, metadata, None, serialized_size)
+        return schema, metadata, None, serialized_size
+
+    @classmethod
+    def count(cls, dataset: Dataset, jobs: T.Optional[int] = None, cache: bool = True) -> int:
+        """
+        Print the number of records of a dataset, counting the files in a pool of threads.
+        """
+        count = functools.partial(dataset.utils_cls.num_rows, cache=cache)
+        paths = [data_file.path for data_file in dataset.files]
+        num_rows = sum(ordered_map(count, paths, jobs, concurrent.futures.ThreadPoolExecutor))
+        print(f"Number of rows: {num_rows}")
+        return num_rows
+
+    @classmethod
+    def stats(cls, dataset: Dataset, jobs: T.Optional[int] = None, cache: bool = True,
+              columns: T.Optional[T.Sequence[str]] = None, approx: bool = False) -> T.Tuple[int, T.Dict]:
+        """
+        Compute per-column statistics of a dataset, one file per worker process, merging the per-file results.
+        The sketches of approximate mode are merged across files like the other statistics.
+        """
+        utils_cls = dataset.utils_cls
+        if columns:
+            utils_cls.project_schema(dataset.with_partition_fields(utils_cls.arrow_schema(dataset.files[0].path)),
+                                     columns)
+        # Files are the unit of parallelism, every file is read by a single worker
+        read = functools.partial(utils_cls.file_stats, jobs=1, cache=cache, columns=dataset.data_columns(columns),
+                                 approx=approx)
+        paths = [data_file.path for data_file in dataset.files]
+        file_stats = functools.reduce(utils_cls.merge_stats, ordered_map(read, paths, jobs))
+        num_rows, column_stats = utils_cls.summarize_stats(file_stats)
+        utils_cls.print_stats(num_rows, column_stats)
+        return num_rows, column_stats
+
+    @classmethod
+    def _with_partition(cls, batch: pa.RecordBatch, schema: pa.Schema, data_file: DataFile) -> pa.RecordBatch:
+        partition = dict(data_file.partition)
+        columns = []
+        for field in schema:
+            if field.name in batch.schema.names:
+                columns.append(batch.column(field.name).cast(field.type))
+            else:
+                value = partition.get(field.name)
+                value = None if value is None else pa.scalar(value).cast(field.type)
+                columns.append(pa.nulls(batch.num_rows, field.type) if value is None
+                               else pa.repeat(value, batch.num_rows))
+        return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+    @classmethod
+    def to_record_batch_reader(cls, dataset: Dataset, jobs: T.Optional[int] = None,
+                               columns: T.Optional[T.Sequence[str]] = None) -> pa.RecordBatchReader:
+        """
+        Stream the records of all the files in path order, with their partition columns.
+        Files are opened one after the other, once the batches of the previous ones are consumed.
+        """
+        utils_cls = dataset.utils_cls
+        schema = dataset.with_partition_fields(utils_cls.arrow_schema(dataset.files[0].path))
+        schema = utils_cls.project_schema(schema, columns)
+        data_columns = dataset.data_columns(columns)
+        batches = (
+            cls._with_partition(batch, schema, data_file)
+            for data_file in dataset.files
+            for batch in utils_cls.to_record_batch_reader(data_file.path, jobs=jobs, columns=data_columns)
+        )
+        return pa.RecordBatchReader.from_batches(schema, batches)
+
+    @classmethod
+    def head(cls, dataset: Dataset, n: int = 20, output_format: str = "jsonl",
+             columns: T.Optional[T.Sequence[str]] = None) -> pa.Table:
+        """
+        Prints the first N records of a dataset, reading its files in path order until N records are found.
+        """
+        reader = cls.to_record_batch_reader(dataset, columns=columns)
+        batches = []
+        num_rows = 0
+        for batch in reader:
+            if num_rows >= n:
+                break
+            batches.append(batch)
+            num_rows += batch.num_rows
+        table = pa.Table.from_batches(batches, reader.schema).slice(0, n)
+        dataset.utils_cls.print_batches(table.schema, table.to_batches(), output_format)
+        return table
+
+    @classmethod
+    def sample(cls, dataset: Dataset, n: int = 20, seed: T.Optional[int] = None, output_format: str = "jsonl",
+               columns: T.Optional[T.Sequence[str]] = None, jobs: T.Optional[int] = None,
+               cache: bool = True) -> pa.Table:
+        """
+        Prints N records of a dataset picked uniformly at random, in path order, with their partition columns.
+
+        When the format indexes its blocks, files are counted in a pool of threads and only the blocks holding
+        the picked positions are decoded; otherwise all the files are sampled in one streaming pass.
+        """
+        from data_tools.utils.sampling import group_positions, reservoir_sample, sample_positions
+
+        utils_cls = dataset.utils_cls
+        if not hasattr(utils_cls, "take_rows"):
+            reader = cls.to_record_batch_reader(dataset, columns=columns)
+            table = reservoir_sample(reader, reader.schema, n, seed)
+        else:
+            schema = dataset.with_partition_fields(utils_cls.arrow_schema(dataset.files[0].path))
+            schema = utils_cls.project_schema(schema, columns)
+            count = functools.partial(utils_cls.num_rows, cache=cache)
+            paths = [data_file.path for data_file in dataset.files]
+            counts = list(ordered_map(count, paths, jobs, concurrent.futures.ThreadPoolExecutor))
+            offsets = group_positions(sample_positions(sum(counts), n, seed), counts)
+            batches = [
+                cls._with_partition(batch, schema, dataset.files[i])
+                for i, file_offsets in offsets.items()
+                for batch in utils_cls.take_rows(paths[i], file_offsets, dataset.data_columns(columns),
+                                                 cache).to_batches()
+            ]
+            table = pa.Table.from_batches(batches, schema)
+        utils_cls.print_batches(table.schema, table.to_batches(), output_format)
+        return table
+
+    @classmethod
+    def convert(cls, dataset: Dataset, output_path: Path, output_cls: T.Type[BaseUtils], codec: T.Optional[str] = None,
+                row_group_size: T.Optional[int] = None, sync_interval: T.Optional[int] = None,
+                jobs: T.Optional[int] = None, columns: T.Optional[T.Sequence[str]] = None) -> int:
+        """
+        Convert a dataset into a single file, partition values included as columns.
+        """
+        reader = cls.to_record_batch_reader(dataset, jobs, columns)
+        return dataset.utils_cls.write_converted(output_path, output_cls, reader.schema, reader, codec,
+                                                 row_group_size, sync_interval, jobs)
+
+    @classmethod
+    def register_dataset(cls, con: duckdb.DuckDBPyConnection, dataset: Dataset, jobs: T.Optional[int] = None,
+                         columns: T.Optional[T.Sequence[str]] = None) -> None:
+        """
+        Make the dataset queryable under its name in the given DuckDB connection, with the given columns only.
+
+        Every partition is registered on its own, and the dataset is a UNION ALL of the partitions with
+        their key values as constant columns. DuckDB drops the partitions whose constants contradict the
+        WHERE clause while planning, so their files are never opened. Only the schema of the first file
+        is read upfront.
+        """
+        utils_cls = dataset.utils_cls
+        schema = utils_cls.arrow_schema(dataset.files[0].path)
+        partition_fields = dataset.partition_fields
+        projected_schema = utils_cls.project_schema(dataset.with_partition_fields(schema), columns)
+        partition_fields = [field for field in partition_fields if field.name in projected_schema.names]
+        data_columns = dataset.data_columns(columns)
+
+        partitions = {}
+        for data_file in dataset.files:
+            partitions.setdefault(data_file.partition, []).append(data_file.path)
+
+        selects = []
+        for i, (partition, paths) in enumerate(partitions.items()):
+            table_name = f"__{dataset.name}_{i}"
+            utils_cls.register_files(con, table_name, paths, jobs, schema, data_columns)
+            values = dict(partition)
+            # Only partition keys may be requested, in which case the data files provide the row count alone
+            expressions = ["*"] if data_columns is None else [_sql_identifier(column) for column in data_columns]
+            for field in partition_fields:
+                value = values.get(field.name)
+                literal = "NULL" if value is None else _sql_string(value)
+                sql_type = "BIGINT" if pa.types.is_integer(field.type) else "VARCHAR"
+                expressions.append(f"CAST({literal} AS {sql_type}) AS {_sql_identifier(field.name)}")
+            selects.append(f"SELECT {', '.join(expressions)} FROM {_sql_identifier(table_name)}")
+        con.execute(f"CREATE TEMP VIEW {_sql_identifier(dataset.name)} AS {' UNION ALL '.join(selects)}")
+
+    @classmethod
+    def query(cls, dataset: Dataset, query_expression: str, jobs: T.Optional[int] = None,
+              output_format: str = "jsonl", columns: T.Optional[T.Sequence[str]] = None) -> None:
+        """
+        Query a dataset, registered under its directory name or glob pattern.
+        Example: "select count(*) from 'events' where day = '2023-06-01'"
+        """
+        con = duckdb.connect()
+        cls.register_dataset(con, dataset, jobs, columns)
+        dataset.utils_cls.run_query(con, query_expression, output_format)
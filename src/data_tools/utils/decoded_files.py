@@ -0,0 +1,174 @@
+"""
+Expose files of any format to DuckDB as a table that every scan of a query reads from the start.
+
+A record batch reader can only be scanned once, while a query may scan a table several times (self-joins,
+subqueries). DuckDB 1.1 and later ask an object implementing the Arrow PyCapsule stream interface for a new
+stream on every scan: each one decodes the files lazily, batch by batch, so memory is bounded by the batch size
+and a LIMIT stops decoding once it is satisfied. No file is opened before DuckDB pulls its first batch, so the
+files of partitions pruned by the query are never opened.
+
+With older DuckDB or pyarrow, the files are exposed as a pyarrow dataset read through a file system serving
+every file as an Arrow IPC file of its decoded records. A file is decoded when first opened, streamed batch by
+batch to a temporary file, which the scans that follow read again: a LIMIT does not stop the decoding of a file.
+"""
+import itertools
+import os
+import tempfile
+import threading
+import typing as T
+import weakref
+from pathlib import Path
+
+import duckdb
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+
+# Decodes a file into record batches, lazily: nothing is read before the first batch is requested
+Decode = T.Callable[[Path], T.Iterable[pa.RecordBatch]]
+# Seconds to wait for DuckDB to release the streams of a closed connection, see close_streams
+RELEASE_TIMEOUT = 5
+
+# Streams registered in every connection, stopped when the connection is closed
+_streams: "weakref.WeakKeyDictionary[duckdb.DuckDBPyConnection, T.List[DecodedStream]]" = weakref.WeakKeyDictionary()
+# Notified whenever DuckDB releases a stream
+_streams_released = threading.Condition()
+
+
+def register_decoded(con: duckdb.DuckDBPyConnection, table_name: str, file_paths: T.List[Path],
+                     schema: pa.Schema, decode: Decode) -> None:
+    """
+    Make the records `decode` returns for the files queryable under the given table name.
+    """
+    if _scans_streams():
+        stream = DecodedStream(file_paths, schema, decode)
+        _streams.setdefault(con, []).append(stream)
+        con.register(table_name, stream)
+    else:
+        con.register(table_name, decoded_dataset(file_paths, schema, decode))
+
+
+def close_streams(con: duckdb.DuckDBPyConnection, timeout: float = RELEASE_TIMEOUT) -> None:
+    """
+    Stop decoding the files registered in the connection, once it is closed, and wait until DuckDB released them.
+    """
+    # DuckDB keeps pulling batches after a query stopped early (LIMIT), and releases the stream from one of its
+    # threads shortly after. Closing the decoding generators then runs Python code, which aborts the process or
+    # makes it hang when the interpreter is shutting down already.
+    streams = _streams.pop(con, [])
+    for stream in streams:
+        stream.stopped = True
+    with _streams_released:
+        _streams_released.wait_for(lambda: not any(stream.open_streams for stream in streams), timeout=timeout)
+
+
+def _scans_streams() -> bool:
+    major, minor = (int(part) for part in duckdb.__version__.split(".")[:2])
+    return (major, minor) >= (1, 1) and hasattr(pa.RecordBatchReader, "__arrow_c_stream__")
+
+
+class DecodedStream:
+    """
+    The records of the files, as a new Arrow stream decoding them on every request (PyCapsule interface).
+    """
+
+    def __init__(self, file_paths: T.List[Path], schema: pa.Schema, decode: Decode):
+        self.file_paths = file_paths
+        self.schema = schema
+        self.decode = decode
+        # Streams requested by DuckDB and not released yet
+        self.open_streams = 0
+        self.stopped = False
+
+    def __arrow_c_stream__(self, requested_schema: T.Optional[object] = None) -> object:
+        batches = self.batches()
+        with _streams_released:
+            self.open_streams += 1
+        # The generator is freed once DuckDB releases the stream
+        weakref.finalize(batches, self._release)
+        reader = pa.RecordBatchReader.from_batches(self.schema, batches)
+        return reader.__arrow_c_stream__(requested_schema)
+
+    def batches(self) -> T.Iterator[pa.RecordBatch]:
+        """
+        Decode the files one after the other, each opened once the batches of the previous one are exhausted.
+        """
+        batches = itertools.chain.from_iterable(map(self.decode, self.file_paths))
+        while not self.stopped:
+            batch = next(batches, None)
+            if batch is None:
+                return
+            yield batch
+
+    def _release(self) -> None:
+        with _streams_released:
+            self.open_streams -= 1
+            _streams_released.notify_all()
+
+
+class DecodedFileSystem(pafs.FileSystemHandler):
+    """
+    A read-only file system handler serving every file as an Arrow IPC file of the batches `decode` returns.
+
+    Files are decoded when first opened, into temporary files removed along with the handler.
+    """
+
+    def __init__(self, schema: pa.Schema, decode: Decode):
+        self.schema = schema
+        self.decode = decode
+        self.directory = tempfile.TemporaryDirectory(prefix="data-tools-")
+        self.decoded: T.Dict[str, str] = {}
+        self.locks: T.Dict[str, threading.Lock] = {}
+        self.lock = threading.Lock()
+
+    def get_type_name(self) -> str:
+        return "decoded"
+
+    def normalize_path(self, path: str) -> str:
+        return path
+
+    def equals(self, other: pafs.FileSystemHandler) -> bool:
+        return self is other
+
+    def __eq__(self, other: object) -> bool:
+        return self is other
+
+    def __hash__(self) -> int:
+        return id(self)
+
+    def get_file_info(self, paths: T.List[str]) -> T.List[pafs.FileInfo]:
+        return [pafs.FileInfo(path, pafs.FileType.File) for path in paths]
+
+    def get_file_info_selector(self, selector: pafs.FileSelector) -> T.List[pafs.FileInfo]:
+        raise NotImplementedError("Files are listed by the caller.")
+
+    def open_input_file(self, path: str) -> pa.NativeFile:
+        # The dataset scans several files in parallel threads, each file is decoded once
+        with self.lock:
+            lock = self.locks.setdefault(path, threading.Lock())
+        with lock:
+            if path not in self.decoded:
+                decoded_path = os.path.join(self.directory.name, f"{len(self.locks)}-{os.path.basename(path)}")
+                with pa.ipc.new_file(decoded_path, self.schema) as writer:
+                    for batch in self.decode(Path(path)):
+                        writer.write_batch(batch)
+                self.decoded[path] = decoded_path
+        return pa.memory_map(self.decoded[path])
+
+    def open_input_stream(self, path: str) -> pa.NativeFile:
+        return self.open_input_file(path)
+
+    def _read_only(self, *args, **kwargs) -> T.NoReturn:
+        raise OSError("Decoded files are read-only.")
+
+    create_dir = delete_dir = delete_dir_contents = delete_root_dir_contents = _read_only
+    delete_file = move = copy_file = open_output_stream = open_append_stream = _read_only
+
+
+def decoded_dataset(file_paths: T.List[Path], schema: pa.Schema, decode: Decode) -> ds.Dataset:
+    """
+    Build a dataset of the given files with the given schema, their records decoded by `decode`.
+    """
+    filesystem = pafs.PyFileSystem(DecodedFileSystem(schema, decode))
+    return ds.FileSystemDataset.from_paths([str(file_path) for file_path in file_paths], schema=schema,
+                                           format=ds.IpcFileFormat(), filesystem=filesystem)
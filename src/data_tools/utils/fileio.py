@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import contextlib
+import mmap
+import os
+import stat
+import typing as T
+from pathlib import Path
+
+from data_tools.utils.lazy import LazyModule
+
+if T.TYPE_CHECKING:
+    import pyarrow as pa
+else:
+    pa = LazyModule("pyarrow")
+
+# Set to 0 to read input files with buffered I/O instead of memory maps. An environment variable rather
+# than a module setting, so that worker processes, forked or spawned, follow the choice of the command.
+MMAP_ENV = "DATA_TOOLS_MMAP"
+# Number of Avro blocks or Parquet row groups read ahead of the decoder by background threads, 0 to disable.
+# An environment variable for the same reason as MMAP_ENV.
+PREFETCH_ENV = "DATA_TOOLS_PREFETCH"
+PREFETCH_DEPTH = 4
+
+
+def mmap_enabled() -> bool:
+    return os.environ.get(MMAP_ENV, "1") != "0"
+
+
+def prefetch_depth() -> int:
+    return int(os.environ.get(PREFETCH_ENV, PREFETCH_DEPTH))
+
+
+def read_at(fo: T.BinaryIO, offset: int, size: int) -> bytes:
+    """
+    Read `size` bytes at `offset` of a file opened by open_input, without moving its position.
+    Safe to call from several threads at once, while another one reads the file sequentially.
+    """
+    if isinstance(fo, mmap.mmap):
+        return fo[offset:offset + size]
+    return os.pread(fo.fileno(), size, offset)
+
+
+def _can_map(file_path: Path) -> bool:
+    # Pipes and devices cannot be mapped, nor can empty files
+    try:
+        file_stat = os.stat(file_path)
+    except OSError:
+        return False
+    return stat.S_ISREG(file_stat.st_mode) and file_stat.st_size > 0
+
+
+@contextlib.contextmanager
+def open_input(file_path: Path) -> T.Iterator[T.BinaryIO]:
+    """
+    Open a file for reading, as a read-only memory map of the whole file when mmap is enabled.
+
+    A map serves read, seek, tell and readline from the page cache without a system call each,
+    which matters when walking many small Avro block headers, and the pages are shared by every
+    process reading the file.
+    """
+    with open(file_path, "rb") as f:
+        if not (mmap_enabled() and _can_map(file_path)):
+            yield f
+            return
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    with mapped:
+        yield mapped
+
+
+def open_arrow_input(file_path: Path) -> pa.NativeFile:
+    """
+    Open a file for pyarrow readers, memory-mapped when mmap is enabled.
+    Buffers read from a memory-mapped file point into the map instead of holding a copy.
+    """
+    if mmap_enabled() and _can_map(file_path):
+        return pa.memory_map(str(file_path))
+    return pa.OSFile(str(file_path))
@@ -0,0 +1,133 @@
+import datetime
+import decimal
+import random
+import string
+import typing as T
+import uuid
+
+Generator = T.Callable[[random.Random], T.Any]
+
+ALPHABET = string.ascii_letters + string.digits
+# Maps every random byte onto the alphabet, which is much faster than drawing characters one by one
+ALPHABET_TABLE = bytes(ord(ALPHABET[i % len(ALPHABET)]) for i in range(256))
+STRING_LENGTH = 10
+MIN_ITEMS = 1
+MAX_ITEMS = 5
+
+EPOCH = datetime.datetime(1970, 1, 1)
+EPOCH_UTC = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+# Dates and timestamps are drawn between 1970-01-01 and 2038-01-19
+MAX_SECONDS = 2 ** 31 - 1
+
+
+def _random_string(rng: random.Random) -> str:
+    return rng.randbytes(STRING_LENGTH).translate(ALPHABET_TABLE).decode()
+
+
+def _random_bytes(rng: random.Random) -> bytes:
+    return rng.randbytes(STRING_LENGTH)
+
+
+PRIMITIVE_GENERATORS: T.Dict[str, Generator] = {
+    "null": lambda rng: None,
+    "boolean": lambda rng: rng.random() < 0.5,
+    "int": lambda rng: rng.getrandbits(32) - 2 ** 31,
+    "long": lambda rng: rng.getrandbits(64) - 2 ** 63,
+    # Scaled after drawing, the width of the full double range would overflow to inf
+    "float": lambda rng: (rng.random() * 2 - 1) * 3.4e38,
+    "double": lambda rng: (rng.random() * 2 - 1) * 1.7e308,
+    "string": _random_string,
+    "bytes": _random_bytes,
+}
+
+LOGICAL_GENERATORS: T.Dict[str, Generator] = {
+    "date": lambda rng: (EPOCH + datetime.timedelta(days=rng.randrange(MAX_SECONDS // 86400))).date(),
+    "time-millis": lambda rng: (EPOCH + datetime.timedelta(milliseconds=rng.randrange(86400000))).time(),
+    "time-micros": lambda rng: (EPOCH + datetime.timedelta(microseconds=rng.randrange(86400000000))).time(),
+    "timestamp-millis": lambda rng: EPOCH_UTC + datetime.timedelta(milliseconds=rng.randrange(MAX_SECONDS * 1000)),
+    "timestamp-micros": lambda rng: EPOCH_UTC + datetime.timedelta(microseconds=rng.randrange(MAX_SECONDS * 10 ** 6)),
+    "local-timestamp-millis": lambda rng: EPOCH + datetime.timedelta(milliseconds=rng.randrange(MAX_SECONDS * 1000)),
+    "local-timestamp-micros": lambda rng: EPOCH + datetime.timedelta(microseconds=rng.randrange(MAX_SECONDS * 10 ** 6)),
+    "uuid": lambda rng: uuid.UUID(int=rng.getrandbits(128)),
+}
+
+
+def compile_generator(schema: T.Union[str, T.List, T.Dict]) -> Generator:
+    """
+    Compile an Avro schema into a tree of generator callables.
+
+    Type dispatch happens once here; the returned callable only draws values from the given
+    random.Random, so a seeded generator always produces the same records.
+    """
+    return _compile(schema, {}, schema.get("namespace", "") if isinstance(schema, dict) else "")
+
+
+def _full_name(name: str, namespace: str) -> str:
+    if "." in name or not namespace:
+        return name
+    return f"{namespace}.{name}"
+
+
+def _compile(schema: T.Union[str, T.List, T.Dict], named: T.Dict[str, Generator], namespace: str) -> Generator:
+    if isinstance(schema, str):
+        if schema in PRIMITIVE_GENERATORS:
+            return PRIMITIVE_GENERATORS[schema]
+        for name in (_full_name(schema, namespace), schema):
+            if name in named:
+                return named[name]
+        raise ValueError("Unsupported type: {}".format(schema))
+
+    if isinstance(schema, list):
+        branches = [_compile(branch, named, namespace) for branch in schema]
+        return lambda rng: rng.choice(branches)(rng)
+
+    logical_type = schema.get("logicalType")
+    if logical_type in LOGICAL_GENERATORS:
+        return LOGICAL_GENERATORS[logical_type]
+    if logical_type == "decimal":
+        return _compile_decimal(schema)
+
+    type_name = schema["type"]
+    if type_name == "record" or type_name == "error":
+        full_name = _full_name(schema["name"], schema.get("namespace", namespace))
+        record_namespace = full_name.rpartition(".")[0]
+        fields = []
+
+        def record_generator(rng):
+            return {name: generate(rng) for name, generate in fields}
+
+        # Registered before its fields are compiled, so that a recursive field can refer to the record
+        named[full_name] = record_generator
+        for field in schema["fields"]:
+            fields.append((field["name"], _compile(field["type"], named, record_namespace)))
+        return record_generator
+    elif type_name == "enum":
+        symbols = list(schema["symbols"])
+        generator = named[_full_name(schema["name"], schema.get("namespace", namespace))] = \
+            lambda rng: rng.choice(symbols)
+        return generator
+    elif type_name == "fixed":
+        size = schema["size"]
+        generator = named[_full_name(schema["name"], schema.get("namespace", namespace))] = \
+            lambda rng: rng.randbytes(size)
+        return generator
+    elif type_name == "array":
+        items = _compile(schema["items"], named, namespace)
+        return lambda rng: [items(rng) for _ in range(rng.randint(MIN_ITEMS, MAX_ITEMS))]
+    elif type_name == "map":
+        values = _compile(schema["values"], named, namespace)
+        return lambda rng: {_random_string(rng): values(rng) for _ in range(rng.randint(MIN_ITEMS, MAX_ITEMS))}
+    else:
+        # A primitive type written in its object form, e.g. {"type": "string"}
+        return _compile(type_name, named, namespace)
+
+
+def _compile_decimal(schema: T.Dict) -> Generator:
+    precision = schema["precision"]
+    scale = schema.get("scale", 0)
+    limit = 10 ** precision
+
+    def decimal_generator(rng):
+        return decimal.Decimal(rng.randrange(-limit + 1, limit)).scaleb(-scale)
+
+    return decimal_generator
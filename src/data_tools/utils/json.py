@@ -0,0 +1,32 @@
+import typing as T
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.json as pa_json
+
+from data_tools.utils.text import BLOCK_SIZE, TextUtils
+
+
+class JsonUtils(TextUtils):
+    output_format = "jsonl"
+
+    @classmethod
+    def open_reader(cls, source: T.Union[Path, T.BinaryIO], block_size: int = BLOCK_SIZE) -> pa.RecordBatchReader:
+        """
+        Open a streaming reader of newline-delimited JSON. Types are inferred from the first block.
+
+        pyarrow before 14 has no streaming JSON reader: there, the whole file is read into a table first.
+        """
+        read_options = pa_json.ReadOptions(block_size=block_size)
+        if not hasattr(pa_json, "open_json"):
+            table = pa_json.read_json(source, read_options=read_options)
+            return pa.RecordBatchReader.from_batches(table.schema, table.to_batches())
+        return pa_json.open_json(source, read_options=read_options)
+
+    @classmethod
+    def read_lines(cls, data: pa.Buffer, schema: pa.Schema) -> pa.Table:
+        if not data:
+            return schema.empty_table()
+        # Like the streaming reader, fields missing from the first block are not picked up later on
+        parse_options = pa_json.ParseOptions(explicit_schema=schema, unexpected_field_behavior="ignore")
+        return pa_json.read_json(pa.BufferReader(data), parse_options=parse_options)
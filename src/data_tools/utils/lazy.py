@@ -0,0 +1,18 @@
+import importlib
+import types
+import typing as T
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stand-in for a module that is only imported on first attribute access.
+
+    Heavy backends (pyarrow, duckdb, numpy) are bound this way so commands that do not need them
+    start without paying for their import.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+
+    def __getattr__(self, attr: str) -> T.Any:
+        return getattr(importlib.import_module(self.__name__), attr)
@@ -0,0 +1,165 @@
+import base64
+import datetime
+import functools
+import json
+import sys
+import typing as T
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+OUTPUT_FORMATS = ("jsonl", "csv", "arrow")
+
+
+def write_batches(schema: pa.Schema, batches: T.Iterable[pa.RecordBatch], output_format: str = "jsonl",
+                  stream: T.Optional[T.IO[bytes]] = None) -> int:
+    """
+    Write record batches to stdout (or `stream`) one batch at a time, as JSON Lines, CSV or an Arrow IPC stream.
+
+    Nothing is accumulated: output starts with the first batch and every batch is a single buffered write.
+    Returns the number of rows written.
+    """
+    if stream is None:
+        # Anything printed before goes out first, the rest is written to the underlying binary buffer
+        sys.stdout.flush()
+        stream = sys.stdout.buffer
+
+    num_rows = 0
+    if output_format == "jsonl":
+        for batch in batches:
+            rows = to_pylist(batch)
+            stream.write("".join(_to_json(row) + "\n" for row in rows).encode())
+            num_rows += batch.num_rows
+    elif output_format == "csv":
+        csv_schema = pa.schema([_csv_field(field) for field in schema])
+        with pa_csv.CSVWriter(stream, csv_schema) as writer:
+            for batch in batches:
+                writer.write_batch(_csv_batch(batch, csv_schema))
+                num_rows += batch.num_rows
+    elif output_format == "arrow":
+        with pa.ipc.new_stream(stream, schema) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+                num_rows += batch.num_rows
+    else:
+        raise ValueError("Unsupported output format: {}".format(output_format))
+    stream.flush()
+    return num_rows
+
+
+def write_records(field_names: T.Sequence[str], records: T.Iterable[T.Dict], output_format: str = "jsonl",
+                  stream: T.Optional[T.IO[bytes]] = None) -> int:
+    """
+    Write records one at a time, for schemas without an Arrow representation (Avro unions of several types).
+
+    The output matches write_batches for JSON Lines and CSV. Returns the number of rows written.
+    """
+    if output_format not in ("jsonl", "csv"):
+        raise ValueError("Records of this schema can only be written as jsonl or csv, not {}".format(output_format))
+    if stream is None:
+        sys.stdout.flush()
+        stream = sys.stdout.buffer
+
+    lines = []
+    if output_format == "csv":
+        lines.append(",".join(_csv_value(name) for name in field_names))
+    num_rows = 0
+    for record in records:
+        if output_format == "jsonl":
+            lines.append(_to_json(record))
+        else:
+            lines.append(",".join(_csv_value(record.get(name)) for name in field_names))
+        num_rows += 1
+    stream.write("".join(line + "\n" for line in lines).encode())
+    stream.flush()
+    return num_rows
+
+
+def to_pylist(values: T.Union[pa.RecordBatch, pa.Array]) -> T.List:
+    """
+    Convert the rows of a record batch or the values of an array to Python objects, maps as dicts.
+    """
+    if _maps_as_pydicts():
+        return values.to_pylist(maps_as_pydicts="lossy")
+    # Before pyarrow 20, maps are converted to lists of (key, value) tuples
+    if isinstance(values, pa.RecordBatch):
+        fields = [field for field in values.schema if _has_map(field.type)]
+        rows = values.to_pylist()
+        for row in rows:
+            for field in fields:
+                row[field.name] = _maps_to_dicts(row[field.name], field.type)
+        return rows
+    if not _has_map(values.type):
+        return values.to_pylist()
+    return [_maps_to_dicts(value, values.type) for value in values.to_pylist()]
+
+
+@functools.lru_cache(maxsize=None)
+def _maps_as_pydicts() -> bool:
+    try:
+        pa.array([], pa.null()).to_pylist(maps_as_pydicts="lossy")
+    except TypeError:
+        return False
+    return True
+
+
+def _has_map(arrow_type: pa.DataType) -> bool:
+    if pa.types.is_map(arrow_type):
+        return True
+    return any(_has_map(arrow_type.field(i).type) for i in range(arrow_type.num_fields))
+
+
+def _maps_to_dicts(value: T.Any, arrow_type: pa.DataType) -> T.Any:
+    if value is None:
+        return None
+    if pa.types.is_map(arrow_type):
+        # Like maps_as_pydicts="lossy", the last of duplicate keys wins
+        return {_maps_to_dicts(key, arrow_type.key_type): _maps_to_dicts(item, arrow_type.item_type)
+                for key, item in value}
+    if pa.types.is_struct(arrow_type):
+        return {field.name: _maps_to_dicts(value[field.name], field.type) for field in arrow_type}
+    if pa.types.is_list(arrow_type) or pa.types.is_large_list(arrow_type) or \
+            pa.types.is_fixed_size_list(arrow_type):
+        return [_maps_to_dicts(item, arrow_type.value_type) for item in value]
+    return value
+
+
+def _json_default(value: T.Any) -> T.Any:
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(value).decode()
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    # Decimal, UUID, ...
+    return str(value)
+
+
+def _to_json(value: T.Any) -> str:
+    return json.dumps(value, default=_json_default, ensure_ascii=False)
+
+
+def _csv_value(value: T.Any) -> str:
+    # Quoted like pyarrow's CSV writer: strings and nested values (as JSON) are quoted, numbers are not
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return str(value)
+    if not isinstance(value, str):
+        value = _to_json(value) if isinstance(value, (dict, list)) else _json_default(value)
+    return '"{}"'.format(value.replace('"', '""'))
+
+
+def _csv_field(field: pa.Field) -> pa.Field:
+    # Nested values have no CSV representation, they are written as JSON strings
+    return field.with_type(pa.string()) if pa.types.is_nested(field.type) else field
+
+
+def _csv_batch(batch: pa.RecordBatch, csv_schema: pa.Schema) -> pa.RecordBatch:
+    columns = []
+    for column, field in zip(batch.columns, csv_schema):
+        if pa.types.is_nested(column.type):
+            values = to_pylist(column)
+            column = pa.array([None if value is None else _to_json(value) for value in values], pa.string())
+        columns.append(column)
+    return pa.RecordBatch.from_arrays(columns, schema=csv_schema)
@@ -0,0 +1,53 @@
+import collections
+import concurrent.futures
+import os
+import typing as T
+
+Executor = T.Type[concurrent.futures.Executor]
+
+
+def ordered_map(function: T.Callable, items: T.Iterable, jobs: T.Optional[int] = None,
+                executor_class: Executor = concurrent.futures.ProcessPoolExecutor,
+                max_pending: T.Optional[int] = None) -> T.Iterator:
+    """
+    Like Executor.map, but keeps at most `max_pending` tasks in flight.
+
+    Results are yielded in order as soon as they are ready, so a slow consumer (a file writer) keeps memory
+    bounded instead of letting finished results pile up. With a single job everything runs in-process.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1:
+        yield from map(function, items)
+        return
+
+    with executor_class(jobs) as executor:
+        yield from _bounded_map(executor, function, items, max_pending or 2 * jobs)
+
+
+def prefetch(function: T.Callable, items: T.Iterable, depth: int) -> T.Iterator:
+    """
+    Map in a pool of `depth` threads, computing up to `depth` results ahead of the consumer, in order.
+
+    Meant for I/O and for work releasing the GIL (decompression, Arrow reads), overlapped with the consumer.
+    Items are drawn from `items` in the consumer thread. With a depth of 0, everything runs in-process.
+    """
+    if not depth:
+        yield from map(function, items)
+        return
+    with concurrent.futures.ThreadPoolExecutor(depth) as executor:
+        yield from _bounded_map(executor, function, items, depth)
+
+
+def _bounded_map(executor: concurrent.futures.Executor, function: T.Callable, items: T.Iterable,
+                 max_pending: int) -> T.Iterator:
+    pending = collections.deque()
+    try:
+        for item in items:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
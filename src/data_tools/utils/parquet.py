@@ -1,29 +1,61 @@
+from __future__ import annotations
+
+import concurrent.futures
+import functools
 import json
 import typing as T
 from pathlib import Path
 
 import fastavro
 import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.parquet as pq
 
+from data_tools.utils import profile
+from data_tools.utils.avro_arrow import avro_to_arrow_schema
 from data_tools.utils.base import BaseUtils
+from data_tools.utils.cache import cached, entry_name
+from data_tools.utils.fileio import mmap_enabled, prefetch_depth
+from data_tools.utils.lazy import LazyModule
+from data_tools.utils.parallel import prefetch
+
+if T.TYPE_CHECKING:
+    import duckdb
+
+    from data_tools.utils.stats import TableStats
+else:
+    duckdb = LazyModule("duckdb")
+
+# Rows per row group written, the pyarrow default
+ROW_GROUP_SIZE = 1024 * 1024
 
 
 class ParquetUtils(BaseUtils):
     @classmethod
-    def create_sample(cls, file_path: Path, schema_path: Path, sample_size: int, codec: str = None,
-                      metadata=None, sync_interval: int = 1024 * 1024) -> Path:
+    def create_sample(cls, file_path: Path, schema_path: Path, sample_size: int, codec: T.Optional[str] = None,
+                      metadata=None, sync_interval: int = 1024 * 1024, seed: T.Optional[int] = None,
+                      columnar: bool = False, jobs: T.Optional[int] = None, chunk_size: int = 100_000) -> Path:
         """
         Create a random sample data file given an Avro schema file.
+        The same seed always produces the same records.
+
+        In columnar mode, whole columns are generated with NumPy in chunks of `chunk_size` rows across
+        `jobs` processes and written incrementally, so memory stays flat whatever the sample size.
         """
         if metadata is None:
             metadata = {"Name": "Dummy data"}
 
         with open(schema_path, "r") as f:
-            schema = json.load(f)
-            schema = fastavro.parse_schema(schema=schema)
+            schema = T.cast(T.Dict, fastavro.parse_schema(schema=json.load(f)))
 
-        sample_data = cls.generate_data(schema, sample_size)
+        if columnar:
+            arrow_schema = avro_to_arrow_schema(schema).with_metadata(metadata)
+            with pq.ParquetWriter(file_path, arrow_schema, compression=codec) as writer:
+                for batch in cls.generate_batches(schema, sample_size, seed, jobs, chunk_size):
+                    writer.write_batch(batch)
+            return file_path
+
+        sample_data = cls.generate_data(schema, sample_size, seed)
 
         table = pa.Table.from_pylist(sample_data)
         table = table.replace_schema_metadata(metadata)
@@ -36,45 +68,383 @@ class ParquetUtils(BaseUtils):
         """
         Inspect metadata of a Parquet file.
         """
-        parquet_file = pq.ParquetFile(file_path)
+        parquet_file = pq.ParquetFile(file_path, memory_map=mmap_enabled())
         codec = parquet_file.metadata.row_group(0).column(0).compression
         cls.print_metadata(parquet_file.schema, parquet_file.metadata, codec, parquet_file.metadata)
         return parquet_file.schema, parquet_file.metadata, codec, parquet_file.metadata
 
     @classmethod
-    def stats(cls, file_path: Path):
-        parquet_file = pq.ParquetFile(file_path)
-        num_rows = parquet_file.metadata.num_rows
-        column_stats = {}
-        for i in range(parquet_file.num_row_groups):
-            table = parquet_file.read_row_group(i)
-            for j, column_name in enumerate(table.schema.names):
-                column = table.column(j)
-                column_stat = column_stats.get(column_name, {
+    def num_rows(cls, file_path: Path, cache: bool = True) -> int:
+        # Only the footer is read, there is nothing worth caching
+        return pq.read_metadata(file_path, memory_map=mmap_enabled()).num_rows
+
+    @classmethod
+    def stats(cls, file_path: Path, jobs: T.Optional[int] = None, cache: bool = True,
+              columns: T.Optional[T.Sequence[str]] = None, approx: bool = False) -> T.Tuple[int, T.Dict]:
+        """
+        Compute per-column statistics of a Parquet file, or of the given top-level columns only.
+
+        Statistics are merged from the column chunk statistics stored in the footer, so no data pages are read.
+        Only columns whose chunks lack statistics are decoded, one row group per worker thread.
+        The "source" of every column stat tells which of the two paths was used.
+        In approximate mode, every row group is decoded to estimate quantiles and most frequent values with
+        mergeable sketches. Results are cached until the file changes.
+        """
+        num_rows, column_stats = cls.summarize_stats(cls.file_stats(file_path, jobs, cache, columns, approx))
+        cls.print_stats(num_rows, column_stats)
+        return num_rows, column_stats
+
+    @classmethod
+    def file_stats(cls, file_path: Path, jobs: T.Optional[int] = None, cache: bool = True,
+                   columns: T.Optional[T.Sequence[str]] = None,
+                   approx: bool = False) -> T.Union[T.Tuple[int, T.Dict], TableStats]:
+        if approx:
+            compute_approx = functools.partial(cls._compute_approx_stats, file_path, jobs, columns)
+            return cached(file_path, entry_name("approx_stats", columns), compute_approx, cache)
+        compute = functools.partial(cls._compute_stats, file_path, jobs, columns)
+        return cached(file_path, entry_name("stats", columns), compute, cache)
+
+    @classmethod
+    def merge_stats(cls, left: T.Union[T.Tuple[int, T.Dict], TableStats],
+                    right: T.Union[T.Tuple[int, T.Dict], TableStats]) -> T.Union[T.Tuple[int, T.Dict], TableStats]:
+        if not isinstance(left, tuple) or not isinstance(right, tuple):
+            return BaseUtils.merge_stats(left, right)
+        num_rows, column_stats = left[0], {name: dict(column_stat) for name, column_stat in left[1].items()}
+        for column_path, other in right[1].items():
+            if column_path not in column_stats:
+                column_stats[column_path] = dict(other)
+                continue
+            column_stat = column_stats[column_path]
+            column_stat["count"] += other["count"]
+            column_stat["null_count"] += other["null_count"]
+            cls._merge_min_max(column_stat, other["min"], other["max"])
+            if other["source"] == "decoded":
+                column_stat["source"] = "decoded"
+        return num_rows + right[0], column_stats
+
+    @staticmethod
+    def summarize_stats(file_stats: T.Union[T.Tuple[int, T.Dict], TableStats]) -> T.Tuple[int, T.Dict]:
+        if not isinstance(file_stats, tuple):
+            return BaseUtils.summarize_stats(file_stats)
+        return file_stats
+
+    @classmethod
+    def _compute_approx_stats(cls, file_path: Path, jobs: T.Optional[int],
+                              columns: T.Optional[T.Sequence[str]] = None) -> TableStats:
+        from data_tools.utils.stats import TableStats
+
+        if columns:
+            cls.project_schema(pq.read_schema(file_path, memory_map=mmap_enabled()), columns)
+        num_row_groups = pq.read_metadata(file_path, memory_map=mmap_enabled()).num_row_groups
+        aggregate = functools.partial(cls._row_group_approx_stats, file_path, columns)
+        with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+            return functools.reduce(TableStats.merge, executor.map(aggregate, range(num_row_groups)), TableStats(True))
+
+    @staticmethod
+    def _row_group_approx_stats(file_path: Path, columns: T.Optional[T.Sequence[str]], i: int) -> TableStats:
+        from data_tools.utils.stats import TableStats
+
+        # Every worker opens its own reader, ParquetFile instances are not shared across threads
+        parquet_file = pq.ParquetFile(file_path, memory_map=mmap_enabled())
+        table_stats = TableStats(True)
+        ParquetUtils._count_row_groups(parquet_file.metadata, [i], columns)
+        with profile.span("read"):
+            table = parquet_file.read_row_group(i, columns=columns or None, use_threads=False)
+        table_stats.update(table)
+        return table_stats
+
+    @classmethod
+    def _compute_stats(cls, file_path: Path, jobs: T.Optional[int],
+                       columns: T.Optional[T.Sequence[str]] = None) -> T.Tuple[int, T.Dict]:
+        with profile.span("metadata"):
+            parquet_file = pq.ParquetFile(file_path, memory_map=mmap_enabled())
+            metadata = parquet_file.metadata
+        if columns:
+            cls.project_schema(parquet_file.schema_arrow, columns)
+        num_rows = metadata.num_rows
+        column_stats: T.Dict[str, T.Dict[str, T.Any]] = {}
+        undecoded = set()
+        for i in range(metadata.num_row_groups):
+            row_group = metadata.row_group(i)
+            for j in range(row_group.num_columns):
+                column = row_group.column(j)
+                if columns and column.path_in_schema.split(".")[0] not in columns:
+                    continue
+                column_stat = column_stats.setdefault(column.path_in_schema, {
                     "count": 0,
                     "null_count": 0,
                     "min": None,
-                    "max": None
+                    "max": None,
+                    "source": "footer",
                 })
-                column_stat["count"] += len(column)
-                column_stat["null_count"] += column.null_count
-                column_stat["min"] = pa.compute.min(column).as_py()
-                column_stat["max"] = pa.compute.max(column).as_py()
-                column_stats[column_name] = column_stat
+                column_stat["count"] += column.num_values
+                statistics = column.statistics
+                if statistics is None or not statistics.has_null_count:
+                    undecoded.add(column.path_in_schema)
+                elif statistics.has_min_max:
+                    column_stat["null_count"] += statistics.null_count
+                    cls._merge_min_max(column_stat, statistics.min, statistics.max)
+                elif statistics.null_count == column.num_values:
+                    # All values are null, there is nothing to merge
+                    column_stat["null_count"] += statistics.null_count
+                else:
+                    undecoded.add(column.path_in_schema)
+
+        if undecoded:
+            for column_path in undecoded:
+                column_stats[column_path].update(null_count=0, min=None, max=None, source="decoded")
+            decode = functools.partial(cls._decode_row_group_stats, file_path, sorted(undecoded))
+            with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+                for row_group_stats in executor.map(decode, range(metadata.num_row_groups)):
+                    for column_path, (null_count, min_value, max_value) in row_group_stats.items():
+                        column_stat = column_stats[column_path]
+                        column_stat["null_count"] += null_count
+                        cls._merge_min_max(column_stat, min_value, max_value)
+
         return num_rows, column_stats
 
+    @staticmethod
+    def _merge_min_max(column_stat: T.Dict, min_value, max_value) -> None:
+        if min_value is not None and (column_stat["min"] is None or min_value < column_stat["min"]):
+            column_stat["min"] = min_value
+        if max_value is not None and (column_stat["max"] is None or max_value > column_stat["max"]):
+            column_stat["max"] = max_value
+
+    @classmethod
+    def _decode_row_group_stats(cls, file_path: Path, column_paths: T.List[str], i: int) -> T.Dict[str, T.Tuple]:
+        """
+        Decode the given leaf columns of a single row group and return their null count, min and max.
+        """
+        # Every worker opens its own reader, ParquetFile instances are not shared across threads
+        parquet_file = pq.ParquetFile(file_path, memory_map=mmap_enabled())
+        top_level_names = sorted({column_path.split(".")[0] for column_path in column_paths})
+        cls._count_row_groups(parquet_file.metadata, [i], top_level_names)
+        with profile.span("read"):
+            table = parquet_file.read_row_group(i, columns=top_level_names, use_threads=False)
+
+        row_group_stats = {}
+        for column_path in column_paths:
+            top_level_name, *path = column_path.split(".")
+            array = cls._leaf_array(table.column(top_level_name).combine_chunks(), path)
+            try:
+                min_max = pc.min_max(array)
+                min_value, max_value = min_max["min"].as_py(), min_max["max"].as_py()
+            except pa.ArrowNotImplementedError:
+                min_value = max_value = None
+            row_group_stats[column_path] = (array.null_count, min_value, max_value)
+        return row_group_stats
+
+    @staticmethod
+    def _leaf_array(array: pa.Array, path: T.List[str]) -> pa.Array:
+        """
+        Follow a Parquet column path ("address.street", "phone_numbers.list.element") down to the leaf values.
+        """
+        i = 0
+        while i < len(path):
+            if pa.types.is_map(array.type):
+                # <name>.key_value.key or <name>.key_value.value
+                array = array.keys if path[i + 1] == "key" else array.items
+                i += 2
+            elif pa.types.is_list(array.type) or pa.types.is_large_list(array.type):
+                # <name>.list.element
+                array = array.flatten()
+                i += 2
+            elif pa.types.is_struct(array.type):
+                array = array.flatten()[array.type.get_field_index(path[i])]
+                i += 1
+            else:
+                raise ValueError(f"Cannot resolve column path {'.'.join(path)} in {array.type}")
+        return array
+
+    @classmethod
+    def arrow_schema(cls, file_path: Path, cache: bool = True) -> pa.Schema:
+        # Read from the footer, there is nothing worth caching
+        return pq.read_schema(file_path, memory_map=mmap_enabled())
+
+    @classmethod
+    def to_record_batch_reader(cls, file_path: Path, batch_size: int = 65536, jobs: T.Optional[int] = None,
+                               columns: T.Optional[T.Sequence[str]] = None) -> pa.RecordBatchReader:
+        """
+        Stream a Parquet file as Arrow record batches of at most `batch_size` rows, one row group at a time.
+        Only the column chunks of the given columns are read.
+
+        Background threads read the next row groups while the batches of the current one are consumed,
+        holding up to the prefetch depth of row groups in memory; without prefetch, batches are read one by one.
+        """
+        parquet_file = pq.ParquetFile(file_path, memory_map=mmap_enabled())
+        schema = cls.project_schema(parquet_file.schema_arrow, columns)
+        metadata = parquet_file.metadata
+        cls._count_row_groups(metadata, range(metadata.num_row_groups), columns)
+        depth = prefetch_depth()
+        if depth:
+            read = functools.partial(cls._read_row_group, file_path, metadata, columns, jobs != 1)
+            tables = prefetch(read, range(metadata.num_row_groups), depth)
+            batches = (batch for table in tables for batch in table.to_batches(batch_size))
+        else:
+            batches = parquet_file.iter_batches(batch_size, columns=columns or None, use_threads=jobs != 1)
+        return pa.RecordBatchReader.from_batches(schema, profile.timed_iter("read", batches))
+
+    @staticmethod
+    def _read_row_group(file_path: Path, metadata: pq.FileMetaData, columns: T.Optional[T.Sequence[str]],
+                        use_threads: bool, i: int) -> pa.Table:
+        # Every worker opens its own reader, ParquetFile instances are not shared across threads.
+        # The footer is already parsed, nothing but the column chunks is read again.
+        parquet_file = pq.ParquetFile(file_path, metadata=metadata, memory_map=mmap_enabled())
+        return parquet_file.read_row_group(i, columns=columns or None, use_threads=use_threads)
+
+    @classmethod
+    def write_record_batches(cls, file_path: Path, schema: pa.Schema, batches: T.Iterable[pa.RecordBatch],
+                             codec: T.Optional[str] = None, *, jobs: T.Optional[int] = None,
+                             row_group_size: int = ROW_GROUP_SIZE, **options) -> int:
+        """
+        Write record batches to a Parquet file, one row group of `row_group_size` rows at a time.
+
+        Batches are buffered until a row group is full, so memory is bounded by the row group size.
+        Returns the number of rows written.
+        """
+        num_rows = 0
+        pending = []
+        num_pending = 0
+        with pq.ParquetWriter(file_path, schema, compression=codec or "snappy") as writer:
+            for batch in batches:
+                pending.append(batch)
+                num_pending += batch.num_rows
+                num_rows += batch.num_rows
+                if num_pending >= row_group_size:
+                    table = pa.Table.from_batches(pending, schema)
+                    num_full = num_pending - num_pending % row_group_size
+                    writer.write_table(table.slice(0, num_full), row_group_size)
+                    pending = table.slice(num_full).to_batches()
+                    num_pending -= num_full
+            if num_pending:
+                writer.write_table(pa.Table.from_batches(pending, schema), row_group_size)
+        return num_rows
+
+    @classmethod
+    def register_files(cls, con: duckdb.DuckDBPyConnection, table_name: str, file_paths: T.List[Path],
+                       jobs: T.Optional[int] = None, schema: T.Optional[pa.Schema] = None,
+                       columns: T.Optional[T.Sequence[str]] = None) -> None:
+        """
+        Expose the files to DuckDB as a view over read_parquet, restricted to the given columns.
+
+        DuckDB then scans the files itself: only the columns referenced by the query are read and
+        row groups are skipped using the footer statistics of the columns in the WHERE clause.
+        Row groups are scanned by `jobs` DuckDB threads.
+
+        When a schema is given, the files are registered as a pyarrow dataset instead, which opens no file
+        before DuckDB scans it: read_parquet reads the footers when the view is created.
+        """
+        if jobs:
+            con.execute(f"SET threads = {int(jobs)}")
+        if schema is not None:
+            import pyarrow.dataset as ds
+
+            # Filters and projections are pushed down to the dataset, which skips row groups the same way
+            dataset = ds.dataset([str(file_path) for file_path in file_paths], cls.project_schema(schema, columns),
+                                 format="parquet")
+            con.register(table_name, dataset)
+            return
+        if columns:
+            cls.project_schema(cls.arrow_schema(file_paths[0]), columns)
+        table_name = table_name.replace('"', '""')
+        paths = ", ".join("'{}'".format(str(file_path).replace("'", "''")) for file_path in file_paths)
+        select = ", ".join('"{}"'.format(column.replace('"', '""')) for column in columns) if columns else "*"
+        # Partition columns of Hive-style paths are added by the caller, not guessed by DuckDB
+        con.execute(f"CREATE OR REPLACE TEMP VIEW \"{table_name}\" AS "
+                    f"SELECT {select} FROM read_parquet([{paths}], hive_partitioning = false)")
+
+    @classmethod
+    def register_persistent_table(cls, con: duckdb.DuckDBPyConnection, file_path: Path, jobs: T.Optional[int] = None,
+                                  columns: T.Optional[T.Sequence[str]] = None) -> None:
+        # The view reads the file again on every scan, only the row groups and columns a query needs
+        cls.register_table(con, file_path, jobs, columns)
+
+    @staticmethod
+    def _covering_row_groups(metadata: pq.FileMetaData, n: int, from_end: bool = False) -> T.List[int]:
+        """
+        Return the indices (in file order) of the fewest leading or trailing row groups holding N rows.
+        """
+        indices: T.Iterable[int] = range(metadata.num_row_groups)
+        if from_end:
+            indices = reversed(range(metadata.num_row_groups))
+        row_groups = []
+        num_rows = 0
+        for i in indices:
+            if num_rows >= n:
+                break
+            row_groups.append(i)
+            num_rows += metadata.row_group(i).num_rows
+        return sorted(row_groups)
+
+    @staticmethod
+    def _count_row_groups(metadata: pq.FileMetaData, row_groups: T.Iterable[int],
+                          columns: T.Optional[T.Sequence[str]] = None) -> None:
+        """
+        Count the row groups, rows and compressed bytes of the given columns a read goes through, when profiling.
+        """
+        if not profile.enabled():
+            return
+        for i in row_groups:
+            row_group = metadata.row_group(i)
+            profile.count("row_groups_decoded")
+            profile.count("rows_decoded", row_group.num_rows)
+            profile.count("bytes_read", sum(
+                row_group.column(j).total_compressed_size for j in range(row_group.num_columns)
+                if not columns or row_group.column(j).path_in_schema.split(".")[0] in columns
+            ))
+
     @classmethod
-    def tail(cls, file_path: Path, n: int = 20):
+    def take_rows(cls, file_path: Path, positions: T.Sequence[int], columns: T.Optional[T.Sequence[str]] = None,
+                  cache: bool = True) -> pa.Table:
+        """
+        Return the rows at the given sorted positions of a Parquet file.
+        Using the footer row counts, only the row groups holding them are read, one at a time.
+        """
+        from data_tools.utils.sampling import group_positions
+
+        parquet_file = pq.ParquetFile(file_path, memory_map=mmap_enabled())
+        schema = cls.project_schema(parquet_file.schema_arrow, columns)
+        metadata = parquet_file.metadata
+        offsets = group_positions(positions, (metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)))
+        cls._count_row_groups(metadata, offsets, columns)
+        with profile.span("read"):
+            tables = [
+                parquet_file.read_row_group(i, columns=columns or None).take(row_group_offsets)
+                for i, row_group_offsets in offsets.items()
+            ]
+        return pa.concat_tables(tables) if tables else schema.empty_table()
+
+    @classmethod
+    def tail(cls, file_path: Path, n: int = 20, output_format: str = "jsonl",
+             columns: T.Optional[T.Sequence[str]] = None) -> pa.Table:
         """
         Prints the last N records of a Parquet file.
+
+        Only the trailing row groups needed to cover N rows are read, using the footer row counts.
         """
-        table = pq.read_table(str(file_path), use_threads=True)
-        total_rows = table.num_rows
-        start_row = max(total_rows - n, 0)
-        for row in table.slice(start_row, total_rows).to_pydict().values():
-            print(row)
+        parquet_file = pq.ParquetFile(file_path, memory_map=mmap_enabled())
+        cls.project_schema(parquet_file.schema_arrow, columns)
+        row_groups = cls._covering_row_groups(parquet_file.metadata, n, from_end=True)
+        cls._count_row_groups(parquet_file.metadata, row_groups, columns)
+        with profile.span("read"):
+            table = parquet_file.read_row_groups(row_groups, columns=columns or None, use_threads=True)
+        table = table.slice(max(table.num_rows - n, 0))
+        cls.print_batches(table.schema, table.to_batches(), output_format)
+        return table
 
     @classmethod
-    def head(cls, file_path: Path, n: int = 20):
-        table = pa.parquet.read_table(file_path).slice(0, n)
-        cls._print_table(table)
+    def head(cls, file_path: Path, n: int = 20, output_format: str = "jsonl",
+             columns: T.Optional[T.Sequence[str]] = None) -> pa.Table:
+        """
+        Prints the first N records of a Parquet file.
+
+        Only the leading row groups needed to cover N rows are read, using the footer row counts.
+        """
+        parquet_file = pq.ParquetFile(file_path, memory_map=mmap_enabled())
+        cls.project_schema(parquet_file.schema_arrow, columns)
+        row_groups = cls._covering_row_groups(parquet_file.metadata, n)
+        cls._count_row_groups(parquet_file.metadata, row_groups, columns)
+        with profile.span("read"):
+            table = parquet_file.read_row_groups(row_groups, columns=columns or None, use_threads=True).slice(0, n)
+        cls.print_batches(table.schema, table.to_batches(), output_format)
+        return table
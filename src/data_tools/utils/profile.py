@@ -0,0 +1,182 @@
+"""
+Per-phase timing and counters of a command, enabled by the --profile flag.
+
+Spans measure self time: while a nested span runs, the time goes to it and not to the enclosing one, so the
+spans of a command add up to its wall time. Spans never enclose a `yield`, generators time each step
+separately, see timed_iter. Every thread keeps its own stack of spans; time spent in worker threads adds up
+with the time of the thread waiting for them. Worker processes (--jobs with Avro and text files) are not
+profiled, the time waiting for them goes to the enclosing span.
+"""
+from __future__ import annotations
+
+import collections
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+import typing as T
+
+
+class Profiler:
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.seconds = collections.defaultdict(float)
+        self.calls = collections.defaultdict(int)
+        self.counters = collections.defaultdict(int)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self) -> T.List[T.List]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def enter(self, name: str) -> None:
+        now = time.perf_counter()
+        stack = self._stack()
+        with self._lock:
+            if stack:
+                self.seconds[stack[-1][0]] += now - stack[-1][1]
+            self.calls[name] += 1
+        stack.append([name, now])
+
+    def exit(self) -> None:
+        now = time.perf_counter()
+        stack = self._stack()
+        name, start = stack.pop()
+        with self._lock:
+            self.seconds[name] += now - start
+        if stack:
+            # The enclosing span resumes
+            stack[-1][1] = now
+
+    def count(self, name: str, value: int) -> None:
+        with self._lock:
+            self.counters[name] += value
+
+    def report(self) -> T.Dict:
+        report = {
+            "wall_seconds": time.perf_counter() - self.start_time,
+            "spans": {
+                name: {"seconds": self.seconds[name], "calls": self.calls[name]}
+                for name in sorted(self.seconds, key=self.seconds.get, reverse=True)
+            },
+            "counters": dict(sorted(self.counters.items())),
+            "peak_rss_bytes": _peak_rss(),
+        }
+        if "pyarrow" in sys.modules:
+            report["arrow_peak_bytes"] = sys.modules["pyarrow"].default_memory_pool().max_memory()
+        io_counters = _io_counters()
+        if io_counters:
+            report["io"] = io_counters
+        return report
+
+
+_profiler: T.Optional[Profiler] = None
+
+
+def enable() -> Profiler:
+    """
+    Start profiling this process, and time the decompression of Avro blocks.
+    """
+    global _profiler
+    _profiler = Profiler()
+    _instrument_block_readers()
+    return _profiler
+
+
+def enabled() -> bool:
+    return _profiler is not None
+
+
+@contextlib.contextmanager
+def span(name: str) -> T.Iterator[None]:
+    if _profiler is None:
+        yield
+        return
+    _profiler.enter(name)
+    try:
+        yield
+    finally:
+        _profiler.exit()
+
+
+def count(name: str, value: int = 1) -> None:
+    if _profiler is not None:
+        _profiler.count(name, value)
+
+
+def timed_iter(name: str, iterable: T.Iterable) -> T.Iterator:
+    """
+    Iterate, counting the time spent producing every item in the given span.
+    """
+    iterator = iter(iterable)
+    if _profiler is None:
+        return iterator
+    return _timed_iter(name, iterator)
+
+
+def _timed_iter(name: str, iterator: T.Iterator) -> T.Iterator:
+    while True:
+        with span(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def write_report(destination: str, command: str) -> None:
+    """
+    Write the report as JSON to stderr ("-") or appended as one line to a file, for collecting from batch jobs.
+    """
+    line = json.dumps({"command": command, "pid": os.getpid(), **_profiler.report()})
+    if destination == "-":
+        print(line, file=sys.stderr)
+    else:
+        with open(destination, "a") as f:
+            f.write(line + "\n")
+
+
+def _instrument_block_readers() -> None:
+    # fastavro looks up the reader of the codec in this registry and calls it once per block, with the
+    # decoder positioned at the block; for the null codec it only reads the block
+    from fastavro.read import BLOCK_READERS
+
+    for codec, read_block in list(BLOCK_READERS.items()):
+        if not getattr(read_block, "profiled", False):
+            BLOCK_READERS[codec] = _profiled_block_reader(read_block)
+
+
+def _profiled_block_reader(read_block: T.Callable) -> T.Callable:
+    def profiled(*args, **kwargs):
+        count("blocks_decoded")
+        with span("decompress"):
+            return read_block(*args, **kwargs)
+
+    profiled.profiled = True
+    return profiled
+
+
+def _peak_rss() -> T.Optional[int]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Kilobytes on Linux, bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+def _io_counters() -> T.Optional[T.Dict[str, int]]:
+    """
+    Bytes read by the process, from /proc/self/io on Linux: rchar counts read calls, including those served
+    from the page cache, read_bytes only what came from storage. Reads of memory-mapped files are in neither.
+    """
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(":") for line in f)
+    except OSError:
+        return None
+    return {key: int(counters[key]) for key in ("rchar", "read_bytes") if key in counters}
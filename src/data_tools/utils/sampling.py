@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import bisect
+import random
+import typing as T
+
+from data_tools.utils.lazy import LazyModule
+
+if T.TYPE_CHECKING:
+    import numpy as np
+    import pyarrow as pa
+else:
+    np = LazyModule("numpy")
+    pa = LazyModule("pyarrow")
+
+
+def sample_positions(num_rows: int, n: int, seed: T.Optional[int] = None) -> T.List[int]:
+    """
+    Pick min(N, num_rows) distinct row positions uniformly at random, in increasing order.
+    The same seed always picks the same positions.
+    """
+    # Sampling from a range draws N numbers, the population is never materialized
+    return sorted(random.Random(seed).sample(range(num_rows), min(n, num_rows)))
+
+
+def group_positions(positions: T.Sequence[int], sizes: T.Iterable[int]) -> T.Dict[int, T.List[int]]:
+    """
+    Map the index of every chunk of the given sizes holding some of the sorted positions to their offsets within it.
+    """
+    starts = [0]
+    for size in sizes:
+        starts.append(starts[-1] + size)
+    groups = {}
+    for position in positions:
+        i = bisect.bisect_right(starts, position) - 1
+        groups.setdefault(i, []).append(position - starts[i])
+    return groups
+
+
+def reservoir_sample(reader: T.Iterable[pa.RecordBatch], schema: pa.Schema, n: int,
+                     seed: T.Optional[int] = None) -> pa.Table:
+    """
+    Pick N rows uniformly at random in one pass over the batches, keeping them in their original order.
+
+    Every row gets a random key and the N rows with the smallest keys are kept, so memory is bounded by N rows.
+    Keys are drawn a batch at a time and only rows beating the largest kept key are copied.
+    """
+    rng = np.random.default_rng(seed)
+    sample = schema.empty_table()
+    keys = np.empty(0)
+    positions = np.empty(0, dtype=np.int64)
+    start = 0
+    for batch in reader:
+        batch_keys = rng.random(batch.num_rows)
+        candidates = np.arange(batch.num_rows)
+        if len(keys) >= n:
+            candidates = np.flatnonzero(batch_keys < keys.max()) if n else candidates[:0]
+        if len(candidates):
+            sample = pa.concat_tables([sample, pa.Table.from_batches([batch.take(candidates)], schema)])
+            keys = np.concatenate([keys, batch_keys[candidates]])
+            positions = np.concatenate([positions, candidates + start])
+            if len(keys) > n:
+                kept = np.argpartition(keys, n - 1)[:n] if n else np.empty(0, dtype=np.int64)
+                sample, keys, positions = sample.take(kept), keys[kept], positions[kept]
+        start += batch.num_rows
+    return sample.take(np.argsort(positions, kind="stable")).combine_chunks()
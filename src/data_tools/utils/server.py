@@ -0,0 +1,267 @@
+"""
+A long-lived query server on a Unix socket, keeping one DuckDB connection and the tables of the queried files.
+
+A request is a JSON line with the file path, query, output format and columns. The server answers with a JSON
+status line, then the query output in the requested format until it closes the connection. Requests are served
+one at a time, a DuckDB connection must not be shared across threads.
+"""
+from __future__ import annotations
+
+import collections
+import io
+import json
+import os
+import shutil
+import signal
+import socket
+import socketserver
+import sys
+import typing as T
+from pathlib import Path
+
+from data_tools.utils.cache import cache_dir
+from data_tools.utils.lazy import LazyModule
+
+if T.TYPE_CHECKING:
+    import duckdb
+    from typing_extensions import Buffer
+else:
+    duckdb = LazyModule("duckdb")
+
+# Set to use another socket than the one in the cache directory
+SOCKET_ENV = "DATA_TOOLS_SOCKET"
+RESULT_CACHE_SIZE = 32
+# Larger results are streamed to the client but not kept
+MAX_RESULT_SIZE = 16 * 1024 * 1024
+
+
+def socket_path() -> Path:
+    """
+    Return the server socket: $DATA_TOOLS_SOCKET, or server.sock in the cache directory.
+    """
+    if os.environ.get(SOCKET_ENV):
+        return Path(os.environ[SOCKET_ENV])
+    return cache_dir() / "server.sock"
+
+
+class TableState(T.NamedTuple):
+    path: str
+    columns: T.Optional[T.Tuple[str, ...]]
+    size: int
+    mtime_ns: int
+
+
+def _table_state(file_path: Path, columns: T.Optional[T.Sequence[str]]) -> TableState:
+    stat = os.stat(file_path)
+    return TableState(str(file_path), tuple(columns) if columns else None, stat.st_size, stat.st_mtime_ns)
+
+
+class _TeeStream(io.RawIOBase):
+    """
+    Write to the client, keeping a copy of the output as long as it stays under `max_size` bytes.
+    """
+
+    def __init__(self, stream: T.IO[bytes], max_size: int):
+        super().__init__()
+        self.stream = stream
+        self.max_size = max_size
+        self.copy = io.BytesIO()
+        self.truncated = False
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Buffer) -> int:
+        size = memoryview(data).nbytes
+        self.stream.write(data)
+        if not self.truncated:
+            if self.copy.tell() + size > self.max_size:
+                self.truncated = True
+                self.copy = io.BytesIO()
+            else:
+                self.copy.write(data)
+        return size
+
+    def flush(self) -> None:
+        self.stream.flush()
+
+
+class QueryServer:
+    """
+    Answer queries with a persistent DuckDB connection.
+
+    The first query of a file registers it as a table, later ones reuse it as long as the file keeps its size
+    and modification time. Outputs of recent queries are kept in an LRU cache, cleared whenever a registered
+    file changes: queries may join any registered table, so any change may affect any result.
+    """
+
+    def __init__(self, jobs: T.Optional[int] = None, result_cache_size: int = RESULT_CACHE_SIZE,
+                 max_result_size: int = MAX_RESULT_SIZE):
+        self.con = duckdb.connect()
+        self.jobs = jobs
+        self.result_cache_size = result_cache_size
+        self.max_result_size = max_result_size
+        self.tables: T.Dict[str, TableState] = {}
+        self.results: T.OrderedDict[T.Tuple, bytes] = collections.OrderedDict()
+
+    def _drop_stale_tables(self) -> None:
+        for table_name, state in list(self.tables.items()):
+            try:
+                stale = _table_state(Path(state.path), state.columns) != state
+            except OSError:
+                stale = True
+            if stale:
+                self._drop_table(table_name)
+
+    def _drop_table(self, table_name: str) -> None:
+        identifier = '"{}"'.format(table_name.replace('"', '""'))
+        # Files are registered either as views or as Arrow tables
+        self.con.execute(f"DROP VIEW IF EXISTS {identifier}")
+        self.con.unregister(table_name)
+        del self.tables[table_name]
+        self.results.clear()
+
+    def register(self, file_path: Path, columns: T.Optional[T.Sequence[str]] = None) -> None:
+        """
+        Make the file queryable under its file name, unless it already is with the same columns and content.
+        """
+        from data_tools.main import get_file_format, get_utils_class
+
+        self._drop_stale_tables()
+        state = _table_state(file_path, columns)
+        if self.tables.get(file_path.name) == state:
+            return
+        if file_path.name in self.tables:
+            # Another file of the same name, or other columns
+            self._drop_table(file_path.name)
+        utils_cls = get_utils_class(get_file_format(file_path))
+        utils_cls.register_persistent_table(self.con, file_path, self.jobs, columns)
+        self.tables[file_path.name] = state
+
+    def query(self, file_path: Path, query_expression: str, output_format: str, stream: T.IO[bytes],
+              columns: T.Optional[T.Sequence[str]] = None, on_start: T.Callable[[], None] = lambda: None) -> None:
+        """
+        Write the output of the query to the stream, from the result cache when possible.
+        `on_start` is called once the query succeeded, before any output is written.
+        """
+        from data_tools.utils.base import BaseUtils
+        from data_tools.utils.output import write_batches
+
+        self.register(file_path, columns)
+        key = (str(file_path), tuple(columns) if columns else None, query_expression, output_format)
+        if key in self.results:
+            self.results.move_to_end(key)
+            on_start()
+            stream.write(self.results[key])
+            return
+
+        record_batch_reader = BaseUtils.result_reader(self.con.execute(query_expression))
+        on_start()
+        tee = _TeeStream(stream, self.max_result_size)
+        write_batches(record_batch_reader.schema, record_batch_reader, output_format, io.BufferedWriter(tee))
+        if not tee.truncated and self.result_cache_size > 0:
+            self.results[key] = tee.copy.getvalue()
+            while len(self.results) > self.result_cache_size:
+                self.results.popitem(last=False)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    server: _UnixServer
+
+    def handle(self) -> None:
+        request = json.loads(self.rfile.readline())
+        started = False
+
+        def on_start():
+            nonlocal started
+            started = True
+            self.wfile.write(json.dumps({"ok": True}).encode() + b"\n")
+
+        # The socket writer is a binary file, typed as its BufferedIOBase base class
+        stream = T.cast(T.IO[bytes], self.wfile)
+        try:
+            self.server.query_server.query(Path(request["file_path"]), request["query_expression"],
+                                           request.get("output_format", "jsonl"), stream,
+                                           request.get("columns"), on_start)
+        except BrokenPipeError:
+            return
+        except Exception as e:
+            if started:
+                # The output is cut short, nothing else can be told to the client
+                return
+            self.wfile.write(json.dumps({"ok": False, "error": f"{type(e).__name__}: {e}"}).encode() + b"\n")
+
+
+class _UnixServer(socketserver.UnixStreamServer):
+    def __init__(self, path: Path, query_server: QueryServer):
+        self.query_server = query_server
+        super().__init__(str(path), _RequestHandler)
+
+
+def serve(socket_file: T.Optional[Path] = None, jobs: T.Optional[int] = None,
+          result_cache_size: int = RESULT_CACHE_SIZE) -> None:
+    """
+    Serve queries on the Unix socket until interrupted. The `query` command uses the server when it runs.
+    """
+    path = Path(socket_file) if socket_file is not None else socket_path()
+    if path.exists():
+        client = _connect(path)
+        if client is not None:
+            client.close()
+            raise ValueError(f"A server is already listening on {path}.")
+        # Left behind by a server that did not exit cleanly
+        path.unlink()
+    path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+
+    # Stop like on Ctrl-C, so that the socket is removed
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    with _UnixServer(path, QueryServer(jobs, result_cache_size)) as server:
+        print(f"Serving queries on {path}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            path.unlink(missing_ok=True)
+
+
+def _connect(path: Path) -> T.Optional[socket.socket]:
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(str(path))
+    except OSError:
+        client.close()
+        return None
+    return client
+
+
+def query_server(file_path: Path, query_expression: str, output_format: str = "jsonl",
+                 columns: T.Optional[T.Sequence[str]] = None, socket_file: T.Optional[Path] = None) -> bool:
+    """
+    Run a query on the server and copy its output to stdout.
+    Returns False, having done nothing, when no server is listening on the socket.
+    """
+    path = Path(socket_file) if socket_file is not None else socket_path()
+    if not path.exists():
+        return False
+    client = _connect(path)
+    if client is None:
+        return False
+
+    with client, client.makefile("rwb") as f:
+        request = {
+            # The server runs in another working directory
+            "file_path": str(Path(file_path).resolve()),
+            "query_expression": query_expression,
+            "output_format": output_format,
+            "columns": columns,
+        }
+        f.write(json.dumps(request).encode() + b"\n")
+        f.flush()
+        status = json.loads(f.readline() or b'{"ok": false, "error": "The server closed the connection."}')
+        if not status["ok"]:
+            raise ValueError(status["error"])
+        sys.stdout.flush()
+        shutil.copyfileobj(f, sys.stdout.buffer)
+        sys.stdout.buffer.flush()
+    return True
@@ -0,0 +1,242 @@
+import typing as T
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+def _splitmix64(values: np.ndarray) -> np.ndarray:
+    """
+    Scramble 64-bit integers so that their bits are uniformly distributed.
+    """
+    with np.errstate(over="ignore"):
+        z = values.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+
+def hash_array(array: pa.Array) -> np.ndarray:
+    """
+    Hash the non-null values of an Arrow array to uint64.
+
+    Hashes are stable across processes, so sketches built in different workers can be merged.
+    """
+    array = array.drop_null()
+    if not len(array):
+        return np.zeros(0, dtype=np.uint64)
+    array_type = array.type
+    if pa.types.is_dictionary(array_type):
+        array = array.dictionary_decode()
+        array_type = array.type
+    if pa.types.is_boolean(array_type):
+        return _splitmix64(np.asarray(array.cast(pa.int64())))
+    if pa.types.is_integer(array_type):
+        # uint64 values of 2^63 or more wrap around, keeping their bits
+        return _splitmix64(np.asarray(array.cast(pa.int64(), safe=False)).view(np.uint64))
+    if pa.types.is_floating(array_type):
+        return _splitmix64(np.asarray(array.cast(pa.float64())).view(np.uint64))
+    if pa.types.is_temporal(array_type):
+        # Dates and times only cast to the integer type of their storage (int32 for date32 and time32)
+        storage_type = pa.int32() if array_type.bit_width == 32 else pa.int64()
+        return _splitmix64(np.asarray(array.cast(storage_type).cast(pa.int64())).view(np.uint64))
+    if pa.types.is_fixed_size_binary(array_type):
+        array = array.cast(pa.binary())
+    elif not (pa.types.is_string(array_type) or pa.types.is_large_string(array_type)
+              or pa.types.is_binary(array_type) or pa.types.is_large_binary(array_type)):
+        array = array.cast(pa.string())
+    return _hash_binary(array)
+
+
+_POWERS = np.ones(1, dtype=np.uint64)
+
+
+def _hash_binary(array: pa.Array) -> np.ndarray:
+    """
+    Vectorized polynomial hash of variable-length string or binary values.
+    """
+    global _POWERS
+    offset_type = np.int64 if pa.types.is_large_string(array.type) or pa.types.is_large_binary(array.type) \
+        else np.int32
+    _, offsets_buffer, data_buffer = array.buffers()
+    offsets = np.frombuffer(offsets_buffer, dtype=offset_type)[array.offset:array.offset + len(array) + 1]
+    offsets = offsets.astype(np.int64)
+    if data_buffer is None or offsets[-1] == offsets[0]:
+        data = np.zeros(0, dtype=np.uint64)
+    else:
+        data = np.frombuffer(data_buffer, dtype=np.uint8)[offsets[0]:offsets[-1]].astype(np.uint64)
+    offsets = offsets - offsets[0]
+    lengths = np.diff(offsets)
+
+    max_length = int(lengths.max()) if len(lengths) else 0
+    if len(_POWERS) <= max_length:
+        factors = np.full(max_length + 1, 0x100000001B3, dtype=np.uint64)
+        factors[0] = 1
+        with np.errstate(over="ignore"):
+            _POWERS = np.cumprod(factors, dtype=np.uint64)
+
+    positions = np.arange(len(data)) - np.repeat(offsets[:-1], lengths)
+    with np.errstate(over="ignore"):
+        sums = np.concatenate([np.zeros(1, dtype=np.uint64), np.cumsum(data * _POWERS[positions], dtype=np.uint64)])
+        hashes = sums[offsets[1:]] - sums[offsets[:-1]]
+        return _splitmix64(hashes ^ lengths.astype(np.uint64))
+
+
+class HyperLogLog:
+    """
+    Mergeable distinct count estimate with a fixed memory footprint of 2 ** precision bytes.
+    """
+
+    def __init__(self, precision: int = 14):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def update(self, array: pa.Array) -> None:
+        # Hashing only the distinct values of the batch gives the same registers at a lower cost
+        try:
+            array = pc.unique(array)
+        except pa.ArrowNotImplementedError:
+            pass
+        self.update_hashes(hash_array(array))
+
+    def update_hashes(self, hashes: np.ndarray) -> None:
+        if not len(hashes):
+            return
+        value_bits = 64 - self.precision
+        indices = (hashes >> np.uint64(value_bits)).astype(np.intp)
+        # The remaining bits fit in a float64 mantissa, so log2 gives their exact bit length
+        remainders = (hashes & np.uint64((1 << value_bits) - 1)).astype(np.float64)
+        with np.errstate(divide="ignore"):
+            ranks = np.where(remainders > 0, value_bits - np.floor(np.log2(remainders)), value_bits + 1)
+        np.maximum.at(self.registers, indices, ranks.astype(np.uint8))
+
+    def merge(self, other: "HyperLogLog") -> None:
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        num_zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and num_zeros:
+            # Small range correction: linear counting
+            estimate = m * np.log(m / num_zeros)
+        return int(round(estimate))
+
+    def __getstate__(self) -> T.Dict:
+        return {"precision": self.precision, "registers": self.registers.tobytes()}
+
+    def __setstate__(self, state: T.Dict) -> None:
+        self.precision = state["precision"]
+        self.registers = np.frombuffer(state["registers"], dtype=np.uint8).copy()
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile estimate (a KLL sketch) of numeric values.
+
+    Values are kept in levels of sorted compactors, an item of level h standing for 2 ** h values. A full
+    level keeps every other item, at a random offset, and promotes them to the next level; capacities
+    shrink geometrically from the top level down, so about 3 * k items are kept whatever the number of
+    values. The rank error is about 1.7 / k with high probability.
+    """
+
+    def __init__(self, k: int = 256, seed: T.Optional[int] = None):
+        self.k = k
+        self.count = 0
+        self.levels = [np.zeros(0)]
+        self.rng = np.random.default_rng(seed)
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.levels) - level - 1
+        return max(int(np.ceil(self.k * (2 / 3) ** depth)), 2)
+
+    def update(self, values: np.ndarray) -> None:
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        self.count += len(values)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def _compress(self) -> None:
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) <= self._capacity(level):
+                level += 1
+                continue
+            if level + 1 == len(self.levels):
+                self.levels.append(np.zeros(0))
+            items = np.sort(items)
+            # With an odd number of items, the largest one stays behind
+            leftover = items[len(items) - len(items) % 2:]
+            promoted = items[int(self.rng.integers(2)):len(items) - len(items) % 2:2]
+            self.levels[level] = leftover
+            self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def merge(self, other: "QuantileSketch") -> None:
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.zeros(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.count += other.count
+        self._compress()
+
+    def quantiles(self, qs: T.Sequence[float]) -> T.List[T.Optional[float]]:
+        if not self.count:
+            return [None for _ in qs]
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2 ** i, dtype=np.float64) for i, level in enumerate(self.levels)])
+        order = np.argsort(items, kind="stable")
+        items, ranks = items[order], np.cumsum(weights[order])
+        indices = np.searchsorted(ranks, np.asarray(qs) * ranks[-1], side="left")
+        return [float(items[min(index, len(items) - 1)]) for index in indices]
+
+
+class HeavyHitters:
+    """
+    Mergeable frequent values (Misra-Gries summary) with at most `capacity` counters.
+
+    Counts are underestimated by at most N / (capacity + 1) for N values, and every value occurring more
+    often than that is kept. Each batch is summarized exactly and reduced to `capacity` counters before
+    being merged, so per-value Python work is bounded by the capacity, not by the batch size.
+    """
+
+    def __init__(self, capacity: int = 64):
+        self.capacity = capacity
+        self.count = 0
+        self.counters: T.Dict[T.Any, int] = {}
+
+    def update(self, array: pa.Array) -> None:
+        array = array.drop_null()
+        if not len(array):
+            return
+        value_counts = pc.value_counts(array)
+        counts = np.asarray(value_counts.field("counts"))
+        if len(counts) > self.capacity:
+            top = np.argpartition(counts, -(self.capacity + 1))[-(self.capacity + 1):]
+            threshold = counts[top].min()
+            top = top[counts[top] > threshold]
+            values = value_counts.field("values").take(pa.array(top)).to_pylist()
+            batch_counters = dict(zip(values, (counts[top] - threshold).tolist()))
+        else:
+            batch_counters = dict(zip(value_counts.field("values").to_pylist(), counts.tolist()))
+        self._merge_counters(batch_counters, len(array))
+
+    def _merge_counters(self, counters: T.Dict[T.Any, int], count: int) -> None:
+        self.count += count
+        for value, value_count in counters.items():
+            self.counters[value] = self.counters.get(value, 0) + value_count
+        if len(self.counters) > self.capacity:
+            threshold = sorted(self.counters.values(), reverse=True)[self.capacity]
+            self.counters = {value: value_count - threshold for value, value_count in self.counters.items()
+                             if value_count > threshold}
+
+    def merge(self, other: "HeavyHitters") -> None:
+        self._merge_counters(other.counters, other.count)
+
+    def top(self, n: int = 10) -> T.List[T.Tuple[T.Any, int]]:
+        return sorted(self.counters.items(), key=lambda item: item[1], reverse=True)[:n]
@@ -0,0 +1,158 @@
+import itertools
+import typing as T
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from data_tools.utils import profile
+from data_tools.utils.sketches import HeavyHitters, HyperLogLog, QuantileSketch
+
+# Quantiles and number of most frequent values reported in approximate mode
+QUANTILES = {"p50": 0.5, "p95": 0.95, "p99": 0.99}
+TOP_K = 10
+
+
+class ColumnStats:
+    """
+    Mergeable statistics of a single column, updated one Arrow array at a time.
+
+    In approximate mode, quantiles of numeric columns and the most frequent values are tracked too,
+    with sketches of a fixed size whatever the number of values.
+    """
+
+    def __init__(self, approx: bool = False):
+        self.approx = approx
+        self.count = 0
+        self.null_count = 0
+        # Python values of the column's type
+        self.min: T.Any = None
+        self.max: T.Any = None
+        self.sum = 0.0
+        self.num_summed = 0
+        self.distinct: T.Optional[HyperLogLog] = None
+        self.quantiles: T.Optional[QuantileSketch] = None
+        self.heavy_hitters: T.Optional[HeavyHitters] = None
+        self.integer = False
+
+    def update(self, array: pa.Array) -> None:
+        self.count += len(array)
+        self.null_count += array.null_count
+        if array.null_count == len(array):
+            return
+        array_type = array.type
+        if pa.types.is_dictionary(array_type):
+            array = array.dictionary_decode()
+            array_type = array.type
+
+        try:
+            min_max = pc.min_max(array)
+        except pa.ArrowNotImplementedError:
+            pass
+        else:
+            self._merge_min_max(min_max["min"].as_py(), min_max["max"].as_py())
+
+        if pa.types.is_integer(array_type) or pa.types.is_floating(array_type) or pa.types.is_decimal(array_type):
+            # Summing in float64 avoids integer overflow on wide random values
+            float_array = array.cast(pa.float64(), safe=False)
+            self.sum += pc.sum(float_array).as_py()
+            self.num_summed += len(array) - array.null_count
+            if self.approx:
+                if self.quantiles is None:
+                    self.quantiles = QuantileSketch()
+                    self.integer = pa.types.is_integer(array_type)
+                self.quantiles.update(np.asarray(float_array.drop_null()))
+
+        if not (pa.types.is_nested(array_type) or pa.types.is_null(array_type)):
+            if self.distinct is None:
+                self.distinct = HyperLogLog()
+            self.distinct.update(array)
+            if self.approx:
+                if self.heavy_hitters is None:
+                    self.heavy_hitters = HeavyHitters()
+                self.heavy_hitters.update(array)
+
+    def merge(self, other: "ColumnStats") -> None:
+        self.count += other.count
+        self.null_count += other.null_count
+        self._merge_min_max(other.min, other.max)
+        self.sum += other.sum
+        self.num_summed += other.num_summed
+        if other.distinct is not None:
+            if self.distinct is None:
+                self.distinct = HyperLogLog(other.distinct.precision)
+            self.distinct.merge(other.distinct)
+        if other.quantiles is not None:
+            if self.quantiles is None:
+                self.quantiles = QuantileSketch(other.quantiles.k)
+                self.integer = other.integer
+            self.quantiles.merge(other.quantiles)
+        if other.heavy_hitters is not None:
+            if self.heavy_hitters is None:
+                self.heavy_hitters = HeavyHitters(other.heavy_hitters.capacity)
+            self.heavy_hitters.merge(other.heavy_hitters)
+
+    def _merge_min_max(self, min_value, max_value) -> None:
+        if min_value is not None and (self.min is None or min_value < self.min):
+            self.min = min_value
+        if max_value is not None and (self.max is None or max_value > self.max):
+            self.max = max_value
+
+    def to_dict(self) -> T.Dict:
+        column_stats: T.Dict[str, T.Any] = {
+            "count": self.count,
+            "null_count": self.null_count,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.sum / self.num_summed if self.num_summed else None,
+            "distinct": self.distinct.estimate() if self.distinct is not None else None,
+        }
+        if self.approx:
+            values: T.List[T.Optional[float]] = []
+            if self.quantiles is not None:
+                values = self.quantiles.quantiles(list(QUANTILES.values()))
+            for name, value in itertools.zip_longest(QUANTILES, values):
+                # Sketch items are values of the column, integers are exact in float64 up to 2 ** 53; beyond,
+                # rounding may step past the extremes (2 ** 64 for the largest uint64)
+                if self.integer and value is not None:
+                    value = min(max(int(value), self.min), self.max)
+                column_stats[name] = value
+            column_stats["top_k"] = self.heavy_hitters.top(TOP_K) if self.heavy_hitters is not None else []
+        return column_stats
+
+
+class TableStats:
+    """
+    Mergeable per-column statistics of a stream of record batches.
+
+    Struct columns are flattened into one entry per field, named by their dotted path.
+    """
+
+    def __init__(self, approx: bool = False):
+        self.approx = approx
+        self.num_rows = 0
+        self.columns: T.Dict[str, ColumnStats] = {}
+
+    def update(self, batch: T.Union[pa.RecordBatch, pa.Table]) -> None:
+        self.num_rows += batch.num_rows
+        with profile.span("aggregate"):
+            for name, array in zip(batch.schema.names, batch.columns):
+                self._update_column(name, array)
+
+    def _update_column(self, name: str, array: T.Union[pa.Array, pa.ChunkedArray]) -> None:
+        if isinstance(array, pa.ChunkedArray):
+            array = array.combine_chunks()
+        if pa.types.is_struct(array.type):
+            for field, child in zip(array.type, array.flatten()):
+                self._update_column(f"{name}.{field.name}", child)
+            return
+        self.columns.setdefault(name, ColumnStats(self.approx)).update(array)
+
+    def merge(self, other: "TableStats") -> "TableStats":
+        self.num_rows += other.num_rows
+        for name, column_stats in other.columns.items():
+            self.columns.setdefault(name, ColumnStats(column_stats.approx)).merge(column_stats)
+        return self
+
+    def to_dict(self) -> T.Dict[str, T.Dict]:
+        return {name: column_stats.to_dict() for name, column_stats in self.columns.items()}
@@ -0,0 +1,283 @@
+from __future__ import annotations
+
+import concurrent.futures
+import functools
+import itertools
+import os
+import typing as T
+from pathlib import Path
+
+import pyarrow as pa
+
+from data_tools.utils.base import RANGES_PER_JOB, BaseUtils
+from data_tools.utils.cache import cached, entry_name
+from data_tools.utils.fileio import open_arrow_input, open_input
+from data_tools.utils.output import write_batches
+from data_tools.utils.parallel import ordered_map
+
+if T.TYPE_CHECKING:
+    from data_tools.utils.stats import TableStats
+
+BLOCK_SIZE = 1024 * 1024
+# Byte ranges parsed in parallel are kept between these sizes, so that a few of them in flight
+# keep every worker busy without holding a large part of the file in memory
+MIN_RANGE_SIZE = 1024 * 1024
+MAX_RANGE_SIZE = 16 * 1024 * 1024
+TAIL_CHUNK_SIZE = 64 * 1024
+
+
+def line_boundary(f: T.BinaryIO, position: int) -> int:
+    """
+    Return the offset of the first line starting at or after the given position.
+    """
+    if position == 0:
+        return 0
+    # Reading from the previous byte, a position right after a newline is already a boundary
+    f.seek(position - 1)
+    f.readline()
+    return f.tell()
+
+
+def split_line_ranges(f: T.BinaryIO, start: int, end: int, range_size: int) -> T.List[T.Tuple[int, int]]:
+    """
+    Split [start, end) into consecutive byte ranges of about `range_size` bytes, each holding whole lines.
+    """
+    boundaries = [start]
+    for position in range(start + range_size, end, range_size):
+        boundary = line_boundary(f, position)
+        if boundary > boundaries[-1]:
+            boundaries.append(min(boundary, end))
+    if boundaries[-1] < end:
+        boundaries.append(end)
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def tail_start(f: T.BinaryIO, start: int, end: int, n: int) -> int:
+    """
+    Return the offset of the last N lines in [start, end), scanning the file backwards.
+    """
+    f.seek(max(end - 1, start))
+    # A newline ending the last line does not start another one
+    position = end - 1 if end > start and f.read(1) == b"\n" else end
+    num_newlines = 0
+    while position > start:
+        chunk_start = max(position - TAIL_CHUNK_SIZE, start)
+        f.seek(chunk_start)
+        chunk = f.read(position - chunk_start)
+        index = len(chunk)
+        while True:
+            index = chunk.rfind(b"\n", 0, index)
+            if index < 0:
+                break
+            num_newlines += 1
+            if num_newlines == n:
+                return chunk_start + index + 1
+        position = chunk_start
+    return start
+
+
+class TextUtils(BaseUtils):
+    """
+    Line-delimited text formats (CSV, JSON Lines) read with pyarrow's streaming block readers.
+
+    The schema is inferred from the first block. Parallel reads split the file into byte ranges of whole
+    lines, parsed with that schema by pyarrow, which releases the GIL, in a pool of threads.
+    Every line is parsed whole, column projections are applied to the parsed batches.
+    """
+
+    # Output format of data_tools.utils.output the files are written in, set by every format
+    output_format: str
+
+    @classmethod
+    def open_reader(cls, source: T.Union[Path, T.BinaryIO], block_size: int = BLOCK_SIZE) -> pa.RecordBatchReader:
+        """
+        Open a streaming reader, returning record batches of one block each.
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def read_lines(cls, data: pa.Buffer, schema: pa.Schema) -> pa.Table:
+        """
+        Parse whole lines of data, without a header, with the given schema.
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def data_start(cls, f: T.BinaryIO) -> int:
+        """
+        Return the offset of the first data line, past any header.
+        """
+        return 0
+
+    @classmethod
+    def read_schema(cls, file_path: Path) -> pa.Schema:
+        # Opening the streaming reader only parses the first block
+        with cls.open_reader(open_arrow_input(file_path)) as reader:
+            return reader.schema
+
+    @classmethod
+    def arrow_schema(cls, file_path: Path, cache: bool = True) -> pa.Schema:
+        return cached(file_path, "schema", functools.partial(cls.read_schema, file_path), cache)
+
+    @classmethod
+    def schema(cls, file_path: Path, cache: bool = True) -> pa.Schema:
+        """
+        Print the schema inferred from the first block of the file.
+        """
+        schema = cls.arrow_schema(file_path, cache)
+        print(f"Inferred schema:\n{schema}")
+        return schema
+
+    @classmethod
+    def meta(cls, file_path: Path, cache: bool = True) -> T.Tuple:
+        """
+        Inspect a text file: the schema inferred from its first block and its size. Text files carry
+        no metadata and are not compressed.
+        """
+        schema = cls.arrow_schema(file_path, cache)
+        serialized_size = os.path.getsize(file_path)
+
+        cls.print_metadata(schema, None, None, serialized_size)
+        return schema, None, None, serialized_size
+
+    @classmethod
+    def num_rows(cls, file_path: Path, cache: bool = True) -> int:
+        """
+        Count the data lines of the file without parsing them.
+        """
+        return cached(file_path, "num_rows", functools.partial(cls._count_lines, file_path), cache)
+
+    @classmethod
+    def _count_lines(cls, file_path: Path) -> int:
+        with open_input(file_path) as f:
+            f.seek(cls.data_start(f))
+            num_lines = 0
+            last_byte = b"\n"
+            while True:
+                chunk = f.read(BLOCK_SIZE)
+                if not chunk:
+                    break
+                num_lines += chunk.count(b"\n")
+                last_byte = chunk[-1:]
+        # The last line may not end with a newline
+        return num_lines + (last_byte != b"\n")
+
+    @classmethod
+    def to_record_batch_reader(cls, file_path: Path, block_size: int = BLOCK_SIZE, jobs: T.Optional[int] = None,
+                               columns: T.Optional[T.Sequence[str]] = None) -> pa.RecordBatchReader:
+        """
+        Stream the file as Arrow record batches of one block each, with the given columns only.
+
+        With several jobs, byte ranges of the file are parsed in a thread pool and the batches are
+        yielded in file order.
+        """
+        reader = cls._open_batches(file_path, block_size, jobs)
+        if not columns:
+            return reader
+        schema = cls.project_schema(reader.schema, columns)
+        return pa.RecordBatchReader.from_batches(schema, (batch.select(columns) for batch in reader))
+
+    @classmethod
+    def _open_batches(cls, file_path: Path, block_size: int, jobs: T.Optional[int]) -> pa.RecordBatchReader:
+        if not jobs or jobs == 1:
+            return cls.open_reader(open_arrow_input(file_path), block_size)
+
+        schema = cls.read_schema(file_path)
+        file_size = os.path.getsize(file_path)
+        with open_input(file_path) as f:
+            start = cls.data_start(f)
+            range_size = (file_size - start) // (RANGES_PER_JOB * jobs)
+            range_size = min(max(range_size, MIN_RANGE_SIZE), MAX_RANGE_SIZE)
+            ranges = split_line_ranges(f, start, file_size, range_size)
+        decode = functools.partial(cls._decode_line_range, file_path, schema)
+        decoded = ordered_map(decode, ranges, jobs, concurrent.futures.ThreadPoolExecutor)
+        batches = itertools.chain.from_iterable(decoded)
+        return pa.RecordBatchReader.from_batches(schema, batches)
+
+    @classmethod
+    def _decode_line_range(cls, file_path: Path, schema: pa.Schema,
+                           byte_range: T.Tuple[int, int]) -> T.List[pa.RecordBatch]:
+        start, end = byte_range
+        with open_arrow_input(file_path) as f:
+            f.seek(start)
+            data = f.read_buffer(end - start)
+        return cls.read_lines(data, schema).to_batches()
+
+    @classmethod
+    def head(cls, file_path: Path, n: int = 20, output_format: str = "jsonl",
+             columns: T.Optional[T.Sequence[str]] = None) -> pa.Table:
+        """
+        Prints the first N records of the file.
+
+        Blocks are parsed one at a time and reading stops as soon as N records are available,
+        which for small N means only the first block.
+        """
+        with cls.to_record_batch_reader(file_path, columns=columns) as reader:
+            batches = []
+            num_rows = 0
+            for batch in reader:
+                if num_rows >= n:
+                    break
+                batches.append(batch)
+                num_rows += batch.num_rows
+            table = pa.Table.from_batches(batches, reader.schema).slice(0, n)
+        cls.print_batches(table.schema, table.to_batches(), output_format)
+        return table
+
+    @classmethod
+    def tail(cls, file_path: Path, n: int = 20, output_format: str = "jsonl",
+             columns: T.Optional[T.Sequence[str]] = None) -> pa.Table:
+        """
+        Prints the last N records of the file.
+
+        The file is scanned backwards for the start of the last N lines and only those lines are parsed,
+        with the schema inferred from the first block.
+        """
+        schema = cls.read_schema(file_path)
+        projected_schema = cls.project_schema(schema, columns)
+        file_size = os.path.getsize(file_path)
+        with open_input(file_path) as f:
+            start = cls.data_start(f)
+            start = tail_start(f, start, file_size, n) if n > 0 else file_size
+        batches = cls._decode_line_range(file_path, schema, (start, file_size)) if start < file_size else []
+        table = pa.Table.from_batches(batches, schema).select(projected_schema.names)
+        table = table.slice(max(table.num_rows - n, 0))
+        cls.print_batches(table.schema, table.to_batches(), output_format)
+        return table
+
+    @classmethod
+    def write_record_batches(cls, file_path: Path, schema: pa.Schema, batches: T.Iterable[pa.RecordBatch],
+                             codec: T.Optional[str] = None, *, jobs: T.Optional[int] = None, **options) -> int:
+        """
+        Write record batches to the file one batch at a time, uncompressed. Returns the number of rows written.
+        """
+        with open(file_path, "wb") as f:
+            return write_batches(schema, batches, cls.output_format, f)
+
+    @classmethod
+    def stats(cls, file_path: Path, jobs: T.Optional[int] = None, cache: bool = True,
+              columns: T.Optional[T.Sequence[str]] = None, approx: bool = False) -> T.Tuple[int, T.Dict]:
+        """
+        Compute per-column statistics of the file, aggregating one block at a time.
+        In approximate mode, quantiles and most frequent values are estimated with mergeable sketches.
+        Results are cached until the file changes.
+        """
+        num_rows, column_stats = cls.summarize_stats(cls.file_stats(file_path, jobs, cache, columns, approx))
+        cls.print_stats(num_rows, column_stats)
+        return num_rows, column_stats
+
+    @classmethod
+    def file_stats(cls, file_path: Path, jobs: T.Optional[int] = None, cache: bool = True,
+                   columns: T.Optional[T.Sequence[str]] = None, approx: bool = False) -> TableStats:
+        compute = functools.partial(cls._compute_stats, file_path, jobs, columns, approx)
+        return cached(file_path, entry_name("approx_stats" if approx else "stats", columns), compute, cache)
+
+    @classmethod
+    def _compute_stats(cls, file_path: Path, jobs: T.Optional[int], columns: T.Optional[T.Sequence[str]] = None,
+                       approx: bool = False) -> TableStats:
+        from data_tools.utils.stats import TableStats
+
+        table_stats = TableStats(approx)
+        for batch in cls.to_record_batch_reader(file_path, jobs=jobs, columns=columns):
+            table_stats.update(batch)
+        return table_stats
@@ -0,0 +1,8 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    # Keep the metadata cache of every test to itself, out of the user's cache directory
+    monkeypatch.setenv("DATA_TOOLS_CACHE_DIR", str(tmp_path / "cache"))
+    return tmp_path / "cache"
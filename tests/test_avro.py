@@ -1,7 +1,24 @@
+import datetime
+import decimal
+import io
 import os
 import tempfile
+import tracemalloc
 from pathlib import Path
+
+import fastavro
+import pyarrow as pa
+import pytest
+
 from data_tools.utils.avro import AvroUtils
+from data_tools.utils import avro_blocks, decoded_files
+from data_tools.utils.avro_arrow import avro_to_arrow_schema
+from data_tools.utils.avro_blocks import (encode_long, iter_blocks, iter_range_blocks, prefetch_records, read_header,
+                                          split_ranges)
+from data_tools.utils.avro_columnar import ENGINE_ENV
+from data_tools.utils.avro_schema import project_schema
+from data_tools.utils.fileio import PREFETCH_ENV
+from data_tools.utils.sampling import sample_positions
 
 TEST_DATA_DIR = Path(__file__).resolve().parent
 
@@ -39,6 +56,28 @@ def test_create_sample():
         assert os.path.getsize(file_path) > 0
 
 
+def test_create_sample_seed():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        schema_path = TEST_DATA_DIR / "sample_schema.avsc"
+        first = AvroUtils.create_sample(Path(tmpdir) / "first.avro", schema_path, 100, seed=7)
+        second = AvroUtils.create_sample(Path(tmpdir) / "second.avro", schema_path, 100, seed=7)
+
+        with open(first, "rb") as f, open(second, "rb") as g:
+            assert list(fastavro.reader(f)) == list(fastavro.reader(g))
+
+
+def test_create_columnar_sample():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.avro"
+        schema_path = TEST_DATA_DIR / "sample_schema.avsc"
+        AvroUtils.create_sample(file_path, schema_path, 2500, "deflate", seed=1, columnar=True, chunk_size=1000)
+
+        with open(file_path, "rb") as f:
+            records = list(fastavro.reader(f))
+        assert len(records) == 2500
+        assert set(records[0]["address"]) == {"street", "city", "zip"}
+
+
 def test_snappy_meta():
     file_path = TEST_DATA_DIR / "data" / "avro" / "test-snappy.avro"
     result = AvroUtils.meta(file_path)
@@ -98,18 +137,456 @@ def test_stats():
         assert "max" in stats
 
 
+def test_stats_dates_and_times():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "events.avro"
+        schema = {
+            "type": "record",
+            "name": "Event",
+            "fields": [
+                {"name": "day", "type": {"type": "int", "logicalType": "date"}},
+                {"name": "time", "type": {"type": "int", "logicalType": "time-millis"}},
+            ],
+        }
+        records = [
+            {"day": datetime.date(2020, 1, day % 3 + 1), "time": datetime.time(12, day % 4)} for day in range(10)
+        ]
+        with open(file_path, "wb") as f:
+            fastavro.writer(f, fastavro.parse_schema(schema), records)
+
+        num_rows, column_stats = AvroUtils.stats(file_path, cache=False, approx=True)
+
+    assert num_rows == 10
+    assert column_stats["day"]["distinct"] == 3
+    assert column_stats["day"]["max"] == datetime.date(2020, 1, 3)
+    assert column_stats["time"]["distinct"] == 4
+    assert column_stats["time"]["top_k"][0] == (datetime.time(12, 0), 3)
+
+
+def _reference_stats(records):
+    """
+    Per-row reference implementation of the flat column statistics.
+    """
+    column_stats = {}
+    for record in records:
+        for k, v in record.items():
+            column_stat = column_stats.setdefault(k, {"count": 0, "null_count": 0, "values": []})
+            column_stat["count"] += 1
+            if v is None:
+                column_stat["null_count"] += 1
+            else:
+                column_stat["values"].append(v)
+    return column_stats
+
+
+def test_stats_matches_reference():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.avro"
+        schema_path = TEST_DATA_DIR / "sample_schema.avsc"
+        AvroUtils.create_sample(file_path, schema_path, 5000, "deflate", sync_interval=4096)
+        with open(file_path, "rb") as f:
+            records = list(fastavro.reader(f))
+
+        num_rows, column_stats = AvroUtils.stats(file_path, batch_size=700)
+
+        assert num_rows == 5000
+        for name, expected in _reference_stats(records).items():
+            if name in ("address", "phone_numbers"):
+                continue
+            values = expected["values"]
+            actual = column_stats[name]
+            assert actual["count"] == expected["count"]
+            assert actual["null_count"] == expected["null_count"]
+            assert actual["min"] == min(values)
+            assert actual["max"] == max(values)
+            if name not in ("name", "is_student"):
+                assert actual["mean"] == pytest.approx(sum(values) / len(values))
+            exact_distinct = len(set(values))
+            assert abs(actual["distinct"] - exact_distinct) <= 0.02 * exact_distinct + 1
+
+        # Nested records are flattened into dotted columns
+        cities = [record["address"]["city"] for record in records]
+        assert column_stats["address.city"]["min"] == min(cities)
+        assert column_stats["address.city"]["max"] == max(cities)
+        assert column_stats["phone_numbers"]["count"] == 5000
+
+
+def test_iter_range_blocks():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.avro"
+        schema_path = TEST_DATA_DIR / "sample_schema.avsc"
+        AvroUtils.create_sample(file_path, schema_path, 3000, "deflate", sync_interval=2048)
+
+        with open(file_path, "rb") as f:
+            header = read_header(f)
+            blocks = list(iter_blocks(f, header))
+            ranges = split_ranges(header, os.path.getsize(file_path), 7, min_split_size=1)
+            range_blocks = [block for byte_range in ranges for block in iter_range_blocks(f, header, *byte_range)]
+
+        assert len(ranges) == 7
+        assert range_blocks == blocks
+
+
+def test_split_ranges():
+    with open(TEST_DATA_DIR / "data" / "avro" / "weather.avro", "rb") as f:
+        header = read_header(f)
+    data_start = len(header.raw)
+
+    # A large file is split into ranges of at most MAX_SPLIT_SIZE, more than the requested number of splits
+    ranges = split_ranges(header, data_start + 100 * avro_blocks.MAX_SPLIT_SIZE, 4)
+    assert len(ranges) == 100
+    assert max(end - start for start, end in ranges) == avro_blocks.MAX_SPLIT_SIZE
+    assert ranges[0][0] == data_start and ranges[-1][1] == data_start + 100 * avro_blocks.MAX_SPLIT_SIZE
+
+    assert split_ranges(header, data_start + 10, 4) == [(data_start, data_start + 10)]
+
+
+def test_parallel_decode(monkeypatch):
+    monkeypatch.setattr(avro_blocks, "MIN_SPLIT_SIZE", 1)
+    file_paths = [
+        TEST_DATA_DIR / "data" / "avro" / "test-deflate.avro",
+        TEST_DATA_DIR / "data" / "avro" / "test-snappy.avro",
+        TEST_DATA_DIR / "data" / "avro" / "weather.avro",
+    ]
+    for file_path in file_paths:
+        sequential = AvroUtils.to_record_batch_reader(file_path, batch_size=100).read_all()
+        parallel = AvroUtils.to_record_batch_reader(file_path, batch_size=100, jobs=3).read_all()
+        assert parallel.equals(sequential)
+
+        parallel_rows, parallel_stats = AvroUtils.stats(file_path, jobs=3)
+        sequential_rows, sequential_stats = AvroUtils.stats(file_path)
+        assert parallel_rows == sequential_rows
+        for name, expected in sequential_stats.items():
+            # Partial sums are added in a different order
+            assert parallel_stats[name].pop("mean") == pytest.approx(expected.pop("mean"))
+            assert parallel_stats[name] == expected
+
+
+def test_prefetch_records(monkeypatch):
+    file_paths = [
+        TEST_DATA_DIR / "data" / "avro" / "test-deflate.avro",
+        TEST_DATA_DIR / "data" / "avro" / "test-snappy.avro",
+        TEST_DATA_DIR / "data" / "avro" / "weather.avro",
+    ]
+    for file_path in file_paths:
+        with open(file_path, "rb") as f:
+            expected = list(fastavro.reader(f))
+            f.seek(0)
+            header = read_header(f)
+            blocks = list(iter_blocks(f, header))
+            for depth in (0, 1, 4):
+                assert list(prefetch_records(f, header, blocks, depth=depth)) == expected
+
+        prefetched = AvroUtils.to_record_batch_reader(file_path, batch_size=100).read_all()
+        monkeypatch.setenv(PREFETCH_ENV, "0")
+        assert AvroUtils.to_record_batch_reader(file_path, batch_size=100).read_all().equals(prefetched)
+        monkeypatch.delenv(PREFETCH_ENV)
+
+
+def test_encode_long():
+    for value in (0, 1, -1, 63, -64, 64, 2 ** 31, -(2 ** 63)):
+        assert fastavro.schemaless_reader(io.BytesIO(encode_long(value)), "long") == value
+
+
+def test_columnar_engine(monkeypatch):
+    file_paths = [
+        TEST_DATA_DIR / "data" / "avro" / "test-deflate.avro",
+        TEST_DATA_DIR / "data" / "avro" / "test-snappy.avro",
+        TEST_DATA_DIR / "data" / "avro" / "weather.avro",
+    ]
+    for file_path in file_paths:
+        columns = ["station"] if file_path.name == "weather.avro" else None
+        for options in ({}, {"batch_size": 3}, {"jobs": 2}, {"columns": columns}):
+            monkeypatch.setenv(ENGINE_ENV, "fastavro")
+            expected = AvroUtils.to_record_batch_reader(file_path, **options).read_all()
+            monkeypatch.setenv(ENGINE_ENV, "columnar")
+            assert AvroUtils.to_record_batch_reader(file_path, **options).read_all().equals(expected)
+
+    monkeypatch.setenv(ENGINE_ENV, "unknown")
+    with pytest.raises(ValueError):
+        AvroUtils.to_arrow_table(file_paths[0])
+
+
+def test_columnar_engine_types():
+    schema = {"type": "record", "name": "Record", "namespace": "test", "fields": [
+        {"name": "id", "type": "long"},
+        {"name": "flag", "type": ["null", "boolean"]},
+        {"name": "score", "type": ["double", "null"]},
+        {"name": "name", "type": ["null", "string"]},
+        {"name": "kind", "type": {"type": "enum", "name": "Kind", "symbols": ["A", "B"]}},
+        {"name": "digest", "type": {"type": "fixed", "name": "Digest", "size": 4}},
+        {"name": "amount", "type": {"type": "bytes", "logicalType": "decimal", "precision": 10, "scale": 2}},
+        {"name": "balance", "type": ["null", {"type": "fixed", "name": "Balance", "size": 16,
+                                              "logicalType": "decimal", "precision": 38, "scale": 4}]},
+        {"name": "day", "type": ["null", {"type": "int", "logicalType": "date"}]},
+        {"name": "values", "type": {"type": "array", "items": ["null", "long"]}},
+        {"name": "attributes", "type": ["null", {"type": "map", "values": "string"}]},
+        {"name": "child", "type": ["null", {"type": "record", "name": "Child", "fields": [
+            {"name": "kinds", "type": {"type": "array", "items": "Kind"}},
+            {"name": "digests", "type": ["null", {"type": "array", "items": "Digest"}]},
+        ]}]},
+    ]}
+    records = [
+        {
+            "id": (-1) ** i * 37 ** (i % 12),
+            "flag": None if i % 3 == 0 else i % 2 == 0,
+            "score": None if i % 4 == 0 else i / 7,
+            "name": None if i % 5 == 0 else "é" * (i % 70),
+            "kind": "AB"[i % 2],
+            "digest": i.to_bytes(4, "big"),
+            "amount": decimal.Decimal(i * 1234567 - 10 ** 7) / 100,
+            "balance": None if i % 8 == 0 else decimal.Decimal((-3) ** (i % 80)).scaleb(-4),
+            "day": None if i % 6 == 0 else datetime.date(2000, 1, 1) + datetime.timedelta(days=i),
+            "values": [None if j % 3 == 0 else j * i for j in range(i % 4)],
+            "attributes": None if i % 7 == 0 else {str(j): "v" * j for j in range(i % 3)},
+            "child": None if i % 2 else {"kinds": ["B"] * (i % 3), "digests": None if i % 4 else [b"abcd"]},
+        }
+        for i in range(500)
+    ]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "types.avro"
+        with open(file_path, "wb") as f:
+            fastavro.writer(f, schema, records, codec="deflate", sync_interval=2000)
+
+        for columns in (None, ["child", "amount"]):
+            reader_schema = project_schema(schema, columns) if columns else schema
+            with open(file_path, "rb") as f:
+                expected = pa.Table.from_pylist(list(fastavro.reader(f, reader_schema)),
+                                                schema=avro_to_arrow_schema(reader_schema))
+            for batch_size in (7, 65536):
+                reader = AvroUtils.to_record_batch_reader(file_path, batch_size=batch_size, columns=columns)
+                batches = list(reader)
+                assert all(batch.num_rows == batch_size for batch in batches[:-1])
+                assert pa.Table.from_batches(batches).equals(expected)
+
+
+def test_columnar_engine_skips_recursive_types():
+    schema = {
+        "type": "record",
+        "name": "Node",
+        "fields": [
+            {"name": "value", "type": "long"},
+            {"name": "next", "type": ["null", "Node"]},
+            {"name": "tags", "type": {"type": "array", "items": {
+                "type": "record",
+                "name": "Tag",
+                "fields": [{"name": "name", "type": "string"}, {"name": "parent", "type": ["null", "Node", "Tag"]}],
+            }}},
+            {"name": "label", "type": "string"},
+        ],
+    }
+
+    def node(depth):
+        tag = {"name": f"tag{depth}", "parent": {"name": "parent", "parent": None} if depth % 2 else None}
+        return {"value": depth, "next": node(depth - 1) if depth else None, "tags": [tag], "label": f"node{depth}"}
+
+    records = [node(i % 5) for i in range(100)]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "nodes.avro"
+        with open(file_path, "wb") as f:
+            fastavro.writer(f, fastavro.parse_schema(schema), records)
+
+        table = AvroUtils.to_record_batch_reader(file_path, columns=["value", "label"]).read_all()
+        num_rows, column_stats = AvroUtils.stats(file_path, cache=False, columns=["value"])
+
+    assert table.to_pylist() == [{"value": record["value"], "label": record["label"]} for record in records]
+    assert num_rows == 100
+    assert column_stats["value"]["max"] == 4
+
+
+def test_columnar_engine_truncated():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.avro"
+        with open(file_path, "wb") as f:
+            fastavro.writer(f, {"type": "record", "name": "Record", "fields": [{"name": "name", "type": "string"}]},
+                            [{"name": "x" * 100}] * 10)
+        data = bytearray(file_path.read_bytes())
+        with open(file_path, "rb") as f:
+            block = next(iter_blocks(f, read_header(f)))
+        # Declare one record more than the block holds
+        data[block.offset] += 2
+        file_path.write_bytes(data)
+        with pytest.raises(ValueError):
+            AvroUtils.to_arrow_table(file_path)
+
+
 def test_head():
     pass
 
 
 def test_tail():
-    pass
+    file_path = TEST_DATA_DIR / "data" / "avro" / "weather.avro"
+    with open(file_path, "rb") as f:
+        expected = list(fastavro.reader(f))
+
+    assert AvroUtils.tail(file_path, 2) == expected[-2:]
+    assert AvroUtils.tail(file_path, 100) == expected
+    assert AvroUtils.tail(file_path, 0) == []
+
+
+def test_head_tail_multi_type_union(capsys):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "union.avro"
+        schema = {
+            "type": "record",
+            "name": "Event",
+            "fields": [{"name": "id", "type": "int"}, {"name": "value", "type": ["null", "string", "long"]}],
+        }
+        records = [{"id": 1, "value": "a,b"}, {"id": 2, "value": 3}, {"id": 3, "value": None}]
+        with open(file_path, "wb") as f:
+            fastavro.writer(f, fastavro.parse_schema(schema), records)
+
+        assert AvroUtils.head(file_path, 2) == records[:2]
+        assert AvroUtils.tail(file_path, 2, output_format="csv") == records[1:]
+
+    assert capsys.readouterr().out.splitlines() == [
+        '{"id": 1, "value": "a,b"}',
+        '{"id": 2, "value": 3}',
+        '"id","value"',
+        '2,3',
+        '3,',
+    ]
+
+
+def test_tail_multi_block():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.avro"
+        schema_path = TEST_DATA_DIR / "sample_schema.avsc"
+        AvroUtils.create_sample(file_path, schema_path, 20000, "deflate", sync_interval=4096)
+
+        with open(file_path, "rb") as f:
+            header = read_header(f)
+            blocks = list(iter_blocks(f, header))
+        assert len(blocks) > 10
+        assert sum(block.num_records for block in blocks) == 20000
+
+        tracemalloc.start()
+        with open(file_path, "rb") as f:
+            expected = list(fastavro.reader(f))[-7:]
+        _, full_peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        result = AvroUtils.tail(file_path, 7)
+        _, tail_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        assert result == expected
+        # Memory depends on N and the block size, not on the number of records in the file
+        assert tail_peak * 10 < full_peak
+
+
+def test_count(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.avro"
+        schema_path = TEST_DATA_DIR / "sample_schema.avsc"
+        AvroUtils.create_sample(file_path, schema_path, 5000, "deflate", sync_interval=4096)
+
+        def fail(*args, **kwargs):
+            pytest.fail("Counting should not decode records")
+
+        monkeypatch.setattr(fastavro, "reader", fail)
+        monkeypatch.setattr(fastavro, "block_reader", fail)
+        assert AvroUtils.count(file_path) == 5000
+
+
+def test_sample(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.avro"
+        schema_path = TEST_DATA_DIR / "sample_schema.avsc"
+        AvroUtils.create_sample(file_path, schema_path, 20000, "deflate", sync_interval=4096)
+        table = AvroUtils.to_arrow_table(file_path)
+
+        decoded_blocks = []
+
+        def read_records(fo, header, blocks, reader_schema=None):
+            blocks = list(blocks)
+            decoded_blocks.extend(blocks)
+            return avro_blocks.read_records(fo, header, blocks, reader_schema)
+
+        monkeypatch.setattr("data_tools.utils.avro.read_records", read_records)
+        result = AvroUtils.sample(file_path, 5, seed=7)
+        assert result.equals(table.take(sample_positions(20000, 5, seed=7)))
+        assert 0 < len(decoded_blocks) <= 5
+        assert len(AvroUtils.block_index(file_path)) > 100
+
+        assert AvroUtils.sample(file_path, 5, seed=7).equals(result)
+        assert not AvroUtils.sample(file_path, 5, seed=8).equals(result)
+        assert AvroUtils.sample(file_path, 3, seed=7, columns=["age"]).schema.names == ["age"]
 
 
 def test_schema():
     pass
 
 
-def test_query():
-    pass
+def test_query(capsys):
+    file_path = TEST_DATA_DIR / "data" / "avro" / "weather.avro"
+    AvroUtils.query(
+        file_path, "select station, max(temp) as temp from 'weather.avro' group by station order by station",
+    )
+
+    assert capsys.readouterr().out.splitlines() == [
+        '{"station": "011990-99999", "temp": 22}',
+        '{"station": "012650-99999", "temp": 111}',
+    ]
+
+
+@pytest.mark.parametrize("scans_streams", [None, False])
+def test_query_scans_table_twice(capsys, monkeypatch, scans_streams):
+    # Older DuckDB and pyarrow versions scan the decoded files through a dataset of temporary files
+    if scans_streams is not None:
+        monkeypatch.setattr(decoded_files, "_scans_streams", lambda: scans_streams)
+    file_path = TEST_DATA_DIR / "data" / "avro" / "weather.avro"
+    AvroUtils.query(file_path, "select count(*) as c from 'weather.avro' a, 'weather.avro' b")
+    AvroUtils.query(
+        file_path,
+        "select (select min(temp) from 'weather.avro') as low, (select max(temp) from 'weather.avro') as high",
+    )
+
+    assert capsys.readouterr().out.splitlines() == ['{"c": 25}', '{"low": -11, "high": 111}']
+
+
+def test_columns():
+    file_path = TEST_DATA_DIR / "data" / "avro" / "weather.avro"
+    with open(file_path, "rb") as f:
+        expected = [{"temp": record["temp"], "station": record["station"]} for record in fastavro.reader(f)]
+
+    assert AvroUtils.head(file_path, 2, columns=["temp", "station"]) == expected[:2]
+    assert AvroUtils.tail(file_path, 2, columns=["temp", "station"]) == expected[-2:]
+    table = AvroUtils.to_record_batch_reader(file_path, columns=["temp", "station"]).read_all()
+    assert table.schema.names == ["temp", "station"]
+    assert table.to_pylist() == expected
+
+    num_rows, column_stats = AvroUtils.stats(file_path, columns=["temp"])
+    assert num_rows == 5
+    assert list(column_stats) == ["temp"]
+    assert column_stats["temp"] == AvroUtils.stats(file_path)[1]["temp"]
+
+    with pytest.raises(ValueError, match="Unknown columns: wind"):
+        AvroUtils.head(file_path, columns=["temp", "wind"])
+
+
+def test_project_schema_named_types():
+    schema = fastavro.parse_schema({
+        "type": "record",
+        "name": "Trip",
+        "namespace": "test",
+        "fields": [
+            {"name": "start", "type": {"type": "record", "name": "Point", "fields": [{"name": "x", "type": "int"}]}},
+            {"name": "end", "type": "Point"},
+            {"name": "id", "type": "long"},
+        ],
+    })
+    records = [{"start": {"x": i}, "end": {"x": i + 1}, "id": i} for i in range(3)]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "trips.avro"
+        with open(file_path, "wb") as f:
+            fastavro.writer(f, schema, records)
 
+        # Point is defined in a dropped field, it is inlined in the kept one
+        reader_schema = project_schema(schema, ["end", "id"])
+        assert reader_schema["fields"][0]["type"]["name"] == "test.Point"
+        assert AvroUtils.head(file_path, columns=["end", "id"]) == [
+            {"end": record["end"], "id": record["id"]} for record in records
+        ]
+        assert AvroUtils.head(file_path, columns=["start", "end"]) == [
+            {"start": record["start"], "end": record["end"]} for record in records
+        ]
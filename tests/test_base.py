@@ -0,0 +1,292 @@
+import io
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+import fastavro
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from data_tools.utils.avro import AvroUtils
+from data_tools.utils.avro_arrow import avro_to_arrow_schema
+from data_tools.utils.base import BaseUtils
+
+TEST_DATA_DIR = Path(__file__).resolve().parent
+
+
+def test_avro_to_arrow_schema():
+    schema = {
+        "type": "record",
+        "name": "Event",
+        "namespace": "example",
+        "fields": [
+            {"name": "id", "type": "long"},
+            {"name": "label", "type": ["null", "string"]},
+            {"name": "day", "type": {"type": "int", "logicalType": "date"}},
+            {"name": "ts", "type": {"type": "long", "logicalType": "timestamp-millis"}},
+            {"name": "home", "type": {"type": "record", "name": "Address", "fields": [
+                {"name": "city", "type": "string"},
+            ]}},
+            {"name": "work", "type": "Address"},
+            {"name": "tags", "type": {"type": "array", "items": "string"}},
+            {"name": "attributes", "type": {"type": "map", "values": "double"}},
+            {"name": "kind", "type": {"type": "enum", "name": "Kind", "symbols": ["A", "B"]}},
+            {"name": "digest", "type": {"type": "fixed", "name": "Digest", "size": 4}},
+        ],
+    }
+    address = pa.struct([pa.field("city", pa.string())])
+
+    assert avro_to_arrow_schema(schema) == pa.schema([
+        pa.field("id", pa.int64()),
+        pa.field("label", pa.string()),
+        pa.field("day", pa.date32()),
+        pa.field("ts", pa.timestamp("ms", tz="UTC")),
+        pa.field("home", address),
+        pa.field("work", address),
+        pa.field("tags", pa.list_(pa.string())),
+        pa.field("attributes", pa.map_(pa.string(), pa.float64())),
+        pa.field("kind", pa.string()),
+        pa.field("digest", pa.binary(4)),
+    ])
+
+
+def test_to_record_batch_reader():
+    file_path = TEST_DATA_DIR / "data" / "avro" / "weather.avro"
+    reader = BaseUtils.to_record_batch_reader(file_path, batch_size=2)
+
+    assert reader.schema == pa.schema([("station", pa.string()), ("time", pa.int64()), ("temp", pa.int32())])
+    batches = list(reader)
+    assert [batch.num_rows for batch in batches] == [2, 2, 1]
+    with open(file_path, "rb") as f:
+        assert pa.Table.from_batches(batches).to_pylist() == list(fastavro.reader(f))
+
+
+def test_to_record_batch_reader_bounded_memory():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.avro"
+        schema_path = TEST_DATA_DIR / "sample_schema.avsc"
+        AvroUtils.create_sample(file_path, schema_path, 20000)
+        # Modules imported on first read would otherwise stay allocated and count towards the streaming peak
+        BaseUtils.to_record_batch_reader(file_path, batch_size=1).read_next_batch()
+
+        tracemalloc.start()
+        table = BaseUtils.to_arrow_table(file_path)
+        _, table_peak = tracemalloc.get_traced_memory()
+        del table
+        tracemalloc.reset_peak()
+        num_rows = sum(batch.num_rows for batch in BaseUtils.to_record_batch_reader(file_path, batch_size=500))
+        _, stream_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        assert num_rows == 20000
+        assert stream_peak * 5 < table_peak
+
+
+GENERATOR_SCHEMA = {
+    "type": "record",
+    "name": "Event",
+    "namespace": "example",
+    "fields": [
+        {"name": "id", "type": "long"},
+        {"name": "label", "type": ["null", "string", "int"]},
+        {"name": "day", "type": {"type": "int", "logicalType": "date"}},
+        {"name": "ts", "type": {"type": "long", "logicalType": "timestamp-micros"}},
+        {"name": "price", "type": {"type": "bytes", "logicalType": "decimal", "precision": 9, "scale": 2}},
+        {"name": "ref", "type": {"type": "string", "logicalType": "uuid"}},
+        {"name": "home", "type": {"type": "record", "name": "Address", "fields": [
+            {"name": "city", "type": "string"},
+        ]}},
+        {"name": "work", "type": ["null", "Address"]},
+        {"name": "scores", "type": {"type": "array", "items": "int"}},
+        {"name": "attributes", "type": {"type": "map", "values": {"type": "array", "items": "double"}}},
+        {"name": "kind", "type": {"type": "enum", "name": "Kind", "symbols": ["A", "B"]}},
+        {"name": "digest", "type": {"type": "fixed", "name": "Digest", "size": 4}},
+    ],
+}
+
+
+def test_generate_data():
+    schema = fastavro.parse_schema(GENERATOR_SCHEMA)
+    records = BaseUtils.generate_data(schema, 200, seed=42)
+
+    assert records == BaseUtils.generate_data(schema, 200, seed=42)
+    assert records != BaseUtils.generate_data(schema, 200, seed=43)
+    assert all(isinstance(score, int) for record in records for score in record["scores"])
+    assert {type(record["label"]) for record in records} == {type(None), str, int}
+    assert all(len(record["digest"]) == 4 for record in records)
+
+    # The records are valid for the schema, including unions and logical types
+    buffer = io.BytesIO()
+    fastavro.writer(buffer, schema, records)
+    buffer.seek(0)
+    assert len(list(fastavro.reader(buffer))) == 200
+
+
+def test_generate_recursive_data():
+    schema = fastavro.parse_schema({
+        "type": "record",
+        "name": "Node",
+        "fields": [{"name": "value", "type": "int"}, {"name": "next", "type": ["null", "Node"]}],
+    })
+    records = BaseUtils.generate_data(schema, 50, seed=1)
+
+    # Some lists are longer than one node
+    assert any(record["next"] is not None for record in records)
+    buffer = io.BytesIO()
+    fastavro.writer(buffer, schema, records)
+    buffer.seek(0)
+    assert list(fastavro.reader(buffer)) == records
+
+
+def test_generate_batches():
+    from data_tools.utils.output import to_pylist
+
+    schema = fastavro.parse_schema({
+        "type": "record",
+        "name": "Event",
+        "fields": [f for f in GENERATOR_SCHEMA["fields"] if f["name"] not in ("label", "work")] + [
+            {"name": "label", "type": ["null", "string"]},
+        ],
+    })
+    batches = list(BaseUtils.generate_batches(schema, 2500, seed=42, jobs=2, chunk_size=1000))
+
+    assert [batch.num_rows for batch in batches] == [1000, 1000, 500]
+    assert batches[0].schema == avro_to_arrow_schema(schema)
+    # Chunks are seeded independently, so the output does not depend on the number of workers
+    single_process = list(BaseUtils.generate_batches(schema, 2500, seed=42, jobs=1, chunk_size=1000))
+    assert pa.Table.from_batches(batches).equals(pa.Table.from_batches(single_process))
+    assert 0 < batches[0].column("label").null_count < 1000
+
+    buffer = io.BytesIO()
+    records = [record for batch in batches for record in to_pylist(batch)]
+    fastavro.writer(buffer, schema, records)
+    assert buffer.tell() > 0
+
+
+def test_write_batches():
+    from data_tools.utils.output import write_batches
+
+    table = pa.table({
+        "id": pa.array([1, 2], pa.int64()),
+        "payload": pa.array([b"\x00\x01", None], pa.binary()),
+        "tags": pa.array([["a", "b"], []], pa.list_(pa.string())),
+    })
+
+    stream = io.BytesIO()
+    assert write_batches(table.schema, table.to_batches(max_chunksize=1), "jsonl", stream) == 2
+    assert stream.getvalue().decode().splitlines() == [
+        '{"id": 1, "payload": "AAE=", "tags": ["a", "b"]}',
+        '{"id": 2, "payload": null, "tags": []}',
+    ]
+
+    stream = io.BytesIO()
+    write_batches(table.schema, table.to_batches(), "csv", stream)
+    assert stream.getvalue().decode().splitlines()[0] == '"id","payload","tags"'
+    assert '"[""a"", ""b""]"' in stream.getvalue().decode()
+
+    stream = io.BytesIO()
+    write_batches(table.schema, table.to_batches(max_chunksize=1), "arrow", stream)
+    assert pa.ipc.open_stream(stream.getvalue()).read_all() == table
+
+
+def test_write_maps(monkeypatch):
+    from data_tools.utils import output
+
+    attributes_type = pa.map_(pa.string(), pa.list_(pa.map_(pa.string(), pa.int64())))
+    table = pa.table({
+        "attributes": pa.array([[("a", [[("x", 1)]])], None], attributes_type),
+        "point": pa.array([{"tags": [("b", 2), ("b", 3)]}, None],
+                          pa.struct([("tags", pa.map_(pa.string(), pa.int64()))])),
+    })
+    expected = [
+        '{"attributes": {"a": [{"x": 1}]}, "point": {"tags": {"b": 3}}}',
+        '{"attributes": null, "point": null}',
+    ]
+
+    # Maps are converted to dicts with and without maps_as_pydicts (pyarrow 20)
+    for maps_as_pydicts in {output._maps_as_pydicts(), False}:
+        monkeypatch.setattr(output, "_maps_as_pydicts", lambda: maps_as_pydicts)
+        stream = io.BytesIO()
+        output.write_batches(table.schema, table.to_batches(), "jsonl", stream)
+        assert stream.getvalue().decode().splitlines() == expected
+        stream = io.BytesIO()
+        output.write_batches(table.schema, table.to_batches(), "csv", stream)
+        assert '"{""a"": [{""x"": 1}]}"' in stream.getvalue().decode()
+
+
+def test_write_arrow_table():
+    table = pa.table({
+        "id": pa.array([1, 2, 3], pa.int64()),
+        "name": pa.array(["a", None, "c"]),
+        "point": pa.array([{"x": 1.5}, {"x": None}, None], pa.struct([("x", pa.float64())])),
+        "attributes": pa.array([[("k", 1)], [], None], pa.map_(pa.string(), pa.int32())),
+        "ts": pa.array([0, 1000, None], pa.timestamp("ms", tz="UTC")),
+    })
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "table.avro"
+        BaseUtils.write_arrow_table(table, file_path)
+
+        assert BaseUtils.to_arrow_table(file_path).equals(table.cast(BaseUtils.to_arrow_table(file_path).schema))
+        with open(file_path, "rb") as f:
+            assert [record["name"] for record in fastavro.reader(f)] == ["a", None, "c"]
+
+
+def test_convert(capsys):
+    from data_tools.utils.csv import CsvUtils
+    from data_tools.utils.json import JsonUtils
+    from data_tools.utils.parquet import ParquetUtils
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        avro_path = Path(tmpdir) / "sample.avro"
+        AvroUtils.create_sample(avro_path, TEST_DATA_DIR / "sample_schema.avsc", 5000, "deflate", seed=1)
+        expected = AvroUtils.to_arrow_table(avro_path)
+
+        parquet_path = Path(tmpdir) / "sample.parquet"
+        assert AvroUtils.convert(avro_path, parquet_path, ParquetUtils, codec="zstd", row_group_size=2000) == 5000
+        metadata = pq.read_metadata(parquet_path)
+        assert [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)] == [2000, 2000, 1000]
+        assert metadata.row_group(0).column(0).compression == "ZSTD"
+        assert pq.read_table(parquet_path).equals(expected)
+
+        # Blocks are encoded and compressed in worker processes, and appended in order
+        avro_copy_path = Path(tmpdir) / "copy.avro"
+        ParquetUtils.convert(parquet_path, avro_copy_path, AvroUtils, codec="deflate", sync_interval=4096, jobs=2)
+        with open(avro_copy_path, "rb") as f:
+            assert fastavro.reader(f).codec == "deflate"
+        assert AvroUtils.num_rows(avro_copy_path) == 5000
+        copy = AvroUtils.to_arrow_table(avro_copy_path)
+        assert copy.equals(expected.cast(copy.schema))
+
+        csv_path = Path(tmpdir) / "sample.csv"
+        jsonl_path = Path(tmpdir) / "sample.jsonl"
+        ParquetUtils.convert(parquet_path, csv_path, CsvUtils, columns=["name", "age"])
+        CsvUtils.convert(csv_path, jsonl_path, JsonUtils)
+        converted = JsonUtils.to_record_batch_reader(jsonl_path).read_all()
+        assert converted.to_pylist() == expected.select(["name", "age"]).to_pylist()
+        assert capsys.readouterr().out.splitlines()[-1] == f"Converted 5000 rows to {jsonl_path}"
+
+
+def test_convert_splits_large_avro(capsys, monkeypatch):
+    from data_tools.utils import avro_blocks, base
+    from data_tools.utils.parquet import ParquetUtils
+
+    # A 64KB maximum makes the sample file large: it is split into more ranges than RANGES_PER_JOB * jobs
+    monkeypatch.setattr(avro_blocks, "MIN_SPLIT_SIZE", 1)
+    monkeypatch.setattr(avro_blocks, "MAX_SPLIT_SIZE", 64 * 1024)
+    ranges = []
+
+    def recording_split_ranges(*args, **kwargs):
+        ranges.extend(avro_blocks.split_ranges(*args, **kwargs))
+        return ranges
+
+    monkeypatch.setattr(base, "split_ranges", recording_split_ranges)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        avro_path = Path(tmpdir) / "sample.avro"
+        AvroUtils.create_sample(avro_path, TEST_DATA_DIR / "sample_schema.avsc", 20000, "null", seed=1)
+        parquet_path = Path(tmpdir) / "sample.parquet"
+
+        assert AvroUtils.convert(avro_path, parquet_path, ParquetUtils, jobs=2) == 20000
+
+        assert len(ranges) > base.RANGES_PER_JOB * 2
+        assert max(end - start for start, end in ranges) <= 64 * 1024
+        assert pq.read_table(parquet_path).equals(AvroUtils.to_arrow_table(avro_path))
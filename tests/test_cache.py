@@ -0,0 +1,95 @@
+import os
+import pickle
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from data_tools.utils import cache
+from data_tools.utils.avro import AvroUtils
+from data_tools.utils.cache import MetadataCache, cached, fingerprint
+
+TEST_DATA_DIR = Path(__file__).resolve().parent
+
+
+def test_cached():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "data.csv"
+        file_path.write_text("a\n1\n")
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return {"num_rows": len(calls)}
+
+        assert cached(file_path, "stats", compute) == {"num_rows": 1}
+        assert cached(file_path, "stats", compute) == {"num_rows": 1}
+        assert cached(file_path, "stats", compute, enabled=False) == {"num_rows": 2}
+
+        # Any change of the file makes a new fingerprint
+        file_path.write_text("a\n1\n2\n")
+        assert cached(file_path, "stats", compute) == {"num_rows": 3}
+
+
+def test_eviction():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        metadata_cache = MetadataCache(Path(tmpdir), max_size=3500)
+        for i in range(3):
+            metadata_cache.set(f"key-{i}", "stats", b"x" * 1000)
+            os.utime(Path(tmpdir) / f"key-{i}-stats.pickle", ns=(i, i))
+        # Reading key-0 makes key-1 the least recently used entry
+        assert metadata_cache.get("key-0", "stats") == b"x" * 1000
+
+        metadata_cache.set("key-3", "stats", b"x" * 1000)
+
+        assert metadata_cache.get("key-1", "stats") is None
+        assert metadata_cache.get("key-0", "stats") is not None
+        assert metadata_cache.get("key-3", "stats") is not None
+
+
+def test_version_mismatch(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        metadata_cache = MetadataCache(Path(tmpdir))
+        metadata_cache.set("key", "stats", {"num_rows": 1})
+        assert metadata_cache.get("key", "stats") == {"num_rows": 1}
+
+        # Entries written by another version of the code are misses, as are entries without a version
+        monkeypatch.setattr(cache, "CACHE_VERSION", cache.CACHE_VERSION + 1)
+        assert metadata_cache.get("key", "stats") is None
+        with open(Path(tmpdir) / "key-old-stats.pickle", "wb") as f:
+            pickle.dump({"num_rows": 1}, f)
+        assert metadata_cache.get("key", "old-stats") is None
+
+
+def test_stats_from_cache(monkeypatch):
+    file_path = TEST_DATA_DIR / "data" / "avro" / "weather.avro"
+    expected = AvroUtils.stats(file_path)
+
+    def fail(*args):
+        pytest.fail("Statistics should come from the cache")
+
+    monkeypatch.setattr(AvroUtils, "_compute_stats", fail)
+    assert AvroUtils.stats(file_path) == expected
+    with pytest.raises(pytest.fail.Exception):
+        AvroUtils.stats(file_path, cache=False)
+
+
+def test_fingerprint():
+    file_path = TEST_DATA_DIR / "data" / "avro" / "weather.avro"
+    assert fingerprint(file_path) == fingerprint(file_path)
+    assert fingerprint(file_path) != fingerprint(TEST_DATA_DIR / "data" / "avro" / "test-snappy.avro")
+
+
+@pytest.mark.skipif(not hasattr(os, "getuid"), reason="Entries have no owner")
+def test_private_entries(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        directory = Path(tmpdir) / "cache"
+        metadata_cache = MetadataCache(directory)
+        metadata_cache.set("key", "stats", {"num_rows": 1})
+        assert directory.stat().st_mode & 0o777 == 0o700
+        assert metadata_cache.get("key", "stats") == {"num_rows": 1}
+
+        # Entries of another user are never unpickled
+        uid = os.getuid()
+        monkeypatch.setattr(os, "getuid", lambda: uid + 1)
+        assert metadata_cache.get("key", "stats") is None
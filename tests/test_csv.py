@@ -0,0 +1,141 @@
+import tempfile
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+from data_tools.utils import text
+from data_tools.utils.csv import CsvUtils
+from data_tools.utils.sampling import reservoir_sample
+
+
+def _write_csv(file_path: Path, num_rows: int = 1000) -> pa.Table:
+    table = pa.table({
+        "id": pa.array(range(num_rows), pa.int64()),
+        "name": pa.array([f"name-{i}" for i in range(num_rows)]),
+        "score": pa.array([i / 4 for i in range(num_rows)]),
+    })
+    pa_csv.write_csv(table, file_path)
+    return table
+
+
+def test_head():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.csv"
+        table = _write_csv(file_path)
+
+        assert CsvUtils.head(file_path, 5).equals(table.slice(0, 5))
+        assert CsvUtils.head(file_path, 5000).equals(table)
+
+
+def test_tail():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.csv"
+        table = _write_csv(file_path)
+
+        assert CsvUtils.tail(file_path, 5).equals(table.slice(995))
+        assert CsvUtils.tail(file_path, 5000).equals(table)
+        assert CsvUtils.tail(file_path, 0).num_rows == 0
+
+
+def test_meta(capsys):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.csv"
+        table = _write_csv(file_path)
+
+        schema, metadata, codec, serialized_size = CsvUtils.meta(file_path)
+
+        assert schema == table.schema
+        assert metadata is None and codec is None
+        assert serialized_size == file_path.stat().st_size
+        assert capsys.readouterr().out.splitlines()[-2:] == ["Codec: None", f"Serialized size: {serialized_size}"]
+
+
+def test_count():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.csv"
+        _write_csv(file_path)
+        assert CsvUtils.count(file_path) == 1000
+
+        # Without a newline at the end of the last line
+        file_path.write_bytes(file_path.read_bytes().rstrip(b"\n"))
+        assert CsvUtils.count(file_path) == 1000
+
+
+def test_sample():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.csv"
+        table = _write_csv(file_path)
+
+        result = CsvUtils.sample(file_path, 30, seed=1)
+        ids = result.column("id").to_pylist()
+        assert len(set(ids)) == 30
+        assert ids == sorted(ids)
+        assert result.equals(table.take(ids))
+        assert CsvUtils.sample(file_path, 30, seed=1).equals(result)
+
+        assert CsvUtils.sample(file_path, 5000, seed=1).equals(table)
+        assert CsvUtils.sample(file_path, 0).num_rows == 0
+
+
+def test_reservoir_sample():
+    table = pa.table({"id": pa.array(range(10000), pa.int64())})
+    # Rows of late batches must be as likely to be picked as the first ones
+    picked = [0] * 10
+    for seed in range(50):
+        sample = reservoir_sample(table.to_batches(max_chunksize=100), table.schema, 100, seed)
+        assert sample.num_rows == 100
+        for i in sample.column("id").to_pylist():
+            picked[i // 1000] += 1
+    assert min(picked) > 400
+
+
+def test_parallel_reader(monkeypatch):
+    monkeypatch.setattr(text, "MIN_RANGE_SIZE", 1024)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.csv"
+        table = _write_csv(file_path, 10000)
+
+        reader = CsvUtils.to_record_batch_reader(file_path, jobs=2)
+        batches = list(reader)
+        assert len(batches) > 2
+        assert pa.Table.from_batches(batches).equals(table)
+
+
+def test_stats():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.csv"
+        _write_csv(file_path)
+
+        num_rows, column_stats = CsvUtils.stats(file_path)
+
+        assert num_rows == 1000
+        assert column_stats["id"]["min"] == 0
+        assert column_stats["id"]["max"] == 999
+        assert column_stats["name"]["null_count"] == 0
+
+
+def test_query(capsys):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.csv"
+        _write_csv(file_path)
+
+        CsvUtils.query(file_path, "select id, name from 'sample.csv' where id between 500 and 501")
+
+        assert capsys.readouterr().out.splitlines() == [
+            '{"id": 500, "name": "name-500"}',
+            '{"id": 501, "name": "name-501"}',
+        ]
+
+
+def test_columns(monkeypatch):
+    monkeypatch.setattr(text, "MIN_RANGE_SIZE", 1024)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.csv"
+        table = _write_csv(file_path, 10000).select(["score", "id"])
+
+        assert CsvUtils.head(file_path, 5, columns=["score", "id"]).equals(table.slice(0, 5))
+        assert CsvUtils.tail(file_path, 5, columns=["score", "id"]).equals(table.slice(9995))
+        reader = CsvUtils.to_record_batch_reader(file_path, jobs=2, columns=["score", "id"])
+        assert reader.read_all().equals(table)
+        assert list(CsvUtils.stats(file_path, columns=["id"])[1]) == ["id"]
@@ -0,0 +1,216 @@
+import json
+import tempfile
+from pathlib import Path
+
+import fastavro
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from data_tools.main import get_file_format
+from data_tools.utils.avro import AvroUtils
+from data_tools.utils.dataset import Dataset, DatasetUtils, discover
+from data_tools.utils.parquet import ParquetUtils
+from data_tools.utils.sampling import sample_positions
+
+SCHEMA = {
+    "type": "record",
+    "name": "Event",
+    "fields": [{"name": "id", "type": "long"}, {"name": "name", "type": "string"}],
+}
+
+
+def _write_partitions(root: Path, file_format: str) -> None:
+    """
+    Write day=<day>/hour=<hour>/part-<i> files of 10 records each, plus a _SUCCESS marker per partition.
+    """
+    for day in ("2023-06-01", "2023-06-02"):
+        for hour in (0, 1):
+            directory = root / f"day={day}" / f"hour={hour}"
+            directory.mkdir(parents=True)
+            (directory / "_SUCCESS").touch()
+            for i in range(2):
+                records = [{"id": j, "name": f"{day}/{hour}/{i}"} for j in range(10)]
+                if file_format == "avro":
+                    with open(directory / f"part-{i}.avro", "wb") as f:
+                        fastavro.writer(f, SCHEMA, records)
+                else:
+                    pq.write_table(pa.Table.from_pylist(records), directory / f"part-{i}.parquet")
+
+
+def _dataset(path: Path) -> Dataset:
+    files, file_format = discover(path, get_file_format)
+    utils_cls = AvroUtils if file_format == "avro" else ParquetUtils
+    return Dataset(path.name, files, utils_cls)
+
+
+def test_discover():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        root = Path(tmpdir) / "events"
+        _write_partitions(root, "avro")
+
+        files, file_format = discover(root, get_file_format)
+        assert file_format == "avro"
+        assert len(files) == 8
+        assert files[0].path == root / "day=2023-06-01" / "hour=0" / "part-0.avro"
+        assert files[0].partition == (("day", "2023-06-01"), ("hour", "0"))
+
+        files, _ = discover(root / "day=2023-06-02" / "*" / "part-1.avro", get_file_format)
+        assert [data_file.partition for data_file in files] == [
+            (("hour", "0"),),
+            (("hour", "1"),),
+        ]
+
+
+def test_schema():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        root = Path(tmpdir) / "events"
+        _write_partitions(root, "parquet")
+
+        assert DatasetUtils.schema(_dataset(root), jobs=2) == pa.schema([
+            ("id", pa.int64()),
+            ("name", pa.string()),
+            ("day", pa.string()),
+            ("hour", pa.int64()),
+        ])
+
+
+def test_stats():
+    for file_format in ("avro", "parquet"):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            root = Path(tmpdir) / "events"
+            _write_partitions(root, file_format)
+
+            num_rows, column_stats = DatasetUtils.stats(_dataset(root), jobs=2)
+
+            assert num_rows == 80
+            assert column_stats["id"]["count"] == 80
+            assert column_stats["id"]["max"] == 9
+            assert column_stats["name"]["min"] == "2023-06-01/0/0"
+            assert column_stats["name"]["max"] == "2023-06-02/1/1"
+
+
+def test_count():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        root = Path(tmpdir) / "events"
+        _write_partitions(root, "avro")
+
+        assert DatasetUtils.count(_dataset(root), jobs=2) == 80
+
+
+def test_head():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        root = Path(tmpdir) / "events"
+        _write_partitions(root, "avro")
+
+        table = DatasetUtils.head(_dataset(root), 15)
+
+        assert table.num_rows == 15
+        assert table.column("name").to_pylist()[9:11] == ["2023-06-01/0/0", "2023-06-01/0/1"]
+        assert set(table.column("hour").to_pylist()) == {0}
+
+
+@pytest.mark.parametrize("file_format", ["avro", "parquet"])
+def test_query_prunes_partitions(capsys, monkeypatch, file_format):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        root = Path(tmpdir) / "events"
+        _write_partitions(root, file_format)
+        # The files of pruned partitions are never opened, the schema is read from the first file only
+        (root / "day=2023-06-01" / "hour=1" / f"part-0.{file_format}").write_bytes(b"corrupt")
+        opened = []
+        to_record_batch_reader = AvroUtils.to_record_batch_reader
+
+        def recording_reader(cls, file_path, *args, **kwargs):
+            opened.append(file_path)
+            return to_record_batch_reader(file_path, *args, **kwargs)
+
+        monkeypatch.setattr(AvroUtils, "to_record_batch_reader", classmethod(recording_reader))
+        DatasetUtils.query(
+            _dataset(root),
+            "select day, hour, count(*) as num_rows from events where day = '2023-06-02' and hour = 1 group by all",
+        )
+
+        assert [json.loads(line) for line in capsys.readouterr().out.splitlines()] == [
+            {"day": "2023-06-02", "hour": 1, "num_rows": 20},
+        ]
+        if file_format == "avro":
+            assert sorted(opened) == [root / "day=2023-06-02" / "hour=1" / f"part-{i}.avro" for i in range(2)]
+
+
+def test_query_scans_dataset_twice(capsys):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        root = Path(tmpdir) / "events"
+        _write_partitions(root, "avro")
+
+        DatasetUtils.query(
+            _dataset(root),
+            "select count(*) as num_rows, (select count(distinct day) from events) as num_days "
+            "from events a join events b using (id, day, hour) where a.day = '2023-06-01'",
+            jobs=2,
+        )
+
+        # Each of the 40 records of a day matches the 2 records (one per file) with its id and partition
+        assert [json.loads(line) for line in capsys.readouterr().out.splitlines()] == [
+            {"num_rows": 80, "num_days": 2},
+        ]
+
+
+def test_columns(capsys):
+    for file_format in ("avro", "parquet"):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            root = Path(tmpdir) / "events"
+            _write_partitions(root, file_format)
+            dataset = _dataset(root)
+
+            table = DatasetUtils.head(dataset, 3, columns=["hour", "name"])
+            assert table.schema.names == ["hour", "name"]
+            assert table.to_pylist()[0] == {"hour": 0, "name": "2023-06-01/0/0"}
+            capsys.readouterr()
+
+            DatasetUtils.query(dataset, "select * from events where id = 3 limit 1", columns=["id", "day"])
+            assert [json.loads(line) for line in capsys.readouterr().out.splitlines()] == [
+                {"id": 3, "day": "2023-06-01"},
+            ]
+
+
+def test_convert(capsys):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        root = Path(tmpdir) / "events"
+        _write_partitions(root, "avro")
+        output_path = Path(tmpdir) / "events.parquet"
+
+        assert DatasetUtils.convert(_dataset(root), output_path, ParquetUtils) == 80
+        table = pq.read_table(output_path)
+        assert table.schema.names == ["id", "name", "day", "hour"]
+        assert table.slice(0, 1).to_pylist() == [{"id": 0, "name": "2023-06-01/0/0", "day": "2023-06-01", "hour": 0}]
+
+
+def test_approx_stats():
+    for file_format in ("avro", "parquet"):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            root = Path(tmpdir) / "events"
+            _write_partitions(root, file_format)
+
+            num_rows, column_stats = DatasetUtils.stats(_dataset(root), jobs=2, approx=True)
+
+            assert num_rows == 80
+            # Sketches of the 8 files are merged
+            assert column_stats["id"]["p50"] in (4, 5)
+            assert column_stats["id"]["p99"] == 9
+            assert sorted(column_stats["id"]["top_k"]) == [(i, 8) for i in range(10)]
+
+
+def test_sample(capsys):
+    for file_format in ("avro", "parquet"):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            root = Path(tmpdir) / "events"
+            _write_partitions(root, file_format)
+            dataset = _dataset(root)
+            table = DatasetUtils.head(dataset, 80)
+            capsys.readouterr()
+
+            result = DatasetUtils.sample(dataset, 12, seed=3, columns=["day", "name"])
+            assert result.schema.names == ["day", "name"]
+            expected = table.take(sample_positions(80, 12, seed=3)).select(["day", "name"])
+            assert result.to_pylist() == expected.to_pylist()
+            assert len(capsys.readouterr().out.splitlines()) == 12
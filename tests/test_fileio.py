@@ -0,0 +1,56 @@
+import mmap
+import tempfile
+from pathlib import Path
+
+import pyarrow as pa
+
+from data_tools.utils.avro import AvroUtils
+from data_tools.utils.csv import CsvUtils
+from data_tools.utils.fileio import MMAP_ENV, open_arrow_input, open_input, read_at
+
+TEST_DATA_DIR = Path(__file__).resolve().parent
+
+
+def test_open_input(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "data.bin"
+        file_path.write_bytes(b"first\nsecond\n")
+        with open_input(file_path) as f:
+            assert isinstance(f, mmap.mmap)
+            assert f.readline() == b"first\n"
+            f.seek(8)
+            assert f.read(3) == b"con"
+            assert read_at(f, 6, 6) == b"second"
+            assert f.tell() == 11
+        with open_arrow_input(file_path) as f:
+            assert isinstance(f, pa.MemoryMappedFile)
+
+        # Empty files cannot be mapped
+        empty_path = Path(tmpdir) / "empty.bin"
+        empty_path.touch()
+        with open_input(empty_path) as f:
+            assert not isinstance(f, mmap.mmap)
+            assert f.read() == b""
+
+        monkeypatch.setenv(MMAP_ENV, "0")
+        with open_input(file_path) as f:
+            assert not isinstance(f, mmap.mmap)
+            assert f.readline() == b"first\n"
+            assert read_at(f, 6, 6) == b"second"
+            assert f.tell() == 6
+        with open_arrow_input(file_path) as f:
+            assert not isinstance(f, pa.MemoryMappedFile)
+
+
+def test_buffered_and_mapped_reads_match(monkeypatch):
+    file_path = TEST_DATA_DIR / "data" / "avro" / "weather.avro"
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_path = Path(tmpdir) / "data.csv"
+        csv_path.write_text("id,name\n" + "".join(f"{i},name-{i}\n" for i in range(100)))
+
+        mapped = (AvroUtils.tail(file_path, 3, cache=False), AvroUtils.stats(file_path, jobs=2, cache=False),
+                  CsvUtils.tail(csv_path, 3))
+        monkeypatch.setenv(MMAP_ENV, "0")
+        buffered = (AvroUtils.tail(file_path, 3, cache=False), AvroUtils.stats(file_path, jobs=2, cache=False),
+                    CsvUtils.tail(csv_path, 3))
+        assert mapped == buffered
@@ -0,0 +1,77 @@
+import json
+import tempfile
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.json as pa_json
+
+from data_tools.utils import text
+from data_tools.utils.json import JsonUtils
+
+
+def _write_json_lines(file_path: Path, num_rows: int = 1000) -> pa.Table:
+    records = [
+        {"id": i, "name": f"name-{i}", "address": {"city": f"city-{i % 7}"}}
+        for i in range(num_rows)
+    ]
+    with open(file_path, "w") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+    return pa.Table.from_pylist(records)
+
+
+def test_head():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.jsonl"
+        table = _write_json_lines(file_path)
+
+        assert JsonUtils.head(file_path, 5).equals(table.slice(0, 5))
+
+
+def test_tail():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.jsonl"
+        table = _write_json_lines(file_path)
+
+        assert JsonUtils.tail(file_path, 5).equals(table.slice(995))
+        assert JsonUtils.tail(file_path, 5000).equals(table)
+
+
+def test_reader_without_open_json(monkeypatch):
+    # pyarrow 13 has no streaming JSON reader
+    monkeypatch.delattr(pa_json, "open_json", raising=False)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.jsonl"
+        table = _write_json_lines(file_path)
+
+        assert JsonUtils.to_record_batch_reader(file_path).read_all().equals(table)
+        assert JsonUtils.head(file_path, 5).equals(table.slice(0, 5))
+
+
+def test_parallel_reader(monkeypatch):
+    monkeypatch.setattr(text, "MIN_RANGE_SIZE", 1024)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.jsonl"
+        table = _write_json_lines(file_path, 10000)
+
+        assert JsonUtils.to_record_batch_reader(file_path, jobs=2).read_all().equals(table)
+
+
+def test_stats():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.jsonl"
+        _write_json_lines(file_path)
+
+        num_rows, column_stats = JsonUtils.stats(file_path, jobs=2)
+
+        assert num_rows == 1000
+        assert column_stats["id"]["max"] == 999
+        assert column_stats["address.city"]["min"] == "city-0"
+
+
+def test_schema():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.jsonl"
+        table = _write_json_lines(file_path)
+
+        assert JsonUtils.schema(file_path) == table.schema
@@ -1,5 +1,102 @@
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
 
-def test_subparsers():
-    pass
+import fastavro
+import pytest
 
+from data_tools.main import get_file_format, get_utils_class
+from data_tools.utils import decoded_files
 
+TEST_DATA_DIR = Path(__file__).resolve().parent
+
+HEAVY_MODULES = ("duckdb", "numpy", "pyarrow")
+# Cumulative import time budget of data_tools.main, in microseconds
+IMPORT_TIME_BUDGET_US = 100_000
+
+
+def _run_python(*args: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *args], capture_output=True, text=True, check=True)
+
+
+def test_get_utils_class():
+    assert get_utils_class(get_file_format(Path("weather.avro"))).__name__ == "AvroUtils"
+    assert get_utils_class(get_file_format(Path("weather.parquet"))).__name__ == "ParquetUtils"
+    assert get_utils_class(get_file_format(Path("weather.csv"))).__name__ == "CsvUtils"
+    assert get_utils_class(get_file_format(Path("weather.jsonl"))).__name__ == "JsonUtils"
+    with pytest.raises(ValueError):
+        get_file_format(Path("weather.txt"))
+
+
+def test_meta_does_not_import_heavy_backends():
+    file_path = TEST_DATA_DIR / "data" / "avro" / "weather.avro"
+    script = (
+        "import sys\n"
+        "from data_tools.main import main\n"
+        f"sys.argv = ['data-tools', 'meta', {str(file_path)!r}]\n"
+        "main()\n"
+        f"print(sorted(name for name in {HEAVY_MODULES!r} if name in sys.modules))\n"
+    )
+    result = _run_python("-c", script)
+
+    assert result.stdout.splitlines()[-1] == "[]"
+
+
+def test_cold_start_import_time():
+    result = _run_python("-X", "importtime", "-c", "import data_tools.main")
+
+    imported = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        _, cumulative_us, name = line.split("|")
+        if cumulative_us.strip().isdigit():
+            imported[name.strip()] = int(cumulative_us)
+    assert not set(HEAVY_MODULES) & set(imported)
+    assert imported["data_tools.main"] < IMPORT_TIME_BUDGET_US
+
+
+def test_profile():
+    file_path = TEST_DATA_DIR / "data" / "avro" / "weather.avro"
+    result = _run_python("-m", "data_tools.main", "--profile", "stats", str(file_path), "--no-cache")
+    report = json.loads(result.stderr.splitlines()[-1])
+
+    assert report["command"] == "stats"
+    assert {"stats", "decode", "decompress", "arrow", "aggregate"} <= set(report["spans"])
+    assert report["counters"]["rows_decoded"] == 5
+    assert report["counters"]["blocks_decoded"] >= 1
+    assert report["counters"]["bytes_read"] > 0
+    assert report["peak_rss_bytes"] > 0
+    # Spans measure self time, they add up to at most the wall time
+    assert sum(span["seconds"] for span in report["spans"].values()) <= report["wall_seconds"]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_path = Path(tmpdir) / "profile.jsonl"
+        for _ in range(2):
+            _run_python("-m", "data_tools.main", "--profile", "--profile-output", str(output_path),
+                        "query", str(file_path), "select count(*) from 'weather.avro'", "--no-server")
+        reports = [json.loads(line) for line in output_path.read_text().splitlines()]
+    assert [report["command"] for report in reports] == ["query", "query"]
+    assert {"register", "duckdb", "print"} <= set(reports[0]["spans"])
+    assert reports[0]["counters"]["rows_output"] == 1
+
+
+# Older DuckDB and pyarrow versions decode every file of a table before scanning it, see decoded_files
+@pytest.mark.skipif(not decoded_files._scans_streams(), reason="decoded files are not scanned as streams")
+def test_query_limit_stops_decoding():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "numbers.avro"
+        schema = fastavro.parse_schema({"type": "record", "name": "Number", "fields": [{"name": "n", "type": "long"}]})
+        with open(file_path, "wb") as f:
+            fastavro.writer(f, schema, ({"n": n} for n in range(600_000)), sync_interval=16000)
+        with open(file_path, "rb") as f:
+            num_blocks = sum(1 for _ in fastavro.block_reader(f))
+
+        # The process must also exit cleanly while DuckDB still holds the stream it stopped scanning
+        result = _run_python("-m", "data_tools.main", "--profile", "query", str(file_path),
+                             "select * from 'numbers.avro' limit 1", "--no-server")
+    report = json.loads(result.stderr.splitlines()[-1])
+
+    assert result.stdout.splitlines() == ['{"n": 0}']
+    assert report["counters"]["blocks_decoded"] < num_blocks / 2
@@ -1,6 +1,12 @@
 import os
 import tempfile
 from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from data_tools.utils.fileio import PREFETCH_ENV
 from data_tools.utils.parquet import ParquetUtils
 
 TEST_DATA_DIR = Path(__file__).resolve().parent
@@ -39,6 +45,21 @@ def test_create_sample():
         assert os.path.getsize(file_path) > 0
 
 
+def test_create_columnar_sample():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.parquet"
+        schema_path = TEST_DATA_DIR / "sample_schema.avsc"
+        ParquetUtils.create_sample(file_path, schema_path, 2500, "zstd", seed=1, columnar=True, chunk_size=1000)
+
+        parquet_file = pq.ParquetFile(file_path)
+        assert parquet_file.metadata.num_rows == 2500
+        assert parquet_file.metadata.num_row_groups == 3
+        assert parquet_file.schema_arrow.field("address").type == pa.struct(
+            [("street", pa.string()), ("city", pa.string()), ("zip", pa.string())]
+        )
+        assert parquet_file.schema_arrow.metadata[b"Name"] == b"Dummy data"
+
+
 def test_snappy_meta():
     pass
 
@@ -52,21 +73,162 @@ def test_meta():
 
 
 def test_stats():
-    pass
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.parquet"
+        table = _write_row_groups(file_path)
+
+        num_rows, column_stats = ParquetUtils.stats(file_path)
+
+        assert num_rows == 1000
+        # min/max are merged across all row groups
+        assert column_stats["id"] == {"count": 1000, "null_count": 0, "min": 0, "max": 999, "source": "footer"}
+        assert column_stats["name"]["min"] == min(table.column("name").to_pylist())
+        assert column_stats["name"]["max"] == max(table.column("name").to_pylist())
+
+
+def test_stats_without_footer_statistics():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.parquet"
+        table = pa.table({
+            "id": [3, None, 1, 7],
+            "address": [{"city": "b"}, {"city": "a"}, None, {"city": "c"}],
+            "phone_numbers": [["5", "3"], [], None, ["9"]],
+        })
+        pq.write_table(table, file_path, row_group_size=2, write_statistics=["id"])
+
+        num_rows, column_stats = ParquetUtils.stats(file_path, jobs=2)
+
+        assert num_rows == 4
+        assert column_stats["id"] == {"count": 4, "null_count": 1, "min": 1, "max": 7, "source": "footer"}
+        assert column_stats["address.city"]["source"] == "decoded"
+        assert column_stats["address.city"]["min"] == "a"
+        assert column_stats["address.city"]["max"] == "c"
+        assert column_stats["address.city"]["null_count"] == 1
+        phone_numbers = column_stats["phone_numbers.list.element"]
+        assert (phone_numbers["source"], phone_numbers["min"], phone_numbers["max"]) == ("decoded", "3", "9")
+
+
+def _write_row_groups(file_path: Path, num_rows: int = 1000, row_group_size: int = 100) -> pa.Table:
+    table = pa.table({"id": list(range(num_rows)), "name": [f"name-{i}" for i in range(num_rows)]})
+    pq.write_table(table, file_path, row_group_size=row_group_size)
+    return table
 
 
 def test_head():
-    pass
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.parquet"
+        table = _write_row_groups(file_path)
+
+        metadata = pq.ParquetFile(file_path).metadata
+        assert ParquetUtils._covering_row_groups(metadata, 20) == [0]
+        assert ParquetUtils._covering_row_groups(metadata, 150) == [0, 1]
+
+        assert ParquetUtils.head(file_path, 20).equals(table.slice(0, 20))
+        assert ParquetUtils.head(file_path, 150).equals(table.slice(0, 150))
+        assert ParquetUtils.head(file_path, 5000).equals(table)
 
 
 def test_tail():
-    pass
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.parquet"
+        table = _write_row_groups(file_path)
+
+        metadata = pq.ParquetFile(file_path).metadata
+        assert ParquetUtils._covering_row_groups(metadata, 20, from_end=True) == [9]
+        assert ParquetUtils._covering_row_groups(metadata, 150, from_end=True) == [8, 9]
+
+        assert ParquetUtils.tail(file_path, 20).equals(table.slice(980))
+        assert ParquetUtils.tail(file_path, 150).equals(table.slice(850))
+        assert ParquetUtils.tail(file_path, 5000).equals(table)
+
+
+def test_sample():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.parquet"
+        table = _write_row_groups(file_path)
+
+        result = ParquetUtils.sample(file_path, 30, seed=1)
+        ids = result.column("id").to_pylist()
+        assert len(set(ids)) == 30
+        assert ids == sorted(ids)
+        assert result.equals(table.take(ids))
+        assert ParquetUtils.sample(file_path, 30, seed=1).equals(result)
+
+        assert ParquetUtils.sample(file_path, 5000, seed=1).equals(table)
+        assert ParquetUtils.sample(file_path, 0).num_rows == 0
+
+
+def test_prefetch(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.parquet"
+        table = _write_row_groups(file_path)
+
+        for depth in ("0", "1", "4"):
+            monkeypatch.setenv(PREFETCH_ENV, depth)
+            batches = list(ParquetUtils.to_record_batch_reader(file_path, batch_size=64))
+            assert max(batch.num_rows for batch in batches) <= 64
+            assert pa.Table.from_batches(batches).equals(table)
+            projected = ParquetUtils.to_record_batch_reader(file_path, columns=["id"]).read_all()
+            assert projected.equals(table.select(["id"]))
+
+
+def test_count():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.parquet"
+        _write_row_groups(file_path)
+
+        assert ParquetUtils.count(file_path) == 1000
 
 
 def test_schema():
     pass
 
 
-def test_query():
-    pass
+def test_query(capsys):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.parquet"
+        _write_row_groups(file_path)
+
+        ParquetUtils.query(file_path, "select id, name from 'sample.parquet' where id between 500 and 501")
 
+        assert capsys.readouterr().out.splitlines() == [
+            '{"id": 500, "name": "name-500"}',
+            '{"id": 501, "name": "name-501"}',
+        ]
+
+
+def test_columns(capsys):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.parquet"
+        table = _write_row_groups(file_path)
+
+        assert ParquetUtils.head(file_path, 20, columns=["name"]).equals(table.select(["name"]).slice(0, 20))
+        assert ParquetUtils.tail(file_path, 20, columns=["name"]).equals(table.select(["name"]).slice(980))
+        num_rows, column_stats = ParquetUtils.stats(file_path, columns=["id"])
+        assert num_rows == 1000
+        assert list(column_stats) == ["id"]
+        capsys.readouterr()
+
+        ParquetUtils.query(file_path, "select * from 'sample.parquet' where id = 7", columns=["id"])
+        assert capsys.readouterr().out.splitlines() == ['{"id": 7}']
+
+        with pytest.raises(ValueError, match="Unknown columns: size"):
+            ParquetUtils.head(file_path, columns=["size"])
+
+
+def test_approx_stats():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "sample.parquet"
+        table = pa.table({"value": [i % 100 for i in range(10000)], "label": [f"l{i % 7}" for i in range(10000)]})
+        pq.write_table(table, file_path, row_group_size=1000)
+
+        num_rows, column_stats = ParquetUtils.stats(file_path, jobs=2, approx=True)
+
+        assert num_rows == 10000
+        assert column_stats["value"]["count"] == 10000
+        assert abs(column_stats["value"]["p50"] - 50) <= 2
+        assert abs(column_stats["value"]["p99"] - 99) <= 2
+        assert abs(column_stats["value"]["distinct"] - 100) <= 2
+        assert sorted(column_stats["label"]["top_k"]) == [(f"l{i}", 1429 if i < 4 else 1428) for i in range(7)]
+        # The exact statistics are cached apart
+        assert ParquetUtils.stats(file_path)[1]["value"]["source"] == "footer"
@@ -0,0 +1,32 @@
+import time
+
+from data_tools.utils import profile
+
+
+def test_spans_measure_self_time(monkeypatch):
+    profiler = profile.Profiler()
+    monkeypatch.setattr(profile, "_profiler", profiler)
+
+    def produce():
+        for i in range(3):
+            time.sleep(0.01)
+            yield i
+
+    with profile.span("outer"):
+        time.sleep(0.02)
+        assert list(profile.timed_iter("inner", produce())) == [0, 1, 2]
+        profile.count("items", 3)
+
+    report = profiler.report()
+    assert report["spans"]["inner"]["calls"] == 4
+    assert 0.03 <= report["spans"]["inner"]["seconds"] < 0.06
+    assert 0.02 <= report["spans"]["outer"]["seconds"] < 0.05
+    assert report["counters"] == {"items": 3}
+
+
+def test_disabled():
+    assert not profile.enabled()
+    iterator = iter([1, 2])
+    assert profile.timed_iter("inner", iterator) is iterator
+    with profile.span("outer"):
+        profile.count("items")
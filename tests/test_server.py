@@ -0,0 +1,81 @@
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+
+from data_tools.utils.avro import AvroUtils
+from data_tools.utils.server import SOCKET_ENV, QueryServer, query_server
+
+TEST_DATA_DIR = Path(__file__).resolve().parent
+
+QUERY = "select station, max(temp) as temp from 'weather.avro' group by station order by station"
+
+
+def _query(server: QueryServer, file_path: Path, query_expression: str, output_format: str = "jsonl") -> str:
+    stream = io.BytesIO()
+    server.query(file_path, query_expression, output_format, stream)
+    return stream.getvalue().decode()
+
+
+def test_query_server(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = Path(tmpdir) / "weather.avro"
+        shutil.copy(TEST_DATA_DIR / "data" / "avro" / "weather.avro", file_path)
+
+        registered = []
+        register = AvroUtils.register_persistent_table.__func__
+
+        def register_persistent_table(cls, con, path, jobs=None, columns=None):
+            registered.append(path)
+            register(cls, con, path, jobs, columns)
+
+        monkeypatch.setattr(AvroUtils, "register_persistent_table", classmethod(register_persistent_table))
+        server = QueryServer(result_cache_size=1)
+
+        expected = '{"station": "011990-99999", "temp": 22}\n{"station": "012650-99999", "temp": 111}\n'
+        assert _query(server, file_path, QUERY) == expected
+        assert _query(server, file_path, "select count(*) as n from 'weather.avro'") == '{"n": 5}\n'
+        # The table is registered once, only the last result is kept
+        assert len(registered) == 1
+        assert list(server.results) == [(str(file_path), None, "select count(*) as n from 'weather.avro'", "jsonl")]
+        assert _query(server, file_path, "select count(*) as n from 'weather.avro'") == '{"n": 5}\n'
+
+        # Rewriting the file drops its table and the cached results
+        AvroUtils.write_arrow_table(AvroUtils.to_arrow_table(file_path).slice(0, 2), file_path)
+        os.utime(file_path, ns=(time.time_ns(), time.time_ns() + 1_000_000_000))
+        assert _query(server, file_path, "select count(*) as n from 'weather.avro'") == '{"n": 2}\n'
+        assert len(registered) == 2
+
+
+def test_serve(capsys):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        socket_file = Path(tmpdir) / "server.sock"
+        file_path = TEST_DATA_DIR / "data" / "avro" / "weather.avro"
+        assert not query_server(file_path, QUERY, socket_file=socket_file)
+
+        env = {**os.environ, SOCKET_ENV: str(socket_file)}
+        server = subprocess.Popen([sys.executable, "-m", "data_tools.main", "serve"], env=env,
+                                  stderr=subprocess.PIPE)
+        try:
+            for _ in range(100):
+                if socket_file.exists():
+                    break
+                time.sleep(0.1)
+
+            assert query_server(file_path, QUERY, socket_file=socket_file)
+            assert capsys.readouterr().out.splitlines() == [
+                '{"station": "011990-99999", "temp": 22}',
+                '{"station": "012650-99999", "temp": 111}',
+            ]
+            with pytest.raises(ValueError, match="bogus"):
+                query_server(file_path, "select bogus from 'weather.avro'", socket_file=socket_file)
+        finally:
+            server.terminate()
+            server.wait(10)
+        assert not socket_file.exists()
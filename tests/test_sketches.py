@@ -0,0 +1,83 @@
+import collections
+import datetime
+import pickle
+
+import numpy as np
+import pyarrow as pa
+
+from data_tools.utils.sketches import HeavyHitters, HyperLogLog, QuantileSketch, hash_array
+
+
+def _rank_error(values: np.ndarray, q: float, estimate: float) -> float:
+    return abs(np.searchsorted(np.sort(values), estimate, side="right") / len(values) - q)
+
+
+def test_hash_array():
+    arrays = [
+        pa.array([datetime.date(2020, 1, 1), datetime.date(2020, 1, 2), None, datetime.date(2020, 1, 1)]),
+        pa.array([datetime.time(1, 2, 3), datetime.time(4, 5, 6), None, datetime.time(1, 2, 3)], pa.time32("ms")),
+        pa.array([2 ** 64 - 1, 2 ** 63, None, 2 ** 64 - 1], pa.uint64()),
+    ]
+    for array in arrays:
+        hashes = hash_array(array)
+        assert hashes.dtype == np.uint64
+        assert len(hashes) == 3
+        assert hashes[0] == hashes[2] != hashes[1]
+
+    # Equal integers hash alike whatever their width
+    assert hash_array(pa.array([5], pa.uint64())) == hash_array(pa.array([5], pa.int8()))
+
+
+def test_hyperloglog():
+    rng = np.random.default_rng(0)
+    values = rng.integers(0, 10 ** 12, 200_000)
+    left, right = HyperLogLog(), HyperLogLog()
+    left.update(pa.array(values[:120_000]))
+    right.update(pa.array(values[80_000:]))
+    left.merge(right)
+
+    # The standard error is 1.04 / sqrt(2 ** 14), below 1%
+    assert abs(left.estimate() / len(np.unique(values)) - 1) < 0.03
+
+
+def test_quantile_sketch():
+    rng = np.random.default_rng(0)
+    values = np.concatenate([rng.normal(size=300_000), rng.exponential(5, size=300_000)])
+    sketches = []
+    for chunk in np.array_split(values, 12):
+        sketch = QuantileSketch(seed=len(sketches))
+        for batch in np.array_split(chunk, 5):
+            sketch.update(batch)
+        sketches.append(sketch)
+    merged = sketches[0]
+    for sketch in sketches[1:]:
+        merged.merge(pickle.loads(pickle.dumps(sketch)))
+
+    assert merged.count == len(values)
+    qs = [0.01, 0.5, 0.95, 0.99]
+    for q, estimate in zip(qs, merged.quantiles(qs)):
+        assert _rank_error(values, q, estimate) < 0.01
+    # Memory does not grow with the number of values
+    assert sum(len(level) for level in merged.levels) <= 3 * merged.k
+    assert QuantileSketch().quantiles([0.5]) == [None]
+
+
+def test_heavy_hitters():
+    rng = np.random.default_rng(0)
+    values = rng.zipf(1.3, 500_000) % 10_000
+    summaries = []
+    for chunk in np.array_split(values, 10):
+        summary = HeavyHitters(capacity=64)
+        for batch in np.array_split(chunk, 4):
+            summary.update(pa.array(batch))
+        summaries.append(summary)
+    merged = summaries[0]
+    for summary in summaries[1:]:
+        merged.merge(summary)
+
+    exact = collections.Counter(values.tolist())
+    max_error = len(values) / (merged.capacity + 1)
+    assert len(merged.counters) <= merged.capacity
+    for value, count in merged.top(10):
+        assert exact[value] - max_error <= count <= exact[value]
+    assert [value for value, _ in merged.top(3)] == [value for value, _ in exact.most_common(3)]